@@ -0,0 +1,24 @@
+
+from pizza_bot.interface import Dialog, TransactionManager
+
+
+class NullDialog(Dialog):
+    """Dialog feeding preset input and dropping outgoing messages"""
+    def __init__(self):
+        super(NullDialog, self).__init__()
+        self.input = None
+        self.sent = 0
+
+    def reset_input(self):
+        self.input = None
+
+    def get_input(self):
+        return self.input
+
+    def send_message(self, message):
+        self.sent += 1
+
+
+class NullTransactionManager(TransactionManager):
+    def create_order(self, dialog, order):
+        pass
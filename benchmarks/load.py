@@ -0,0 +1,177 @@
+"""
+Load test of the webhook pipeline against local fake Bot API.
+
+Each of N chats sends its next message once the reply to the previous one
+is delivered to FakeBotApi. Updates are decoded by decode_update and go
+through dispatch_update to the engine made by create_sharded_engine, the one
+the bot runs: sharded message_handler, TelegramDialog and PizzaBot, replies
+queued in outbox and sent over HTTP by its sender threads, paced by rate
+limiter. Latency is taken from update sent to its reply received by the API.
+
+With --mode polling updates are queued in FakeBotApi instead, fetched by
+LongPoller and handled in batches by dispatch_batch.
+
+Replies are not limited to Telegram rates unless --global-rate and
+--chat-rate say so. PizzaBot sends one reply per update, first update of
+chat is answered by greeting as well.
+
+Usage: python -m benchmarks.load [--chats N] [--messages M] [--shards S] [--senders K] [--mode webhook|polling]
+                                 [--global-rate R] [--chat-rate R]
+"""
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+
+import telegram
+
+from pizza_bot.fake_telegram import FakeBotApi
+from pizza_bot.polling import LongPoller
+from pizza_bot.ratelimit import RateLimiter
+from pizza_bot.updates import decode_update
+from telegram_bot import TOKEN, create_sharded_engine, dispatch_batch, dispatch_update
+
+SCRIPT = ('привет', 'большую', 'картой', 'да', 'ой', 'маленькую', 'наличкой', 'нет')
+
+
+def make_update_data(update_id, chat_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Load'},
+            'text': text,
+        },
+    }
+
+
+def make_update(bot, update_id, chat_id, text):
+    """Update as it is decoded from webhook request"""
+    body = json.dumps(make_update_data(update_id, chat_id, text), ensure_ascii=False).encode('utf-8')
+    return decode_update(body, bot)
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class DeliveryBotApi(FakeBotApi):
+    """FakeBotApi calling `delivered(chat_id)` for every message sent"""
+    def __init__(self, delivered, **kwargs):
+        super(DeliveryBotApi, self).__init__(**kwargs)
+        self.delivered = delivered
+
+    def send_message(self, chat_id, text):
+        message = super(DeliveryBotApi, self).send_message(chat_id, text)
+        self.delivered(chat_id)
+        return message
+
+
+class ClosedLoop(object):
+    """
+    Feeds chat its next update once reply to the previous one is delivered,
+    latency is taken from update sent to reply delivered. Polling mode sends
+    updates through FakeBotApi.
+    """
+    def __init__(self, chats, messages, polling=False):
+        self.bot = None
+        self.api = None
+        self.executor = None
+        self.polling = polling
+        self.messages = messages
+        self.left = chats
+        self.latencies = []
+        self.indexes = dict()  # chat_id -> index of message in flight
+        self.started = dict()  # chat_id -> time message in flight was sent
+        self.replies = dict()  # chat_id -> replies to message in flight not delivered yet
+        self.update_ids = itertools.count(1)
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+
+    def start(self, chat_id):
+        self.dispatch(chat_id, 0)
+
+    def dispatch(self, chat_id, index):
+        update_id, text = next(self.update_ids), SCRIPT[index % len(SCRIPT)]
+        self.indexes[chat_id] = index
+        self.replies[chat_id] = 1 if index else 2
+        self.started[chat_id] = time.perf_counter()
+        if self.polling:
+            self.api.push_update(make_update_data(update_id, chat_id, text))
+        else:
+            dispatch_update(self.executor, self.bot, make_update(self.bot, update_id, chat_id, text))
+
+    def delivered(self, chat_id):
+        """Reply to message in flight reached Bot API, called by its request thread"""
+        self.replies[chat_id] -= 1
+        if self.replies[chat_id]:
+            return
+        latency = time.perf_counter() - self.started[chat_id]
+        index = self.indexes[chat_id]
+        with self.lock:
+            self.latencies.append(latency)
+        if index + 1 < self.messages:
+            self.dispatch(chat_id, index + 1)
+        else:
+            with self.lock:
+                self.left -= 1
+                if not self.left:
+                    self.done.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--chats', type=int, default=100)
+    parser.add_argument('--messages', type=int, default=40, help='messages sent by each chat')
+    parser.add_argument('--shards', type=int, default=os.cpu_count())
+    parser.add_argument('--senders', type=int, default=8, help='outbox sender threads')
+    parser.add_argument('--mode', choices=('webhook', 'polling'), default='webhook')
+    parser.add_argument('--global-rate', type=float, default=1e6, help='replies per second overall')
+    parser.add_argument('--chat-rate', type=float, default=1e6, help='replies per second to one chat')
+    args = parser.parse_args()
+
+    loop = ClosedLoop(args.chats, args.messages, polling=args.mode == 'polling')
+    api = loop.api = DeliveryBotApi(loop.delivered).start()
+    # Decodes and polls updates, replies are sent by the engine
+    bot = loop.bot = telegram.Bot(TOKEN, base_url=api.url)
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ.update(
+            ORDERS_JOURNAL=os.path.join(directory, 'orders.jsonl'), SHARDS=str(args.shards), SENDERS=str(args.senders))
+        limiter = RateLimiter(global_rate=args.global_rate, chat_rate=args.chat_rate)
+        executor, registries, shutdown = create_sharded_engine(api.url, limiter)
+        loop.executor = executor
+
+        poller = None
+        if args.mode == 'polling':
+            poller = LongPoller(bot, lambda updates: dispatch_batch(executor, updates), timeout=1)
+            threading.Thread(target=poller.run, daemon=True).start()
+
+        started = time.perf_counter()
+        for chat_id in range(1, args.chats + 1):
+            loop.start(chat_id)
+        loop.done.wait()
+        elapsed = time.perf_counter() - started
+
+        if poller is not None:
+            poller.stop()
+        shutdown()
+    api.stop()
+
+    latencies = sorted(loop.latencies)
+    print('{} mode, chats {}, updates {}, sendMessage calls {}, shards {}, senders {}'.format(
+        args.mode, args.chats, len(latencies), len(api.sent), args.shards, args.senders))
+    print('{:.0f} updates/s in {:.2f}s'.format(len(latencies) / elapsed, elapsed))
+    print('update to delivery p50 {:.2f}ms, p95 {:.2f}ms, p99 {:.2f}ms, max {:.2f}ms'.format(
+        *(value * 1e3 for value in (
+            percentile(latencies, 0.5), percentile(latencies, 0.95),
+            percentile(latencies, 0.99), latencies[-1]))))
+
+
+if __name__ == '__main__':
+    main()
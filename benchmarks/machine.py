@@ -0,0 +1,70 @@
+"""
+Compare dialog start and reset cost of per-dialog transitions.Machine
+against the shared compiled machine.
+
+Usage: python -m benchmarks.machine [--number N] [--repeat R]
+"""
+import argparse
+import timeit
+
+from pizza_bot.bot import PizzaBot
+from benchmarks.common import NullDialog, NullTransactionManager
+
+
+def bench_start(shared_machine, number, repeat):
+    """Start dialogs for fresh chats"""
+    bot = PizzaBot(NullTransactionManager(), shared_machine=shared_machine)
+    dialogs = [NullDialog() for _ in range(number)]
+
+    def run():
+        bot.dialogs.clear()
+        for dialog in dialogs:
+            bot.start_dialog(dialog)
+
+    return min(timeit.repeat(run, number=1, repeat=repeat)) / number
+
+
+def bench_reset(shared_machine, number, repeat):
+    """Restart dialog of a chat, as done after each completed order"""
+    bot = PizzaBot(NullTransactionManager(), shared_machine=shared_machine)
+    dialog = NullDialog()
+    bot.start_dialog(dialog)
+    timer = timeit.Timer(lambda: bot.start_dialog(dialog))
+    return min(timer.repeat(number=number, repeat=repeat)) / number
+
+
+def bench_order(shared_machine, number, repeat):
+    """Complete order: size, payment, confirmation and restart"""
+    bot = PizzaBot(NullTransactionManager(), shared_machine=shared_machine)
+    dialog = NullDialog()
+    bot.on_chat_start(dialog)
+
+    def run():
+        for text in ('большую', 'картой', 'да'):
+            dialog.input = text
+            bot.on_chat_input(dialog)
+
+    return min(timeit.repeat(run, number=number, repeat=repeat)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    benches = [
+        ('start_dialog (new chat)', bench_start),
+        ('start_dialog (reset)', bench_reset),
+        ('full order', bench_order),
+    ]
+    print('{:<26}{:>14}{:>14}{:>10}'.format('', 'per-dialog', 'shared', 'speedup'))
+    for title, bench in benches:
+        legacy = bench(False, args.number, args.repeat)
+        shared = bench(True, args.number, args.repeat)
+        print('{:<26}{:>12.2f}us{:>12.2f}us{:>9.1f}x'.format(
+            title, legacy * 1e6, shared * 1e6, legacy / shared))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""
+Microbenchmarks of the conversation engine hot paths with regression gate.
+
+Each benchmark reports best time per call over several rounds, with garbage
+collection off. Rounds run all benchmarks in turn, so a noisy moment hits one
+sample of each rather than all samples of one. Times are also taken relative
+to a fixed pure Python workload measured alongside, which keeps baseline
+comparable when the machine is slower or busier as a whole.
+
+Results are compared against baseline committed in micro_baseline.json,
+exit status is 1 when any benchmark got slower than the threshold or there
+is no baseline to compare against. Run the gate before merging changes to
+the engine, and save new baseline in the same change when it is slower on
+purpose:
+
+    python -m benchmarks.micro                  # gate, compare against baseline
+    python -m benchmarks.micro --threshold P    # gate allowing P percent slowdown
+    python -m benchmarks.micro --save           # record baseline
+
+Times are scaled by calibration, so committed baseline holds on other
+machines as long as the engine and calibration slow down alike.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+from pizza_bot.bot import PizzaBot
+from pizza_bot.flow import Flow, FlowBot
+from pizza_bot.console_chat import ConsoleDialog
+from pizza_bot.interface import Order
+from benchmarks.common import NullDialog, NullTransactionManager
+
+PIZZA_FLOW = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'pizza_bot', 'flows', 'pizza.json')
+BASELINE = os.path.join(os.path.dirname(__file__), 'micro_baseline.json')
+CONVERSATION = ('большую', 'картой', 'да', 'ой', 'маленькую', 'нал', 'нет')
+
+
+def make_bot():
+    return PizzaBot(NullTransactionManager(), shared_machine=True)
+
+
+def bench_start_dialog():
+    bot = make_bot()
+    dialog = NullDialog()
+    return lambda: bot.start_dialog(dialog)
+
+
+def make_run_dialog(state, text):
+    def bench():
+        bot = make_bot()
+        dialog = NullDialog()
+        bot.start_dialog(dialog)
+        order, machine = bot.dialogs[dialog]
+        size, payment = Order.BIG_SIZE, Order.PAY_CARD
+
+        def run():
+            # Restore state the turn starts from, handler moves it on
+            order.state, order.pizza_size, order.payment_method = state, size, payment
+            dialog.input = text
+            bot.run_dialog(dialog)
+        return run
+    return bench
+
+
+def make_get_value(text):
+    def bench():
+        bot = make_bot()
+        dialog = NullDialog()
+        bot.start_dialog(dialog)
+        dialog.input = text
+        return lambda: bot.get_value(dialog)
+    return bench
+
+
+def bench_order_properties():
+    order = Order()
+    order.pizza_size, order.payment_method = Order.BIG_SIZE, Order.PAY_CARD
+    return lambda: (order.size_description, order.payment_description)
+
+
+def bench_console_conversation():
+    bot = make_bot()
+    dialog = ConsoleDialog(bot)
+
+    def run():
+        bot.on_chat_start(dialog)
+        for text in CONVERSATION:
+            dialog.input = text
+            bot.on_chat_input(dialog)
+        bot.on_chat_exit(dialog)
+        dialog.messages.clear()
+    return run
+
+
+def make_flow_conversation(extra_states):
+    def bench():
+        # Loaded from a copy, FlowBot archives versions next to the flow file
+        with tempfile.TemporaryDirectory() as directory:
+            bot = FlowBot(NullTransactionManager(), shutil.copy(PIZZA_FLOW, directory))
+        if extra_states:
+            # States never visited, turn cost must not depend on their number
+            with open(PIZZA_FLOW, encoding='utf-8') as f:
+                definition = json.load(f)
+            for index in range(extra_states):
+                definition['states'].append(dict(
+                    name='extra_{}'.format(index), prompt='pick_size', inputs={'вариант': index % 2},
+                    set='set_pizza_size', next='idle'))
+            bot.flow = Flow(definition)
+        dialog = NullDialog()
+
+        def run():
+            bot.on_chat_start(dialog)
+            for text in CONVERSATION:
+                dialog.input = text
+                bot.on_chat_input(dialog)
+            bot.on_chat_exit(dialog)
+        return run
+    return bench
+
+
+def bench_calibration():
+    """Reference workload, dict and attribute access, calls and string joins"""
+    data = {str(i): i for i in range(16)}
+
+    def run():
+        total = 0
+        for key in data:
+            total += data.get(key, 0)
+        return ', '.join(data.keys()), total
+    return run
+
+
+CALIBRATION = 'calibration'
+BENCHMARKS = [
+    (CALIBRATION, bench_calibration),
+    ('start_dialog', bench_start_dialog),
+    ('run_dialog idle', make_run_dialog('idle', 'большую')),
+    ('run_dialog idle invalid', make_run_dialog('idle', 'ой')),
+    ('run_dialog size_picked', make_run_dialog('size_picked', 'картой')),
+    ('run_dialog payment_picked', make_run_dialog('payment_picked', 'да')),
+    ('get_value exact', make_get_value('маленькую')),
+    ('get_value typo', make_get_value('мленькую')),
+    ('get_value invalid', make_get_value('пожалуй, нет')),
+    ('Order properties', bench_order_properties),
+    ('console conversation', bench_console_conversation),
+    ('flow conversation', make_flow_conversation(0)),
+    ('flow conversation 100 states', make_flow_conversation(100)),
+]
+
+
+def measure(benchmarks, rounds, min_time=0.05):
+    """Best seconds per call of each benchmark, calls per sample picked to last min_time"""
+    timers = dict()
+    for name, bench in benchmarks:
+        timer = timeit.Timer(bench())
+        number, elapsed = timer.autorange()
+        timers[name] = timer, max(1, int(number * min_time / max(elapsed, 1e-9)))
+
+    best = dict()
+    for _ in range(rounds):
+        for name, (timer, number) in timers.items():
+            seconds = timer.timeit(number) / number
+            best[name] = min(best.get(name, seconds), seconds)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--baseline', default=BASELINE, help='baseline file, default %(default)s')
+    parser.add_argument('--save', action='store_true', help='save results as new baseline')
+    parser.add_argument('--threshold', type=float, default=20.0,
+                        help='slowdown in percent treated as regression, default %(default)s')
+    parser.add_argument('--rounds', type=int, default=15)
+    parser.add_argument('--filter', default='', help='run benchmarks with this substring only')
+    args = parser.parse_args()
+
+    baseline = dict()
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    benchmarks = [(name, bench) for name, bench in BENCHMARKS if name == CALIBRATION or args.filter in name]
+    results = measure(benchmarks, args.rounds)
+    # Slowdown of the whole machine since baseline is not a regression
+    scale = 1.0
+    if CALIBRATION in baseline:
+        scale = results[CALIBRATION] / baseline[CALIBRATION]
+
+    regressions = []
+    print('{:<28}{:>12}{:>12}{:>9}'.format('', 'time', 'baseline', 'change'))
+    for name, _ in benchmarks:
+        seconds = results[name]
+        base = baseline.get(name)
+        if base is None:
+            print('{:<28}{:>10.2f}us{:>12}{:>9}'.format(name, seconds * 1e6, '-', '-'))
+            continue
+        if name == CALIBRATION:
+            print('{:<28}{:>10.2f}us{:>10.2f}us{:>+8.1f}%'.format(name, seconds * 1e6, base * 1e6, (scale - 1) * 100))
+            continue
+        base *= scale
+        change = (seconds / base - 1) * 100
+        mark = ''
+        if change > args.threshold:
+            regressions.append(name)
+            mark = '  REGRESSION'
+        print('{:<28}{:>10.2f}us{:>10.2f}us{:>+8.1f}%{}'.format(name, seconds * 1e6, base * 1e6, change, mark))
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print('Baseline saved to {}'.format(args.baseline))
+    elif not baseline:
+        print('No baseline at {}, run with --save to record one'.format(args.baseline))
+        sys.exit(1)
+
+    if regressions and not args.save:
+        print('{} slower than baseline by more than {}%'.format(', '.join(regressions), args.threshold))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Replay of recorded updates through PizzaBot, engine throughput on real traffic.
+
+Recordings are written by the bot when RECORD_FILE is set. Messages are fed
+to PizzaBot in recorded order with replies counted and orders dropped, as
+fast as possible or at recorded pacing with --speed (1 is real time, 10 is
+ten times faster).
+
+Usage:
+    python -m benchmarks.replay RECORDING [--speed X] [--repeat N]
+    python -m benchmarks.replay RECORDING --synthesize CHATS  # write test recording
+"""
+import argparse
+import time
+
+from benchmarks.common import NullTransactionManager
+from pizza_bot.bot import PizzaBot
+from pizza_bot.recording import Recorder, Replayer, read_records
+
+SCRIPT = ('привет', 'большую', 'картой', 'да', 'ой', 'маленькую', 'наличкой', 'нет')
+
+
+def synthesize(path, chats):
+    """Write recording of chats talking in turns, one message per millisecond"""
+    recorder = Recorder(path)
+    started = time.time()
+    for index, text in enumerate(text for text in SCRIPT for _ in range(chats)):
+        recorder.record(index % chats, text, started + index / 1000)
+    recorder.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('recording')
+    parser.add_argument('--speed', type=float, default=None, help='replay at recorded pacing sped up X times')
+    parser.add_argument('--repeat', type=int, default=1, help='replay recording N times, sessions carry over')
+    parser.add_argument('--synthesize', type=int, default=None, metavar='CHATS', help='append test recording of CHATS chats')
+    args = parser.parse_args()
+
+    if args.synthesize is not None:
+        synthesize(args.recording, args.synthesize)
+        return
+
+    replayer = Replayer(PizzaBot(NullTransactionManager(), shared_machine=True), args.speed)
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        replayer.replay(read_records(args.recording))
+    elapsed = time.perf_counter() - started
+
+    replies = sum(dialog.sent for dialog in replayer.dialogs.values())
+    print('{} updates of {} chats in {:.2f}s, {:.0f} updates/s, {} replies'.format(
+        replayer.processed, len(replayer.dialogs), elapsed, replayer.processed / elapsed, replies))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Measure memory held by idle chat sessions with per-dialog transitions.Machine
+and with the shared compiled machine.
+
+Usage: python -m benchmarks.session_memory [--sessions N]
+"""
+import argparse
+import gc
+import sys
+import tracemalloc
+
+from pizza_bot.bot import PizzaBot
+from pizza_bot.telegram_chat import TelegramDialog
+from benchmarks.common import NullTransactionManager
+
+
+def measure(shared_machine, sessions):
+    """Return bytes allocated per session left waiting for payment method"""
+    bot = PizzaBot(NullTransactionManager(), shared_machine=shared_machine)
+    # Compile and warm up everything shared before measuring
+    bot.start_dialog(TelegramDialog(None))
+    bot.dialogs.clear()
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for chat in range(sessions):
+        dialog = TelegramDialog(None)
+        dialog.chat = chat
+        dialog.last_received = float(chat)
+        bot.start_dialog(dialog)
+        order, machine = bot.dialogs[dialog]
+        order.set_size(order.BIG_SIZE)
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, 'filename')
+    return sum(stat.size_diff for stat in stats) / sessions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=10000)
+    args = parser.parse_args()
+
+    legacy = measure(False, args.sessions)
+    shared = measure(True, args.sessions)
+    print('Sessions: {}'.format(args.sessions))
+    print('{:<20}{:>10.0f} bytes/session'.format('per-dialog machine', legacy))
+    print('{:<20}{:>10.0f} bytes/session'.format('shared machine', shared))
+    print('{:<20}{:>10.1f}x'.format('reduction', legacy / shared))
+
+    bot = PizzaBot(NullTransactionManager(), shared_machine=True)
+    dialog = TelegramDialog(None)
+    bot.start_dialog(dialog)
+    order, machine = bot.dialogs[dialog]
+    print()
+    print('Shallow sizes: dialog {}, order {}, dialogs entry {} bytes'.format(
+        sys.getsizeof(dialog), sys.getsizeof(order), sys.getsizeof(bot.dialogs[dialog])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Startup time of entry points with budget gate and import time breakdown.
+
+Each entry point is started by a fresh interpreter several times, median
+wall time is compared against its budget, exit status is 1 when any entry
+point is over budget. Bot modes run their main function the way the bot is
+started, against local FakeBotApi, and are timed until they call Bot API to
+start receiving updates: setWebhook or deleteWebhook before polling. WSGI
+entry point is timed creating application, the way each gunicorn worker
+does. Bare interpreter startup is reported alongside, the difference is what
+our setup costs. Slowest imports are listed from `python -X importtime`,
+cumulative time of each module with its imports, leaving out modules bare
+interpreter imports at startup anyway.
+
+Usage:
+    python -m benchmarks.startup [--runs N] [--top N]
+    python -m benchmarks.startup --budget cli=80 --budget webhook=300
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from pizza_bot.fake_telegram import FakeBotApi
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Entry point: code run by fresh interpreter, Bot API method it is started by,
+# None when it is started once code returns
+ENTRY_POINTS = {
+    'cli': ('import cli', None),
+    'webhook': ('import telegram_bot; telegram_bot.main()', 'setWebhook'),
+    'polling': ('import telegram_bot; telegram_bot.polling_main()', 'deleteWebhook'),
+    'asyncio': ('import telegram_bot; telegram_bot.async_main()', 'setWebhook'),
+    'wsgi': ('import wsgi', None),
+}
+# Milliseconds, medians measured by the build machine with a quarter of headroom:
+# cli 70, webhook 285, polling 190, asyncio 120, wsgi 130
+BUDGETS = {'cli': 90, 'webhook': 350, 'polling': 240, 'asyncio': 150, 'wsgi': 160}
+# Settings of the environment entry points must not pick up
+SETTINGS = ('FLOW_FILE', 'RECORD_FILE', 'TRACE_FILE', 'SESSIONS_SNAPSHOT', 'MAX_SESSIONS', 'LOGLEVEL')
+
+
+class StartBotApi(FakeBotApi):
+    """FakeBotApi telling when entry point called method it is started by"""
+    def __init__(self):
+        super(StartBotApi, self).__init__()
+        self.method = None
+        self.called = threading.Event()
+
+    def expect(self, method):
+        self.method = method
+        self.called = threading.Event()
+
+    def call(self, method, params):
+        if method == self.method:
+            self.called.set()
+        return super(StartBotApi, self).call(method, params)
+
+    def handle_error(self, request, client_address):
+        # Entry points are killed once started, requests of theirs may be cut
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super(StartBotApi, self).handle_error(request, client_address)
+
+
+def entry_point(name):
+    """Code and start method of entry point, other names are modules imported"""
+    return ENTRY_POINTS.get(name, ('import ' + name, None))
+
+
+def run_python(api, environ, code, method=None, *options):
+    """Seconds until interpreter running code exits or calls method, and its stderr"""
+    with tempfile.TemporaryFile() as stderr:
+        api.expect(method)
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable] + list(options) + ['-c', code],
+            cwd=ROOT, env=environ, stdout=subprocess.DEVNULL, stderr=stderr)
+        if method is None:
+            process.wait()
+        else:
+            while not api.called.wait(0.001) and process.poll() is None:
+                pass
+        elapsed = time.perf_counter() - started
+        if method is not None and process.poll() is None:
+            # Started, bot would serve updates from now on
+            process.kill()
+        returncode = process.wait()
+        stderr.seek(0)
+        log = stderr.read().decode('utf-8')
+    if (method is None and returncode) or (method is not None and not api.called.is_set()):
+        raise RuntimeError('{} failed:\n{}'.format(code, log))
+    return elapsed, log
+
+
+def median_time(api, environ, code, method, runs):
+    return statistics.median(run_python(api, environ, code, method)[0] for _ in range(runs))
+
+
+def import_times(api, environ, code, method=None):
+    """List of (cumulative microseconds, module) imported by code"""
+    _, log = run_python(api, environ, code, method, '-X', 'importtime')
+    times = []
+    for line in log.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times.append((int(cumulative), name.strip()))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--runs', type=int, default=10, help='interpreter starts per entry point')
+    parser.add_argument('--top', type=int, default=10, help='slowest imports listed per entry point')
+    parser.add_argument('--budget', action='append', default=[], metavar='ENTRY_POINT=MS',
+                        help='startup budget of entry point or module in milliseconds')
+    args = parser.parse_args()
+
+    budgets = dict(BUDGETS)
+    for budget in args.budget:
+        name, ms = budget.split('=')
+        budgets[name] = float(ms)
+
+    api = StartBotApi().start()
+    with tempfile.TemporaryDirectory() as directory:
+        environ = dict(os.environ)
+        for setting in SETTINGS:
+            environ.pop(setting, None)
+        environ.update(
+            BOT_API_URL=api.root_url, PORT='0', METRICS_PORT='0',
+            ORDERS_JOURNAL=os.path.join(directory, 'orders.jsonl'),
+            SESSIONS_DB=os.path.join(directory, 'sessions.db'))
+
+        bare = median_time(api, environ, 'pass', None, args.runs)
+        preloaded = set(name for _, name in import_times(api, environ, 'import sys'))
+        print('{:<16} {:8.1f} ms'.format('interpreter', bare * 1e3))
+
+        over = []
+        for name, budget in sorted(budgets.items()):
+            code, method = entry_point(name)
+            elapsed = median_time(api, environ, code, method, args.runs)
+            status = 'ok' if elapsed * 1e3 <= budget else 'OVER BUDGET'
+            print('{:<16} {:8.1f} ms  setup {:6.1f} ms  budget {:g} ms  {}'.format(
+                name, elapsed * 1e3, (elapsed - bare) * 1e3, budget, status))
+            if elapsed * 1e3 > budget:
+                over.append(name)
+            times = [(cumulative, module) for cumulative, module in import_times(api, environ, code, method)
+                     if module not in preloaded]
+            for cumulative, module in sorted(times, reverse=True)[:args.top]:
+                print('    {:8.1f} ms  {}'.format(cumulative / 1e3, module))
+    api.stop()
+
+    if over:
+        print('Over budget: ' + ', '.join(over))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
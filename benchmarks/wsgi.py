@@ -0,0 +1,107 @@
+"""
+Throughput of WSGI webhook application run by several worker processes.
+
+Each worker process creates WebhookApplication the way gunicorn workers do,
+all sharing one sessions database, and calls it directly with webhook
+requests of its own chats, one request at a time like a sync worker.
+HTTP is left out, so what is measured is the turn and session store
+handling shared by workers.
+
+With --turn-delay every turn also waits that many milliseconds without
+using CPU, like a turn waiting on disk, to tell how much of the turn holds
+locks shared by workers on machines with fewer cores than workers.
+
+Usage: python -m benchmarks.wsgi [--workers 1 2 4] [--chats N] [--messages M] [--turn-delay MS]
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+from benchmarks.common import NullTransactionManager
+from pizza_bot.bot import PizzaBot
+from pizza_bot.storage import SQLiteSessionStore
+from pizza_bot.wsgi import WebhookApplication
+
+SCRIPT = ('привет', 'большую', 'картой', 'да', 'ой', 'маленькую', 'наличкой', 'нет')
+
+
+def environ(update_id, chat_id, text):
+    body = json.dumps(dict(update_id=update_id, message=dict(
+        message_id=update_id, date=0, chat=dict(id=chat_id, type='private'), text=text)),
+        ensure_ascii=False).encode('utf-8')
+    return {
+        'REQUEST_METHOD': 'POST',
+        'PATH_INFO': '/TOKEN',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+    }
+
+
+class DelayedPizzaBot(PizzaBot):
+    """PizzaBot waiting given seconds every turn"""
+    def __init__(self, delay):
+        super(DelayedPizzaBot, self).__init__(NullTransactionManager(), shared_machine=True)
+        self.delay = delay
+
+    def on_chat_input(self, dialog):
+        time.sleep(self.delay)
+        super(DelayedPizzaBot, self).on_chat_input(dialog)
+
+
+def work(path, chat_ids, messages, delay, barrier, done):
+    """Worker process: send messages of its chats in turns"""
+    application = WebhookApplication(DelayedPizzaBot(delay), SQLiteSessionStore(path), '/TOKEN', threshold=3600)
+    requests = [environ(index * 1000000 + chat_id, chat_id, SCRIPT[index % len(SCRIPT)])
+                for index in range(messages) for chat_id in chat_ids]
+    barrier.wait()
+    for request in requests:
+        application(request, lambda status, headers: None)
+    done.put(len(requests))
+    application.close()
+
+
+def run(workers, chats, messages, delay):
+    """Updates per second handled by workers together"""
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'sessions.db')
+        SQLiteSessionStore(path).close()
+        barrier = multiprocessing.Barrier(workers + 1)
+        done = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=work, args=(path, range(worker + 1, chats + 1, workers), messages, delay, barrier, done))
+            for worker in range(workers)]
+        for process in processes:
+            process.start()
+        barrier.wait()
+        started = time.perf_counter()
+        handled = sum(done.get() for _ in processes)
+        elapsed = time.perf_counter() - started
+        for process in processes:
+            process.join()
+    return handled / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--chats', type=int, default=64)
+    parser.add_argument('--messages', type=int, default=40, help='messages sent by each chat')
+    parser.add_argument('--turn-delay', type=float, default=0, help='milliseconds every turn waits')
+    args = parser.parse_args()
+
+    print('{} cores, chats {}, updates {}, turn delay {}ms'.format(
+        os.cpu_count(), args.chats, args.chats * args.messages, args.turn_delay))
+    single = None
+    for workers in args.workers:
+        rate = run(workers, args.chats, args.messages, args.turn_delay / 1000)
+        single = single or rate / workers
+        print('{} workers: {:.0f} updates/s, {:.2f}x one worker'.format(workers, rate, rate / single))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,7 @@ from pizza_bot.bot import PizzaBot
 
 def main():
     manager = ConsoleTransactionManager()
-    bot = PizzaBot(manager)
+    bot = PizzaBot(manager, shared_machine=True)
     dialog = ConsoleDialog(bot)
     dialog.run_chat()
 
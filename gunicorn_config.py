@@ -0,0 +1,23 @@
+"""gunicorn settings for serving webhook by pre-forked worker processes"""
+import multiprocessing
+import os
+
+
+bind = '0.0.0.0:{}'.format(os.environ.get('PORT', '8443'))
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# Application is created in each worker: database connections and writer
+# threads do not survive fork
+preload_app = False
+
+
+def on_starting(server):
+    """Register webhook once, from the master process"""
+    from telegram_bot import set_webhook
+    set_webhook()
+
+
+def worker_exit(server, worker):
+    """Write pending orders of the worker"""
+    from telegram_bot import close_application
+    from wsgi import application
+    close_application(application)
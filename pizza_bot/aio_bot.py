@@ -0,0 +1,62 @@
+import time
+from pizza_bot import analytics, metrics, tracing
+from pizza_bot.bot import ChatBot, PizzaBot
+from pizza_bot.flow import FlowBot
+from pizza_bot.interface import AsyncDialog
+
+
+class AsyncChatBot(ChatBot):
+    """
+    ChatBot awaiting chat and order I/O instead of blocking on it.
+    Works with AsyncDialog dialogs and AsyncTransactionManager manager.
+
+    Turns run `run_turn` of the bot as it is: dialog buffers messages and
+    confirmed orders are collected, both are awaited once the turn is done.
+    Comes first in bases, before the bot it runs turns of.
+    """
+    # Orders confirmed by the turn running, turns do not await midway
+    orders = None
+
+    async def on_chat_start(self, dialog: AsyncDialog):
+        """Notify dialog has started"""
+        self.start_dialog(dialog)
+        analytics.ANALYTICS.reach(self.initial_state())
+        await self.run_dialog(dialog)
+
+    async def on_chat_input(self, dialog: AsyncDialog):
+        """Notify dialog input received"""
+        if dialog not in self.dialogs:
+            self.log('Input received from wrong dialog: {}'.format(dialog))
+            return
+        await self.run_dialog(dialog)
+
+    async def run_dialog(self, dialog):
+        started = time.perf_counter()
+        order, machine = self.dialogs[dialog]
+        state = order.state
+        orders = self.orders = []
+        try:
+            try:
+                self.run_turn(dialog, order, state)
+            finally:
+                self.orders = None
+            for order in orders:
+                with tracing.tracer.span('create_order', getattr(dialog, 'chat', None)):
+                    await self.manager.create_order(dialog, order)
+                metrics.ORDERS.inc()
+        finally:
+            # Messages of the turn go out together
+            await dialog.flush_messages()
+            metrics.TURN_SECONDS.observe(time.perf_counter() - started, state)
+
+    def place_order(self, dialog, order):
+        """Keep confirmed order to pass to transaction manager after the turn"""
+        self.orders.append(order)
+
+
+class AsyncPizzaBot(AsyncChatBot, PizzaBot):
+    """PizzaBot awaiting chat and order I/O, see AsyncChatBot"""
+
+
+class AsyncFlowBot(AsyncChatBot, FlowBot):
+    """FlowBot awaiting chat and order I/O, see AsyncChatBot"""
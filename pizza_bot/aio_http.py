@@ -0,0 +1,144 @@
+
+import asyncio
+import logging
+import ssl
+from urllib.parse import urlsplit
+
+
+class HTTPError(Exception):
+    """Malformed HTTP message"""
+
+
+async def read_headers(reader):
+    """Read header lines up to empty line, returns dict with lowercase names"""
+    headers = dict()
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise HTTPError('Connection closed while reading headers')
+        line = line.strip()
+        if not line:
+            return headers
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+
+async def read_body(reader, headers, until_eof=False):
+    """Read message body according to headers"""
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if not size:
+                await read_headers(reader)
+                return b''.join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+    if 'content-length' in headers:
+        return await reader.readexactly(int(headers['content-length']))
+    if until_eof:
+        return await reader.read()
+    return b''
+
+
+class HTTPConnectionPool(object):
+    """
+    Keep-alive HTTP/1.1 connections to one server, reused across requests.
+    At most `size` requests are in flight, others wait for a free connection.
+    Connecting and each exchange time out after `connect_timeout` and
+    `timeout` seconds with asyncio.TimeoutError, so hung server does not
+    hold callers forever.
+    """
+    def __init__(self, url, size=10, connect_timeout=10.0, timeout=30.0):
+        parts = urlsplit(url)
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.host = parts.hostname
+        self.ssl = ssl.create_default_context() if parts.scheme == 'https' else None
+        self.port = parts.port or (443 if self.ssl else 80)
+        self.idle = []
+        self.semaphore = asyncio.Semaphore(size)
+
+    async def request(self, method, path, body=b'', headers=None):
+        """Send request, returns (status, body) pair"""
+        lines = [
+            '{} {} HTTP/1.1'.format(method, path),
+            'Host: {}'.format(self.host),
+            'Content-Length: {}'.format(len(body)),
+        ]
+        lines.extend('{}: {}'.format(*header) for header in (headers or dict()).items())
+        message = ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body
+
+        async with self.semaphore:
+            while self.idle:
+                # Idle connection may be closed by server meanwhile
+                connection = self.idle.pop()
+                try:
+                    return await asyncio.wait_for(self.exchange(connection, message), self.timeout)
+                except (ConnectionError, HTTPError, asyncio.IncompleteReadError):
+                    continue
+            connection = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=self.ssl), self.connect_timeout)
+            return await asyncio.wait_for(self.exchange(connection, message), self.timeout)
+
+    async def exchange(self, connection, message):
+        reader, writer = connection
+        try:
+            writer.write(message)
+            await writer.drain()
+            status_line = await reader.readline()
+            if not status_line:
+                raise HTTPError('Connection closed')
+            status = int(status_line.split()[1])
+            headers = await read_headers(reader)
+            keep_alive = headers.get('connection', '').lower() != 'close'
+            body = await read_body(reader, headers, until_eof=not keep_alive)
+        except BaseException:
+            writer.close()
+            raise
+        if keep_alive:
+            self.idle.append(connection)
+        else:
+            writer.close()
+        return status, body
+
+    def close(self):
+        """Close idle connections"""
+        while self.idle:
+            reader, writer = self.idle.pop()
+            writer.close()
+
+
+async def start_server(handler, host, port):
+    """
+    Serve HTTP/1.1 requests by `await handler(method, path, body)` returning
+    (status, body) pair. Returns asyncio server.
+    """
+    async def serve(reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, version = request_line.decode('latin-1').split()
+                headers = await read_headers(reader)
+                body = await read_body(reader, headers)
+
+                status, response = await handler(method, path, body)
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write((
+                    'HTTP/1.1 {} {}\r\n'
+                    'Content-Length: {}\r\n'
+                    'Content-Type: application/json\r\n'
+                    'Connection: {}\r\n\r\n'
+                ).format(status, 'OK' if status < 400 else 'Error', len(response),
+                         'keep-alive' if keep_alive else 'close').encode('latin-1') + response)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, ValueError, HTTPError, asyncio.IncompleteReadError) as e:
+            logging.debug('HTTP connection dropped: {!r}'.format(e))
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(serve, host, port)
@@ -0,0 +1,150 @@
+
+import asyncio
+import json
+import logging
+import time
+from pizza_bot import metrics, tracing
+from pizza_bot.aio_http import HTTPConnectionPool, start_server
+from pizza_bot.interface import AsyncDialog
+from pizza_bot.telegram_chat import TelegramDialog
+from pizza_bot.updates import decode_update
+
+
+class BotApiError(Exception):
+    """Bot API request failed"""
+
+
+class AsyncBotApi(object):
+    """
+    Minimal Telegram Bot API client for asyncio, methods used by the bot only
+    """
+    def __init__(self, token, base_url='https://api.telegram.org', pool_size=10):
+        self.token = token
+        self.pool = HTTPConnectionPool(base_url, size=pool_size)
+
+    async def call(self, method, **params):
+        """Call API method, returns its result"""
+        path = '/bot{}/{}'.format(self.token, method)
+        body = json.dumps(params).encode('utf-8')
+        status, response = await self.pool.request(
+            'POST', path, body, headers={'Content-Type': 'application/json'})
+        try:
+            data = json.loads(response.decode('utf-8'))
+        except ValueError:
+            raise BotApiError('Invalid response to {}, status {}'.format(method, status))
+        if not data.get('ok'):
+            raise BotApiError(data.get('description', 'Request {} failed'.format(method)))
+        return data['result']
+
+    async def send_message(self, chat_id, text):
+        return await self.call('sendMessage', chat_id=chat_id, text=text)
+
+    async def set_webhook(self, url):
+        return await self.call('setWebhook', url=url)
+
+    def close(self):
+        self.pool.close()
+
+
+class AsyncTelegramDialog(TelegramDialog, AsyncDialog):
+    """
+    TelegramDialog sending turn messages through AsyncBotApi
+    """
+    __slots__ = ()
+
+    send_message = TelegramDialog.send_message
+
+    async def flush_messages(self):
+        """Send messages of the turn to user as one message"""
+        if not self.outbox:
+            return
+        messages, self.outbox = self.outbox, None
+        started = time.perf_counter()
+        try:
+            with tracing.tracer.span('send_message', self.chat):
+                await self.bot.send_message(self.chat, '\n'.join(messages))
+        except Exception:
+            metrics.SEND_ERRORS.inc()
+            raise
+        finally:
+            metrics.SEND_SECONDS.observe(time.perf_counter() - started)
+
+
+class ChatLocks(object):
+    """
+    asyncio locks per chat, existing only while chat has updates in progress
+    """
+    def __init__(self):
+        self.locks = dict()
+
+    async def acquire(self, chat_id):
+        entry = self.locks.get(chat_id)
+        if entry is None:
+            entry = self.locks[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self.discard(chat_id, entry)
+            raise
+
+    def release(self, chat_id):
+        entry = self.locks[chat_id]
+        entry[0].release()
+        self.discard(chat_id, entry)
+
+    def discard(self, chat_id, entry):
+        entry[1] -= 1
+        if not entry[1]:
+            del self.locks[chat_id]
+
+
+class UpdateTasks(object):
+    """
+    Tasks processing updates answered already, kept until they are done,
+    failures are logged
+    """
+    def __init__(self):
+        self.tasks = set()
+
+    def start(self, coroutine):
+        task = asyncio.ensure_future(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.done)
+        return task
+
+    def done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logging.error('Update processing failed', exc_info=task.exception())
+
+    async def join(self):
+        """Wait for tasks running"""
+        while self.tasks:
+            await asyncio.wait(list(self.tasks))
+
+
+async def start_webhook(handler, host, port, path, window=None, tasks=None):
+    """
+    Serve webhook updates on given path, passing each to `await handler(update)`
+    in UpdateTasks `tasks`. Request is answered before handler runs, so slow
+    turns and Bot API requests never make Telegram deliver update again.
+    Tasks start in order updates came, handlers taking FIFO ChatLocks first
+    keep the order within chat. Updates seen by UpdateWindow `window` are
+    dropped when it is given. Returns asyncio server.
+    """
+    tasks = tasks if tasks is not None else UpdateTasks()
+
+    async def handle_request(method, request_path, body):
+        if method != 'POST' or request_path != path:
+            return 404, b''
+        try:
+            with tracing.tracer.span('parse'):
+                update = decode_update(body)
+            if update is not None and not (window is not None and window.seen(update.update_id)):
+                tasks.start(handler(update))
+        except Exception as e:
+            logging.exception(e)
+        return 200, b''
+
+    return await start_server(handle_request, host, port)
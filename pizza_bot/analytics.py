@@ -0,0 +1,245 @@
+
+import threading
+import time
+from pizza_bot import metrics
+
+
+class RollingCounts(object):
+    """
+    Counts by key over the last `slots` periods of `period` seconds.
+
+    Ring buffer of per period counts: slot of a period is cleared when it is
+    reused `slots` periods later, so memory is bounded by slots and keys,
+    adding costs the same at any volume and totals never scan events.
+    """
+    def __init__(self, period, slots):
+        self.period = period
+        self.slots = slots
+        self.epochs = [None] * slots  # period number each slot counts
+        self.counts = [dict() for _ in range(slots)]
+        # Slot of current period and its bounds, found once per period
+        self.current = None
+        self.start = self.end = 0
+
+    def add(self, key, now, amount=1):
+        if not self.start <= now < self.end and not self.move(now):
+            return
+        counts = self.current
+        counts[key] = counts.get(key, 0) + amount
+
+    def move(self, now):
+        """
+        Make slot of period now falls in current, clearing it when reused.
+        False when the slot already counts a later period, now is out of window.
+        """
+        epoch = int(now // self.period)
+        index = epoch % self.slots
+        if self.epochs[index] is not None and self.epochs[index] > epoch:
+            return False
+        self.current = self.counts[index]
+        if self.epochs[index] != epoch:
+            self.current.clear()
+            self.epochs[index] = epoch
+        self.start = epoch * self.period
+        self.end = self.start + self.period
+        return True
+
+    def position(self, when, now):
+        """Index of period when falls in among series of the window ending now, None outside it"""
+        index = int(when // self.period) - int(now // self.period) + self.slots - 1
+        return index if 0 <= index < self.slots else None
+
+    def totals(self, now):
+        """Counts by key over the window ending now"""
+        epoch = int(now // self.period)
+        totals = dict()
+        for slot_epoch, counts in zip(self.epochs, self.counts):
+            if slot_epoch is not None and epoch - self.slots < slot_epoch <= epoch:
+                for key, count in counts.items():
+                    totals[key] = totals.get(key, 0) + count
+        return totals
+
+    def series(self, key, now):
+        """Counts of key per period over the window, oldest first"""
+        epoch = int(now // self.period)
+        series = []
+        for past in range(epoch - self.slots + 1, epoch + 1):
+            index = past % self.slots
+            series.append(self.counts[index].get(key, 0) if self.epochs[index] == past else 0)
+        return series
+
+
+class PendingCounts(object):
+    """Counts of one thread for the period from start to end, not yet added to windows"""
+    __slots__ = ('start', 'end', 'counts')
+
+    def __init__(self):
+        self.start = self.end = 0
+        self.counts = dict()
+
+
+class OrderAnalytics(object):
+    """
+    Live order statistics over the last minute, hour and day: orders by
+    pizza size and payment method, confirmed and declined orders, and the
+    funnel, how many orders reached each state and how many of them did not
+    go on to the next one. Served with metrics, see `summary` for the rest.
+
+    An event costs one dict update of the thread recording it, like
+    `metrics.Metric` values: each thread counts events of the current
+    5 seconds on its own and takes the lock only to add them to every window
+    when the period is over. Reading statistics adds counts threads have
+    not added yet without changing them.
+    """
+    windows = (
+        ('1m', 5, 12),  # window, period seconds, periods
+        ('1h', 60, 60),
+        ('1d', 3600, 24),
+    )
+    funnel = ('idle', 'size_picked', 'payment_picked', 'confirmed')
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.counts = [(name, RollingCounts(period, slots)) for name, period, slots in self.windows]
+        self.period = min(period for name, period, slots in self.windows)
+        self.local = threading.local()
+        self.shards = []  # (thread, PendingCounts) of threads recording
+
+    def add(self, key):
+        now = self.clock()
+        try:
+            pending = self.local.pending
+        except AttributeError:
+            pending = self.local.pending = PendingCounts()
+            with self.lock:
+                self.retire()
+                self.shards.append((threading.current_thread(), pending))
+        if not pending.start <= now < pending.end:
+            with self.lock:
+                self.fold(pending)
+                pending.counts = dict()
+                pending.start = now // self.period * self.period
+                pending.end = pending.start + self.period
+        counts = pending.counts
+        counts[key] = counts.get(key, 0) + 1
+
+    def fold(self, pending):
+        """Add pending counts of a period over to windows, lock is held"""
+        for name, counts in self.counts:
+            for key, count in pending.counts.items():
+                counts.add(key, pending.start, count)
+
+    def retire(self):
+        """Add counts of finished threads to windows and drop them, lock is held"""
+        shards = []
+        for thread, pending in self.shards:
+            if thread.is_alive():
+                shards.append((thread, pending))
+            else:
+                self.fold(pending)
+        self.shards = shards
+
+    def collect_pending(self, counts, now):
+        """(position in window, counts) not added to windows yet, lock is held"""
+        self.retire()
+        collected = []
+        for thread, pending in self.shards:
+            position = counts.position(pending.start, now)
+            if position is not None:
+                # Copy is atomic for the interpreter while the thread goes on counting
+                collected.append((position, dict(pending.counts)))
+        return collected
+
+    def reach(self, state):
+        """Order got to state, idle is a new order"""
+        self.add(('state', state))
+
+    def decide(self, order):
+        """Order was confirmed or declined"""
+        if order.is_confirmed:
+            self.add(('state', 'confirmed'))
+            self.add(('order', order.pizza_size, order.payment_method))
+        else:
+            self.add(('state', 'declined'))
+
+    def totals(self, window):
+        counts = dict(self.counts)[window]
+        now = self.clock()
+        with self.lock:
+            totals = counts.totals(now)
+            pending = self.collect_pending(counts, now)
+        for position, pending_counts in pending:
+            for key, count in pending_counts.items():
+                totals[key] = totals.get(key, 0) + count
+        return totals
+
+    def orders_series(self, window='1h'):
+        """
+        Confirmed orders per period of window, oldest first: per minute for
+        the last hour, per hour for the last day
+        """
+        counts = dict(self.counts)[window]
+        now = self.clock()
+        with self.lock:
+            series = dict((key, counts.series(key, now)) for key in counts.totals(now) if key[0] == 'order')
+            pending = self.collect_pending(counts, now)
+        for position, pending_counts in pending:
+            for key, count in pending_counts.items():
+                if key[0] == 'order':
+                    series.setdefault(key, [0] * counts.slots)[position] += count
+        return [sum(period) for period in zip(*series.values())] or [0] * counts.slots
+
+    def summary(self, window='1h'):
+        """Statistics of the window as dict"""
+        totals = self.totals(window)
+        reached = [(state, totals.get(('state', state), 0)) for state in self.funnel]
+        confirmed, declined = reached[-1][1], totals.get(('state', 'declined'), 0)
+        return dict(
+            orders={key[1:]: count for key, count in totals.items() if key[0] == 'order'},
+            confirmed=confirmed,
+            declined=declined,
+            confirm_ratio=confirmed / (confirmed + declined) if confirmed + declined else None,
+            funnel=self.drop_offs(reached),
+        )
+
+    @staticmethod
+    def drop_offs(reached):
+        """(state, reached, share of them not reaching the next state) along funnel"""
+        funnel = []
+        for index, (state, count) in enumerate(reached):
+            drop_off = None
+            if index + 1 < len(reached) and count:
+                drop_off = max(0, count - reached[index + 1][1]) / count
+            funnel.append((state, count, drop_off))
+        return funnel
+
+    def expose(self, extra=()):
+        """Statistics of every window in Prometheus text format, extra (name, value) labels added to all"""
+        summaries = [(window, self.summary(window)) for window, counts in self.counts]
+        gauges = [
+            ('pizza_bot_window_orders', 'Confirmed orders in window by pizza size and payment method', [
+                ('window="{}",pizza_size="{}",payment_method="{}"'.format(window, pizza_size, payment_method), count)
+                for window, summary in summaries
+                for (pizza_size, payment_method), count in sorted(summary['orders'].items(), key=str)]),
+            ('pizza_bot_window_confirm_ratio', 'Share of orders confirmed rather than declined in window', [
+                ('window="{}"'.format(window), summary['confirm_ratio'])
+                for window, summary in summaries if summary['confirm_ratio'] is not None]),
+            ('pizza_bot_window_funnel', 'Orders reaching state in window', [
+                ('window="{}",state="{}"'.format(window, state), count)
+                for window, summary in summaries for state, count, drop_off in summary['funnel']]),
+            ('pizza_bot_window_drop_off', 'Share of orders reaching state but not the next one in window', [
+                ('window="{}",state="{}"'.format(window, state), drop_off)
+                for window, summary in summaries for state, count, drop_off in summary['funnel']
+                if drop_off is not None]),
+        ]
+        extra = ''.join(',{}="{}"'.format(label, value) for label, value in extra)
+        lines = []
+        for name, help, samples in gauges:
+            lines += ['# HELP {} {}'.format(name, help), '# TYPE {} gauge'.format(name)]
+            lines += ['{}{{{}{}}} {}'.format(name, labels, extra, value) for labels, value in samples]
+        return '\n'.join(lines) + '\n'
+
+
+# Order statistics of this process, exposed with metrics
+ANALYTICS = metrics.REGISTRY.register(OrderAnalytics())
@@ -0,0 +1,66 @@
+
+import logging
+import queue
+import threading
+
+
+class BatchWriter(object):
+    """
+    Background thread writing submitted items in batches.
+
+    Everything queued while previous batch was written goes into the next one,
+    so slow writes (fsync) are paid once per batch, never by the submitter.
+    Subclasses implement `write_batch` and call `start` when initialized.
+    """
+    STOP = object()
+
+    def __init__(self, max_queue=0, max_batch=1000):
+        self.queue = queue.Queue(max_queue)
+        self.max_batch = max_batch
+        self.thread = threading.Thread(target=self.run, name=type(self).__name__, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, item):
+        """Queue item for writing, blocks only when queue is full"""
+        self.queue.put(item)
+
+    def flush(self):
+        """Wait until all submitted items are written"""
+        self.queue.join()
+
+    def close(self):
+        """Write remaining items and stop writer thread"""
+        if self.thread.is_alive():
+            self.queue.put(self.STOP)
+            self.thread.join()
+
+    def run(self):
+        stop = False
+        while not stop:
+            batch = []
+            item = self.queue.get()
+            while True:
+                if item is self.STOP:
+                    stop = True
+                    break
+                batch.append(item)
+                if len(batch) >= self.max_batch:
+                    break
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+
+            try:
+                if batch:
+                    self.write_batch(batch)
+            except Exception as e:
+                logging.exception(e)
+            finally:
+                for _ in range(len(batch) + stop):
+                    self.queue.task_done()
+
+    def write_batch(self, items):
+        raise NotImplementedError()
@@ -1,32 +1,26 @@
 
 import logging
-from transitions import Machine
+import time
+from pizza_bot import analytics, metrics, tracing
 from pizza_bot.interface import Dialog, Order, TransactionManager
+from pizza_bot.machine import CompiledMachine
+from pizza_bot.matcher import VariantMatcher
+from pizza_bot.responses import Responses
 
 
-class PizzaBot(object):
-    messages = dict(
-        pick_size='Какую вы хотите пиццу? Большую или маленькую?',
-        pick_payment='Как вы будете платить?',
-        confirm_pick='Вы хотите {pizza_size} пиццу, оплата - {payment_type}?',
-        success='Спасибо за заказ!',
-        please_repeat='Повторите пожалуста. Варианты: {variants}',
-    )
+def Machine(*args, **kwargs):
+    """transitions.Machine, imported when first per-dialog machine is made"""
+    from transitions import Machine
+    return Machine(*args, **kwargs)
 
-    states = ['idle', 'size_picked', 'payment_picked']
-    transitions = [
-        dict(trigger='set_size', source='idle', dest='size_picked', before='set_pizza_size'),
-        dict(trigger='set_payment', source='size_picked', dest='payment_picked', before='set_payment_method'),
-        dict(trigger='confirm', source='payment_picked', dest='idle', before='set_confirmation'),
-    ]
 
+class ChatBot(object):
+    """
+    Dialog handling shared by conversation bots, dialogs map to (order, machine).
+    Bots make orders by `start_dialog` and `restore_dialog` and advance them
+    by `run_turn`, messages of the turn are flushed at once.
+    """
     INVALID = object()
-    variants = {
-        'idle': {'маленькую': Order.SMALL_SIZE, 'большую': Order.BIG_SIZE},
-        'size_picked': {'наличкой': Order.PAY_CHECK, 'картой': Order.PAY_CARD},
-        'payment_picked': {'да': True, 'нет': False},
-    }
-
 
     def __init__(self, manager):
         self.manager = manager
@@ -35,6 +29,7 @@ class PizzaBot(object):
     def on_chat_start(self, dialog: Dialog):
         """Notify dialog has started"""
         self.start_dialog(dialog)
+        analytics.ANALYTICS.reach(self.initial_state())
         self.run_dialog(dialog)
 
     def on_chat_input(self, dialog: Dialog):
@@ -51,37 +46,138 @@ class PizzaBot(object):
             return
         self.delete_dialog(dialog)
 
+    def initial_state(self):
+        """State new dialogs start in"""
+        raise NotImplementedError
+
     def start_dialog(self, dialog):
         """Create new dialog"""
-        order = Order()
-        machine = Machine(
-            model=order,
-            states=self.states,
-            transitions=self.transitions,
-            initial='idle'
-        )
-        self.dialogs[dialog] = (order, machine)
-        dialog.reset_input()
+        raise NotImplementedError
+
+    def restore_dialog(self, dialog, state, pizza_size=None, payment_method=None, flow_version=None):
+        """Create dialog continuing saved order"""
+        raise NotImplementedError
 
     def delete_dialog(self, dialog):
         """Delete dialog"""
         del self.dialogs[dialog]
 
     def run_dialog(self, dialog):
+        started = time.perf_counter()
+        order, machine = self.dialogs[dialog]
+        state = order.state
+        try:
+            self.run_turn(dialog, order, state)
+        finally:
+            # Messages of the turn go out together
+            dialog.flush_messages()
+            metrics.TURN_SECONDS.observe(time.perf_counter() - started, state)
+
+    def run_turn(self, dialog, order, state):
+        """Advance order by dialog input, messages are sent by dialog, not flushed"""
+        raise NotImplementedError
+
+    def place_order(self, dialog, order):
+        """Pass confirmed order to transaction manager"""
+        with tracing.tracer.span('create_order', getattr(dialog, 'chat', None)):
+            self.manager.create_order(dialog, order)
+        metrics.ORDERS.inc()
+
+    def input_label(self, chat_input):
+        """Kind of input for metrics"""
+        if chat_input is None:
+            return 'none'
+        return 'invalid' if chat_input is self.INVALID else 'valid'
+
+    def log(self, message):
+        logging.info(message)
+
+
+class PizzaBot(ChatBot):
+    messages = dict(
+        pick_size='Какую вы хотите пиццу? Большую или маленькую?',
+        pick_payment='Как вы будете платить?',
+        confirm_pick='Вы хотите {pizza_size} пиццу, оплата - {payment_type}?',
+        success='Спасибо за заказ!',
+        please_repeat='Повторите пожалуста. Варианты: {variants}',
+    )
+
+    states = ['idle', 'size_picked', 'payment_picked']
+    transitions = [
+        dict(trigger='set_size', source='idle', dest='size_picked', before='set_pizza_size'),
+        dict(trigger='set_payment', source='size_picked', dest='payment_picked', before='set_payment_method'),
+        dict(trigger='confirm', source='payment_picked', dest='idle', before='set_confirmation'),
+    ]
+
+    variants = {
+        'idle': {'маленькую': Order.SMALL_SIZE, 'большую': Order.BIG_SIZE},
+        'size_picked': {'наличкой': Order.PAY_CHECK, 'картой': Order.PAY_CARD},
+        'payment_picked': {'да': True, 'нет': False},
+    }
+
+
+    def __init__(self, manager, shared_machine=False):
+        super(PizzaBot, self).__init__(manager)
+        # Shared machine compiles states and transitions once for all dialogs,
+        # otherwise each dialog gets its own transitions.Machine
+        self.machine = None
+        if shared_machine:
+            self.machine = CompiledMachine(
+                model_class=Order,
+                states=self.states,
+                transitions=self.transitions,
+                initial='idle'
+            )
+        # Input matchers are compiled once per state
+        self.matchers = dict()
+        for state in self.variants:
+            self.get_matcher(state)
+        self.responses = None
+        self.get_responses()
+
+    def initial_state(self):
+        return 'idle'
+
+    def start_dialog(self, dialog):
+        """Create new dialog"""
+        if self.machine is not None:
+            order = self.machine.create_model()
+            machine = self.machine
+        else:
+            order = Order()
+            machine = Machine(
+                model=order,
+                states=self.states,
+                transitions=self.transitions,
+                initial='idle'
+            )
+        self.dialogs[dialog] = (order, machine)
+        dialog.reset_input()
+
+    def restore_dialog(self, dialog, state, pizza_size=None, payment_method=None, flow_version=None):
+        """Create dialog continuing saved order, built-in conversation has no flow versions"""
+        self.start_dialog(dialog)
         order, machine = self.dialogs[dialog]
+        order.pizza_size = pizza_size
+        order.payment_method = payment_method
+        machine.set_state(state, model=order)
+
+    def run_turn(self, dialog, order, state):
         chat_input = self.get_value(dialog)
+        metrics.TURNS.inc(state, self.input_label(chat_input))
 
-        # Transition handler: idle -> size_picked
-        if order.is_idle():
-            self.handle_idle(dialog, order, chat_input)
+        with tracing.tracer.span('transition', getattr(dialog, 'chat', None), state=state):
+            # Transition handler: idle -> size_picked
+            if order.is_idle():
+                self.handle_idle(dialog, order, chat_input)
 
-        # Transition handler: size_picked -> payment_picked
-        elif order.is_size_picked():
-            self.handle_size_pick(dialog, order, chat_input)
+            # Transition handler: size_picked -> payment_picked
+            elif order.is_size_picked():
+                self.handle_size_pick(dialog, order, chat_input)
 
-        # Transition handler: payment_picked -> idle
-        elif order.is_payment_picked():
-            self.handle_payment_pick(dialog, order, chat_input)
+            # Transition handler: payment_picked -> idle
+            elif order.is_payment_picked():
+                self.handle_payment_pick(dialog, order, chat_input)
 
     def handle_idle(self, dialog, order, chat_input):
         # Handle invalid input
@@ -95,6 +191,7 @@ class PizzaBot(object):
 
         # Set pizza size, Move transition to size_picked
         order.set_size(chat_input)
+        analytics.ANALYTICS.reach(order.state)
 
         # Ask for next input
         dialog.send_message(self.messages.get('pick_payment'))
@@ -108,34 +205,51 @@ class PizzaBot(object):
 
         # Set order payment method, Move transition to payment_picked
         order.set_payment(chat_input)
+        analytics.ANALYTICS.reach(order.state)
 
         # Ask for next input
-        args = dict(pizza_size=order.size_description, payment_type=order.payment_description)
-        dialog.send_message(self.messages.get('confirm_pick').format(**args))
+        dialog.send_message(self.confirm_message(order))
 
     def handle_payment_pick(self, dialog, order, chat_input):
         # Handle invalid input
         if chat_input is self.INVALID:
-            args = dict(pizza_size=order.size_description, payment_type=order.payment_description)
-            dialog.send_message(self.messages.get('confirm_pick').format(**args))
+            dialog.send_message(self.confirm_message(order))
             self.send_variants(dialog)
             return
 
         # Confirm order, Move transition to idle
         order.confirm(chat_input)
+        analytics.ANALYTICS.decide(order)
 
         if order.is_confirmed:
             dialog.send_message(self.messages.get('success'))
-            self.manager.create_order(dialog, order)
+            self.place_order(dialog, order)
         self.start_dialog(dialog)
+        analytics.ANALYTICS.reach('idle')
         dialog.send_message(self.messages.get('pick_size'))
 
     def send_variants(self, dialog):
         order, machine = self.dialogs[dialog]
-        state = order.state
-        variants = ', '.join(self.variants[state].keys())
-        message = self.messages.get('please_repeat')
-        dialog.send_message(message.format(variants=variants))
+        dialog.send_message(self.variants_message(order.state))
+
+    def confirm_message(self, order):
+        """Message asking to confirm order"""
+        message = self.get_responses().confirm_pick.get((order.pizza_size, order.payment_method))
+        if message is None:
+            args = dict(pizza_size=order.size_description, payment_type=order.payment_description)
+            message = self.messages.get('confirm_pick').format(**args)
+        return message
+
+    def variants_message(self, state):
+        """Message listing inputs accepted in given state"""
+        return self.get_responses().please_repeat[state]
+
+    def get_responses(self):
+        """Pre-rendered responses, rendered again if messages or variants were replaced"""
+        responses = self.responses
+        if responses is None or responses.messages is not self.messages or responses.variants is not self.variants:
+            responses = self.responses = Responses(self.messages, self.variants)
+        return responses
 
     def get_value(self, dialog):
         order, machine = self.dialogs[dialog]
@@ -145,11 +259,12 @@ class PizzaBot(object):
         if chat_input is None:
             return None
 
-        chat_input = chat_input.lower().strip()
-        if chat_input not in self.variants[state]:
-            return self.INVALID
-
-        return self.variants[state][chat_input]
+        return self.get_matcher(state).match(chat_input, self.INVALID)
 
-    def log(self, message):
-        logging.info(message)
+    def get_matcher(self, state):
+        """Input matcher of given state, compiled again if its variants were replaced"""
+        variants = self.variants[state]
+        matcher = self.matchers.get(state)
+        if matcher is None or matcher.variants is not variants:
+            matcher = self.matchers[state] = VariantMatcher(variants)
+        return matcher
@@ -0,0 +1,74 @@
+
+import threading
+from pizza_bot import metrics
+
+
+class UpdateWindow(object):
+    """
+    Update ids seen lately, to drop updates Telegram delivers again before
+    any session work is done.
+
+    Bitmap of the last `size` ids up to the highest one seen, so memory
+    stays `size / 8` bytes however many updates pass. Telegram gives ids
+    out in increasing order, but picks the next id at random after a week
+    without updates. So an id below the window starts the sequence over:
+    the window is reset to it and the update is taken as new.
+    """
+    def __init__(self, size=1 << 16):
+        if size <= 0 or size % 8:
+            raise ValueError('Window size must be positive multiple of 8, got {}'.format(size))
+        self.size = size
+        self.bits = bytearray(size // 8)
+        self.highest = None
+        self.lock = threading.Lock()
+
+    def seen(self, update_id):
+        """Whether update was seen already, marks it seen"""
+        with self.lock:
+            if self.contains(update_id):
+                metrics.REPLAYS.inc()
+                return True
+            self.add(update_id)
+            return False
+
+    def contains(self, update_id):
+        """Whether update was seen already, lock is held"""
+        if self.highest is None or update_id > self.highest or update_id <= self.highest - self.size:
+            return False
+        index = update_id % self.size
+        return bool(self.bits[index >> 3] & 1 << (index & 7))
+
+    def add(self, update_id):
+        """Mark update seen, lock is held"""
+        if self.highest is None or update_id > self.highest:
+            self.advance(update_id)
+        elif update_id <= self.highest - self.size:
+            # Sequence started over below the window
+            self.bits[:] = bytes(len(self.bits))
+            self.highest = update_id
+        index = update_id % self.size
+        self.bits[index >> 3] |= 1 << (index & 7)
+
+    def mark(self, update_ids):
+        """Mark updates seen once they are handled"""
+        with self.lock:
+            for update_id in update_ids:
+                self.add(update_id)
+
+    def fresh(self, update_ids):
+        """Update ids not seen yet, without marking them"""
+        with self.lock:
+            fresh = [update_id for update_id in update_ids if not self.contains(update_id)]
+        if len(fresh) < len(update_ids):
+            metrics.REPLAYS.inc(amount=len(update_ids) - len(fresh))
+        return fresh
+
+    def advance(self, update_id):
+        """Move window up to update_id, forgetting ids it leaves behind"""
+        if self.highest is None or update_id - self.highest >= self.size:
+            self.bits[:] = bytes(len(self.bits))
+        else:
+            for index in range(self.highest + 1, update_id + 1):
+                index %= self.size
+                self.bits[index >> 3] &= ~(1 << (index & 7))
+        self.highest = update_id
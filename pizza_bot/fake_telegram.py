@@ -0,0 +1,165 @@
+
+import itertools
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qsl
+from pizza_bot.ratelimit import TokenBucket
+
+
+class FakeBotApiHandler(BaseHTTPRequestHandler):
+    """Answers `POST /bot<token>/<method>` and `GET` with query the way Bot API does"""
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately, don't let them wait for ACK
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8')
+        if self.headers.get('Content-Type', '').startswith('application/json'):
+            params = json.loads(body or '{}')
+        else:
+            params = dict(parse_qsl(body))
+        self.call(self.path, params)
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        self.call(path, dict(parse_qsl(query)))
+
+    def call(self, path, params):
+        parts = path.split('/')
+        if len(parts) != 3 or not parts[1].startswith('bot'):
+            self.reply(404, dict(ok=False, error_code=404, description='Not Found'))
+            return
+        status, data = self.server.call(parts[2], params)
+        self.reply(status, data)
+
+    def reply(self, status, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeBotApi(ThreadingMixIn, HTTPServer):
+    """
+    Local stand-in for Telegram Bot API, for load tests and integration tests.
+    Point clients at `url`, messages sent are kept in `sent` as (chat_id, text).
+
+    With rates given, sendMessage over global or per-chat limit is answered
+    by 429 Too Many Requests like Bot API does, and counted in `rejected`.
+    Requests may come up to `slack` seconds early to allow for network jitter.
+
+    Updates added by `push_update` are served by getUpdates with long polling.
+    """
+    daemon_threads = True
+
+    def __init__(self, host='127.0.0.1', port=0, global_rate=None, chat_rate=None,
+                 global_burst=30, chat_burst=1, slack=0.05):
+        super(FakeBotApi, self).__init__((host, port), FakeBotApiHandler)
+        self.sent = []
+        self.rejected = 0
+        self.lock = threading.Lock()
+        self.thread = None
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.global_burst = global_burst
+        self.chat_burst = chat_burst
+        self.slack = slack
+        self.bucket = global_rate and TokenBucket(global_rate, global_burst, time.monotonic())
+        self.chat_buckets = dict()
+        self.updates = deque()
+        self.updates_ready = threading.Condition(self.lock)
+
+    @property
+    def url(self):
+        """Base url for telegram.Bot, token is appended"""
+        return 'http://{}:{}/bot'.format(*self.server_address)
+
+    @property
+    def root_url(self):
+        """Base url for AsyncBotApi"""
+        return 'http://{}:{}'.format(*self.server_address)
+
+    def start(self):
+        """Serve requests in background thread"""
+        self.thread = threading.Thread(target=self.serve_forever, name='FakeBotApi', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self.thread.join()
+
+    def call(self, method, params):
+        """Run API method, returns (status, response) pair"""
+        if method == 'sendMessage':
+            chat_id = int(params['chat_id'])
+            if not self.allow(chat_id):
+                return 429, dict(ok=False, error_code=429, description='Too Many Requests: retry after 1',
+                                 parameters=dict(retry_after=1))
+            return 200, dict(ok=True, result=self.send_message(chat_id, params['text']))
+        if method == 'getUpdates':
+            updates = self.get_updates(
+                int(params.get('offset') or 0), int(params.get('limit') or 100), float(params.get('timeout') or 0))
+            return 200, dict(ok=True, result=updates)
+        if method == 'getMe':
+            return 200, dict(ok=True, result=dict(id=1, is_bot=True, first_name='Fake', username='fake_bot'))
+        if method == 'getMyCommands':
+            return 200, dict(ok=True, result=[])
+        if method in ('setWebhook', 'deleteWebhook'):
+            return 200, dict(ok=True, result=True)
+        return 404, dict(ok=False, error_code=404, description='Method {} not found'.format(method))
+
+    def push_update(self, update):
+        """Queue update dict for getUpdates"""
+        with self.updates_ready:
+            self.updates.append(update)
+            self.updates_ready.notify_all()
+
+    def get_updates(self, offset, limit, timeout):
+        """Updates from offset on, waiting up to timeout for some to come"""
+        deadline = time.monotonic() + timeout
+        with self.updates_ready:
+            while True:
+                # Updates before offset are confirmed by client
+                while self.updates and self.updates[0]['update_id'] < offset:
+                    self.updates.popleft()
+                remaining = deadline - time.monotonic()
+                if self.updates or remaining <= 0:
+                    return list(itertools.islice(self.updates, limit))
+                self.updates_ready.wait(remaining)
+
+    def allow(self, chat_id):
+        """Take tokens for message to chat, False when over limit"""
+        now = time.monotonic()
+        with self.lock:
+            buckets = []
+            if self.global_rate:
+                buckets.append(self.bucket)
+            if self.chat_rate:
+                bucket = self.chat_buckets.get(chat_id)
+                if bucket is None:
+                    bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+                buckets.append(bucket)
+            if any(bucket.wait_time(now) > self.slack for bucket in buckets):
+                self.rejected += 1
+                return False
+            for bucket in buckets:
+                bucket.take(now)
+            return True
+
+    def send_message(self, chat_id, text):
+        with self.lock:
+            self.sent.append((chat_id, text))
+            message_id = len(self.sent)
+        return dict(message_id=message_id, date=int(time.time()), chat=dict(id=chat_id, type='private'), text=text)
@@ -0,0 +1,256 @@
+
+import json
+import logging
+import os
+from pizza_bot import analytics, metrics, tracing
+from pizza_bot.bot import ChatBot
+from pizza_bot.interface import Order
+from pizza_bot.matcher import VariantMatcher
+from pizza_bot.responses import Responses
+
+
+class FlowStep(object):
+    """Compiled state of a flow, everything a turn in it needs"""
+    __slots__ = ('name', 'prompt', 'prompts', 'repeat', 'matcher', 'setter', 'next', 'success')
+
+    def __init__(self, name, prompt, prompts, repeat, matcher, setter, next, success):
+        self.name = name
+        self.prompt = prompt  # text, or template when rendered per order in prompts
+        self.prompts = prompts  # (pizza_size, payment_method) -> text, or None
+        self.repeat = repeat  # variants listing after invalid input
+        self.matcher = matcher
+        self.setter = setter  # Order method taking matched value
+        self.next = next  # index of next step, None for steps placing the order
+        self.success = success  # text sent for confirmed order, on steps placing it
+
+
+class FlowOrder(Order):
+    """Order knowing index of its flow step, turns index steps by it"""
+    __slots__ = ('step', 'flow_version')
+
+
+class Flow(object):
+    """
+    Conversation flow compiled from declarative definition, see flows/pizza.json.
+
+    States are numbered in definition order and orders keep the number of
+    their state, `steps[order.step]` is all there is to look up per message,
+    however many states the flow has.
+    Each state has prompt message, accepted inputs with their values and
+    Order setter the value is passed to, values must be ones the order can
+    describe, see `values`. Then it goes on to `next` state,
+    or places the order when confirmed, with `order` message, and starts
+    over. Prompts may refer to {pizza_size} and {payment_type} of the order.
+    """
+    # Order setters and values they take
+    values = dict(
+        set_pizza_size=Responses.sizes,
+        set_payment_method=Responses.payments,
+        set_confirmation=(True, False),
+    )
+
+    def __init__(self, definition: dict):
+        self.version = definition.get('version')
+        if self.version is not None and (type(self.version) is not int or not 0 <= self.version < 2 ** 31):
+            raise ValueError('Flow version must be non-negative integer, got {!r}'.format(self.version))
+        messages = definition['messages']
+        states = definition['states']
+        self.codes = {state['name']: code for code, state in enumerate(states)}
+        if len(self.codes) != len(states):
+            raise ValueError('Duplicate state names')
+        self.initial = definition.get('initial', states[0]['name'])
+        if self.initial not in self.codes:
+            raise ValueError('Unknown initial state {!r}'.format(self.initial))
+
+        def message(key):
+            if key not in messages:
+                raise ValueError('Unknown message {!r}'.format(key))
+            return messages[key]
+
+        steps = []
+        for state in states:
+            name = state['name']
+            if state['set'] not in self.values:
+                raise ValueError('Unknown Order setter {!r} in state {!r}'.format(state['set'], name))
+            setter = getattr(Order, state['set'])
+            values = self.values[state['set']]
+            for text, value in state['inputs'].items():
+                # Booleans are ints, type is compared as well
+                if not any(value == known and type(value) is type(known) for known in values):
+                    raise ValueError('Input {!r} of state {!r} has value {!r}, {} takes one of {}'.format(
+                        text, name, value, state['set'], ', '.join(map(repr, values))))
+            if ('next' in state) == ('order' in state):
+                raise ValueError('State {!r} needs either next state or order message'.format(name))
+            if 'next' in state and state['next'] not in self.codes:
+                raise ValueError('Unknown state {!r}'.format(state['next']))
+
+            prompt = message(state['prompt'])
+            steps.append(FlowStep(
+                name=name,
+                prompt=prompt,
+                prompts=self.render(prompt) if '{' in prompt else None,
+                repeat=message('please_repeat').format(variants=', '.join(state['inputs'])),
+                matcher=VariantMatcher(state['inputs']),
+                setter=setter,
+                next=self.codes[state['next']] if 'next' in state else None,
+                success=message(state['order']) if 'order' in state else None,
+            ))
+        self.steps = tuple(steps)
+
+    @staticmethod
+    def render(template):
+        """Template rendered for every pizza size and payment method"""
+        prompts = dict()
+        order = Order()
+        for order.pizza_size in Responses.sizes:
+            for order.payment_method in Responses.payments:
+                prompts[order.pizza_size, order.payment_method] = template.format(
+                    pizza_size=order.size_description, payment_type=order.payment_description)
+        return prompts
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    @classmethod
+    def loads(cls, data: bytes):
+        return cls(json.loads(data.decode('utf-8')))
+
+    def prompt(self, step, order):
+        if step.prompts is None:
+            return step.prompt
+        prompt = step.prompts.get((order.pizza_size, order.payment_method))
+        if prompt is None:
+            prompt = step.prompt.format(pizza_size=order.size_description, payment_type=order.payment_description)
+        return prompt
+
+
+class FlowBot(ChatBot):
+    """
+    ChatBot running conversation flow loaded from file, dialogs map to (order, flow).
+
+    `reload` swaps in new version of the flow file at once. Orders keep the
+    flow version they were started on, saved sessions included, so orders in
+    progress finish on old version and the next ones start on new. Every
+    version loaded is archived next to the flow file, for processes
+    restoring sessions of versions they never loaded. Compiled older flows
+    are kept until no dialog of the process uses them on the next reload.
+    """
+    def __init__(self, manager, path):
+        super(FlowBot, self).__init__(manager)
+        self.path = path
+        self.flow = None
+        self.flows = dict()  # version -> compiled flow
+        self.mtime = None
+        self.reload()
+
+    def reload(self):
+        """Load flow file if it changed since last load, returns whether it did"""
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self.mtime:
+            return False
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        flow = Flow.loads(data)
+        self.archive(flow.version, data)
+        used = {dialog_flow.version for order, dialog_flow in list(self.dialogs.values())}
+        flows = {version: old for version, old in self.flows.items() if version in used}
+        flows[flow.version] = flow
+        # Dialogs pick flow up by single attribute read, never half loaded
+        self.flows, self.flow, self.mtime = flows, flow, mtime
+        return True
+
+    def archive_path(self, version):
+        return '{}.v{}'.format(self.path, version)
+
+    def archive(self, version, data):
+        """Keep definition of flow version, processes sharing sessions find it there"""
+        if version is None:
+            return
+        path = self.archive_path(version)
+        try:
+            if not os.path.exists(path):
+                temporary = '{}.{}.tmp'.format(path, os.getpid())
+                with open(temporary, 'wb') as f:
+                    f.write(data)
+                os.replace(temporary, path)
+        except OSError as e:
+            logging.error('Flow version {} not archived: {!r}'.format(version, e))
+
+    def find_flow(self, version):
+        """Flow of given version, current flow when it is not known"""
+        flow = self.flows.get(version)
+        if flow is None and version is not None:
+            try:
+                with open(self.archive_path(version), 'rb') as f:
+                    flow = Flow.loads(f.read())
+                self.flows[version] = flow
+            except (OSError, ValueError) as e:
+                self.log('Flow version {} not found, current flow used: {!r}'.format(version, e))
+        return flow or self.flow
+
+    def initial_state(self):
+        return self.flow.initial
+
+    def start_dialog(self, dialog, flow=None):
+        """Create new dialog on current flow"""
+        flow = flow or self.flow
+        order = FlowOrder()
+        order.step = flow.codes[flow.initial]
+        order.state = flow.initial
+        order.flow_version = flow.version
+        self.dialogs[dialog] = (order, flow)
+        dialog.reset_input()
+
+    def restore_dialog(self, dialog, state, pizza_size=None, payment_method=None, flow_version=None):
+        """
+        Create dialog continuing saved order on flow version it was started on,
+        on initial state if the flow has no such state
+        """
+        self.start_dialog(dialog, self.find_flow(flow_version))
+        order, flow = self.dialogs[dialog]
+        order.pizza_size = pizza_size
+        order.payment_method = payment_method
+        if state in flow.codes:
+            order.step = flow.codes[state]
+            order.state = state
+
+    def run_turn(self, dialog, order, state):
+        """Advance order along its flow by dialog input, messages are not flushed"""
+        flow = self.dialogs[dialog][1]
+        step = flow.steps[order.step]
+        chat_input = dialog.get_input()
+        if chat_input is not None:
+            chat_input = step.matcher.match(chat_input, self.INVALID)
+        metrics.TURNS.inc(state, self.input_label(chat_input))
+
+        with tracing.tracer.span('transition', getattr(dialog, 'chat', None), state=state):
+            self.handle_step(dialog, order, flow, step, chat_input)
+
+    def handle_step(self, dialog, order, flow, step, chat_input):
+        # No input yet is greeting, invalid input is asked again with variants
+        if chat_input is None or chat_input is self.INVALID:
+            dialog.send_message(flow.prompt(step, order))
+            if chat_input is not None:
+                dialog.send_message(step.repeat)
+            return
+
+        step.setter(order, chat_input)
+        if step.next is not None:
+            next_step = flow.steps[step.next]
+            order.step = step.next
+            order.state = next_step.name
+            analytics.ANALYTICS.reach(order.state)
+            dialog.send_message(flow.prompt(next_step, order))
+            return
+
+        analytics.ANALYTICS.decide(order)
+        if order.is_confirmed:
+            dialog.send_message(step.success)
+            self.place_order(dialog, order)
+        # Next order goes by the flow loaded now
+        self.start_dialog(dialog)
+        order, flow = self.dialogs[dialog]
+        analytics.ANALYTICS.reach(order.state)
+        dialog.send_message(flow.prompt(flow.steps[order.step], order))
@@ -4,6 +4,8 @@ class Dialog(object):
     """
     Interface present given user in certain chat system
     """
+    __slots__ = ()
+
     def reset_input(self):
         """Reset input before dialog has started"""
         raise NotImplementedError()
@@ -16,14 +18,39 @@ class Dialog(object):
         """Send message to user"""
         raise NotImplementedError()
 
+    def flush_messages(self):
+        """Deliver messages buffered during the turn, if dialog buffers them"""
+
+
+class AsyncDialog(Dialog):
+    """
+    Dialog delivering messages without blocking, used by AsyncPizzaBot:
+    messages sent during the turn are buffered and delivered by awaited
+    flush_messages
+    """
+    __slots__ = ()
+
+    def send_message(self, message):
+        """Buffer message to user"""
+        raise NotImplementedError()
+
+    async def flush_messages(self):
+        """Deliver messages buffered during the turn"""
+        raise NotImplementedError()
+
 
 class Order(object):
     SMALL_SIZE, BIG_SIZE = range(2)
     PAY_CHECK, PAY_CARD = range(2)
 
-    pizza_size = None
-    payment_method = None
-    is_confirmed = None
+    # Fields are kept in slots to make idle sessions cheap, `__dict__` is left
+    # for state machines attaching their triggers to the model
+    __slots__ = ('state', 'pizza_size', 'payment_method', 'is_confirmed', '__dict__')
+
+    def __init__(self):
+        self.pizza_size = None
+        self.payment_method = None
+        self.is_confirmed = None
 
     @property
     def size_description(self):
@@ -54,3 +81,8 @@ class Order(object):
 class TransactionManager(object):
     def create_order(self, order: Order, dialog: Dialog):
         raise NotImplementedError()
+
+
+class AsyncTransactionManager(TransactionManager):
+    async def create_order(self, dialog: Dialog, order: Order):
+        raise NotImplementedError()
@@ -0,0 +1,63 @@
+
+import json
+import os
+import queue
+import time
+from pizza_bot.background import BatchWriter
+from pizza_bot.interface import AsyncTransactionManager, Dialog, Order, TransactionManager
+
+
+class JournalTransactionManager(BatchWriter, TransactionManager):
+    """
+    Orders appended to JSON lines journal file by background thread.
+
+    `create_order` only queues the order, queue is bounded so producers are
+    slowed down instead of piling up memory when disk lags behind. Each batch
+    is flushed and fsynced once, `close` writes everything acknowledged.
+    A batch is appended by single write call, so processes may share journal.
+    """
+    def __init__(self, path, max_queue=10000, max_batch=1000):
+        super(JournalTransactionManager, self).__init__(max_queue=max_queue, max_batch=max_batch)
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.start()
+
+    def create_order(self, dialog: Dialog, order: Order):
+        self.submit(self.record(dialog, order))
+
+    def record(self, dialog, order):
+        """Journal record for the order"""
+        return dict(
+            time=time.time(),
+            chat=getattr(dialog, 'chat', None),
+            # Order confirmation update, same for order created again after crash
+            update_id=getattr(dialog, 'update_id', None),
+            pizza_size=order.pizza_size,
+            payment_method=order.payment_method,
+            is_confirmed=order.is_confirmed,
+        )
+
+    def write_batch(self, items):
+        data = ''.join(json.dumps(item, ensure_ascii=False) + '\n' for item in items)
+        os.write(self.fd, data.encode('utf-8'))
+        os.fsync(self.fd)
+
+    def close(self):
+        """Write queued orders and close journal"""
+        super(JournalTransactionManager, self).close()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class AsyncJournalTransactionManager(JournalTransactionManager, AsyncTransactionManager):
+    """
+    JournalTransactionManager for AsyncPizzaBot, waits for full queue off the event loop
+    """
+    async def create_order(self, dialog: Dialog, order: Order):
+        record = self.record(dialog, order)
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            import asyncio
+            await asyncio.get_event_loop().run_in_executor(None, self.submit, record)
@@ -0,0 +1,76 @@
+
+class MachineError(Exception):
+    """Trigger called from a state it has no transition for"""
+
+
+class CompiledMachine(object):
+    """
+    States and transitions compiled once into flat lookup tables.
+
+    Unlike transitions.Machine, which is built per model, one instance is
+    shared by all models: trigger and `is_<state>` methods live on a model
+    class generated at compile time, so each model holds only its state.
+    """
+    def __init__(self, model_class, states, transitions, initial):
+        if initial not in states:
+            raise ValueError('Unknown initial state {!r}'.format(initial))
+        self.states = tuple(states)
+        self.initial = initial
+
+        # trigger -> {source: (dest, before, after)}
+        self.table = dict()
+        for transition in transitions:
+            dest = transition['dest']
+            sources = transition['source']
+            if isinstance(sources, str):
+                sources = [sources]
+            for source in sources:
+                for state in (source, dest):
+                    if state not in self.states:
+                        raise ValueError('Unknown state {!r}'.format(state))
+                edges = self.table.setdefault(transition['trigger'], dict())
+                edges[source] = (dest, transition.get('before'), transition.get('after'))
+
+        attrs = dict(machine=self)
+        for trigger, edges in self.table.items():
+            attrs[trigger] = self.make_trigger(trigger, edges)
+        for state in self.states:
+            attrs['is_{}'.format(state)] = self.make_check(state)
+        if hasattr(model_class, '__slots__'):
+            attrs['__slots__'] = ()
+        self.model_class = type(model_class.__name__, (model_class,), attrs)
+
+    @staticmethod
+    def make_trigger(trigger, edges):
+        def fire(model, *args, **kwargs):
+            try:
+                dest, before, after = edges[model.state]
+            except KeyError:
+                raise MachineError("Can't trigger event {} from state {}".format(trigger, model.state))
+            if before is not None:
+                getattr(model, before)(*args, **kwargs)
+            model.state = dest
+            if after is not None:
+                getattr(model, after)(*args, **kwargs)
+            return True
+        fire.__name__ = trigger
+        return fire
+
+    @staticmethod
+    def make_check(state):
+        def check(model):
+            return model.state == state
+        check.__name__ = 'is_{}'.format(state)
+        return check
+
+    def create_model(self):
+        """Create model in initial state"""
+        model = self.model_class()
+        model.state = self.initial
+        return model
+
+    def set_state(self, state, model):
+        """Force model into given state, bypassing transitions"""
+        if state not in self.states:
+            raise ValueError('Unknown state {!r}'.format(state))
+        model.state = state
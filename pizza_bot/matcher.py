@@ -0,0 +1,93 @@
+
+def within_one_edit(a, b):
+    """Whether strings differ by at most one insertion, deletion, substitution or adjacent swap"""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+
+    # Skip common prefix, then rest must match after the single edit
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) < len(b):
+        return a[i:] == b[i + 1:]
+    return a[i + 1:] == b[i + 1:] or (a[i + 2:] == b[i + 2:] and a[i:i + 2] == b[i:i + 2][::-1])
+
+
+class VariantMatcher(object):
+    """
+    Matcher of user input against variants of a state, compiled once.
+
+    Besides exact words, case-insensitive, it accepts:
+    - words typed in latin keyboard layout, 'lf' for 'да',
+    - other inflections sharing word stem, 'большая' for 'большую',
+    - typos in longer words: one missing, extra, wrong or swapped letter.
+    Input close to variants with different values is not matched.
+    """
+    layout = str.maketrans(
+        "qwertyuiop[]asdfghjkl;'zxcvbnm,.`",
+        'йцукенгшщзхъфывапролджэячсмитьбюё')
+    punctuation = '.,!?'
+    min_stem = 4  # shortest stem shared by inflections
+    max_ending = 4  # longest ending after stem
+    min_fuzzy = 4  # shortest word typos are looked for
+
+    def __init__(self, variants: dict):
+        self.variants = variants
+        self.exact = dict()
+        self.stems = dict()
+        self.deletes = dict()
+
+        ambiguous = set()
+        for word, value in variants.items():
+            word = word.lower()
+            self.exact[word] = value
+
+            for size in range(max(self.min_stem, len(word) - self.max_ending), len(word) + 1):
+                stem = word[:size]
+                if self.stems.get(stem, value) != value:
+                    ambiguous.add(stem)
+                self.stems[stem] = value
+
+            if len(word) >= self.min_fuzzy:
+                for i in range(len(word)):
+                    self.deletes.setdefault(word[:i] + word[i + 1:], set()).add(word)
+
+        for stem in ambiguous:
+            del self.stems[stem]
+
+    def match(self, text: str, default=None):
+        """Value of variant matching text or default"""
+        text = text.lower().strip()
+        value = self.match_word(text.strip(self.punctuation))
+        if value is self:
+            # Punctuation keys are letters in the other layout
+            value = self.match_word(text.translate(self.layout).strip(self.punctuation))
+        return default if value is self else value
+
+    def match_word(self, word):
+        value = self.exact.get(word, self)
+        if value is not self:
+            return value
+
+        # Longest stem first
+        for size in range(len(word), max(self.min_stem, len(word) - self.max_ending) - 1, -1):
+            value = self.stems.get(word[:size], self)
+            if value is not self:
+                return value
+
+        if len(word) < self.min_fuzzy - 1:
+            return self
+        candidates = set(self.deletes.get(word, ()))
+        for i in range(len(word)):
+            deleted = word[:i] + word[i + 1:]
+            if deleted in self.exact and len(deleted) >= self.min_fuzzy:
+                candidates.add(deleted)
+            candidates.update(self.deletes.get(deleted, ()))
+        values = {self.exact[candidate] for candidate in candidates if within_one_edit(word, candidate)}
+        if len(values) == 1:
+            return values.pop()
+        return self
@@ -0,0 +1,204 @@
+
+import bisect
+import threading
+
+
+class Metric(object):
+    """
+    Metric values kept per thread and summed on collection.
+
+    Recording thread updates its own dict, a lock is taken only once per
+    thread to register it, so worker threads never contend on metrics.
+    Dicts of finished threads are merged into `retired` and dropped, so
+    short lived request threads do not pile them up.
+    """
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.local = threading.local()
+        self.shards = []  # (thread, values) of threads recording
+        self.retired = dict()
+        self.lock = threading.Lock()
+
+    def values(self):
+        """Dict of this thread, values by tuple of label values"""
+        try:
+            return self.local.values
+        except AttributeError:
+            values = self.local.values = dict()
+            with self.lock:
+                self.retire()
+                self.shards.append((threading.current_thread(), values))
+            return values
+
+    def retire(self):
+        """Merge dicts of finished threads into retired values, lock is held"""
+        shards = []
+        for thread, values in self.shards:
+            if thread.is_alive():
+                shards.append((thread, values))
+                continue
+            for key, value in values.items():
+                self.merge(self.retired, key, value)
+        self.shards = shards
+
+    def merge(self, totals, key, value):
+        """Add value to totals, new objects are stored so copies stay intact"""
+        raise NotImplementedError()
+
+    def collect_shards(self):
+        """Items of all thread dicts, dict copy is atomic for the interpreter"""
+        with self.lock:
+            self.retire()
+            shards = [values for thread, values in self.shards]
+            retired = list(self.retired.items())
+        yield from retired
+        for values in shards:
+            yield from list(values.items())
+
+    def totals(self):
+        """Values summed over threads by tuple of label values"""
+        totals = dict()
+        for key, value in self.collect_shards():
+            self.merge(totals, key, value)
+        return totals
+
+    def format_labels(self, key, extra=()):
+        pairs = list(zip(self.labels, key)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(name, value) for name, value in pairs) + '}'
+
+    def samples(self, extra=()):
+        """Yield (suffix, labels, value) of the metric, extra (name, value) labels added to all"""
+        raise NotImplementedError()
+
+    def expose(self, extra=()):
+        """Metric in Prometheus text format, extra (name, value) labels added to all samples"""
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} {}'.format(self.name, self.type)]
+        for suffix, labels, value in self.samples(extra):
+            lines.append('{}{}{} {}'.format(self.name, suffix, labels, value))
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    """Monotonic counter"""
+    type = 'counter'
+
+    def inc(self, *key, amount=1):
+        values = self.values()
+        values[key] = values.get(key, 0) + amount
+
+    def merge(self, totals, key, value):
+        totals[key] = totals.get(key, 0) + value
+
+    def total(self, *key):
+        return sum(value for label_values, value in self.collect_shards() if label_values == key)
+
+    def samples(self, extra=()):
+        totals = self.totals()
+        for key in sorted(totals, key=str):
+            yield '', self.format_labels(key, extra), totals[key]
+
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed buckets"""
+    type = 'histogram'
+    buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name, help, labels=(), buckets=None):
+        super(Histogram, self).__init__(name, help, labels)
+        if buckets is not None:
+            self.buckets = tuple(buckets)
+
+    def observe(self, value, *key):
+        values = self.values()
+        counts = values.get(key)
+        if counts is None:
+            # Count per bucket, last one is +Inf, then sum of values
+            counts = values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def merge(self, totals, key, counts):
+        total = totals.get(key)
+        counts = list(counts)
+        totals[key] = counts if total is None else [a + b for a, b in zip(total, counts)]
+
+    def samples(self, extra=()):
+        totals = self.totals()
+        for key in sorted(totals, key=str):
+            counts = totals[key]
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield '_bucket', self.format_labels(key, list(extra) + [('le', bound)]), cumulative
+            yield '_sum', self.format_labels(key, extra), counts[-1]
+            yield '_count', self.format_labels(key, extra), cumulative
+
+
+class Gauge(Metric):
+    """Current value read from a function on collection"""
+    type = 'gauge'
+
+    def __init__(self, name, help, function=None):
+        super(Gauge, self).__init__(name, help)
+        self.function = function
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self, extra=()):
+        if self.function is not None:
+            yield '', self.format_labels((), extra), self.function()
+
+
+class Registry(object):
+    """Metrics exposed together"""
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def expose(self, extra=()):
+        """All metrics in Prometheus text format, extra (name, value) labels added to all samples"""
+        return ''.join(metric.expose(extra) for metric in self.metrics)
+
+
+REGISTRY = Registry()
+
+TURNS = REGISTRY.register(Counter(
+    'pizza_bot_turns_total', 'Conversation turns by state and input: valid, invalid or none', ('state', 'input')))
+TURN_SECONDS = REGISTRY.register(Histogram(
+    'pizza_bot_turn_seconds', 'Conversation turn duration by state, sending replies included', ('state',)))
+SEND_SECONDS = REGISTRY.register(Histogram(
+    'pizza_bot_send_seconds', 'Bot API sendMessage request duration'))
+SEND_ERRORS = REGISTRY.register(Counter(
+    'pizza_bot_send_errors_total', 'Bot API sendMessage requests failed'))
+SEND_RETRIES = REGISTRY.register(Counter(
+    'pizza_bot_send_retries_total', 'Bot API sendMessage requests retried by outbox'))
+SEND_DROPPED = REGISTRY.register(Counter(
+    'pizza_bot_send_dropped_total', 'Messages outbox gave up on'))
+REPLAYS = REGISTRY.register(Counter(
+    'pizza_bot_replayed_updates_total', 'Updates dropped as delivered again'))
+ORDERS = REGISTRY.register(Counter(
+    'pizza_bot_orders_total', 'Confirmed orders passed to transaction manager'))
+SESSIONS = REGISTRY.register(Gauge(
+    'pizza_bot_sessions', 'Live chat sessions'))
+PURGES = REGISTRY.register(Counter(
+    'pizza_bot_purges_total', 'Runs of expired sessions purge'))
+PURGED = REGISTRY.register(Counter(
+    'pizza_bot_purged_sessions_total', 'Expired sessions purged'))
+
+
+def start_http_server(port, host='0.0.0.0', registry=REGISTRY):
+    """Serve metrics in background thread, returns the server"""
+    from pizza_bot.metrics_server import MetricsServer
+    server = MetricsServer(host, port, registry)
+    threading.Thread(target=server.serve_forever, name='Metrics', daemon=True).start()
+    return server
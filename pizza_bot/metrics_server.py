@@ -0,0 +1,34 @@
+
+import logging
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        try:
+            body = self.server.registry.expose().encode('utf-8')
+        except Exception as e:
+            logging.exception(e)
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    """Serves `GET /metrics` for Prometheus scraping"""
+    daemon_threads = True
+
+    def __init__(self, host, port, registry):
+        super(MetricsServer, self).__init__((host, port), MetricsHandler)
+        self.registry = registry
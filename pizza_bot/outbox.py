@@ -0,0 +1,121 @@
+
+import logging
+import queue
+import random
+import threading
+import time
+from collections import deque
+from pizza_bot import metrics, tracing
+
+
+class Outbox(object):
+    """
+    Messages queued by `send_message` and delivered by pool of sender threads.
+
+    Callers return at once, Bot API latency and failures stay here. Messages
+    of one chat are delivered one at a time in queued order, a chat waiting
+    for retry holds one sender only. Temporary failures are retried with
+    exponential backoff and full jitter, 429 responses after `retry_after`.
+    Sends take RateLimiter permits when limiter is given.
+    """
+    STOP = object()
+
+    def __init__(self, bot, limiter=None, senders=8, max_retries=5, base_delay=0.5, max_delay=30.0):
+        self.bot = bot
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.pending = dict()  # chat -> deque of texts, while chat is queued or sending
+        self.lock = threading.Lock()
+        self.ready = queue.Queue()  # chats with messages and no sender
+        self.threads = [
+            threading.Thread(target=self.run, name='Sender-{}'.format(index), daemon=True)
+            for index in range(senders)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def __len__(self):
+        """Number of chats with undelivered messages"""
+        return len(self.pending)
+
+    def send_message(self, chat_id, text):
+        """Queue message for delivery"""
+        with self.lock:
+            texts = self.pending.get(chat_id)
+            if texts is not None:
+                texts.append(text)
+                return
+            self.pending[chat_id] = deque([text])
+        self.ready.put(chat_id)
+
+    def flush(self):
+        """Wait until queued messages are delivered or dropped"""
+        self.ready.join()
+
+    def close(self):
+        """Deliver queued messages and stop senders"""
+        self.flush()
+        for _ in self.threads:
+            self.ready.put(self.STOP)
+        for thread in self.threads:
+            thread.join()
+
+    def run(self):
+        while True:
+            chat_id = self.ready.get()
+            try:
+                if chat_id is self.STOP:
+                    return
+                with self.lock:
+                    text = self.pending[chat_id][0]
+                self.deliver(chat_id, text)
+                with self.lock:
+                    texts = self.pending[chat_id]
+                    texts.popleft()
+                    more = bool(texts)
+                    if not more:
+                        del self.pending[chat_id]
+                if more:
+                    # Back of the queue, other chats go first
+                    self.ready.put(chat_id)
+            except Exception as e:
+                logging.exception(e)
+            finally:
+                self.ready.task_done()
+
+    def deliver(self, chat_id, text):
+        """Send message, retrying temporary failures. Returns whether sent"""
+        for attempt in range(self.max_retries + 1):
+            if self.limiter is not None:
+                self.limiter.acquire(chat_id)
+            started = time.perf_counter()
+            try:
+                with tracing.tracer.span('deliver', chat_id, attempt=attempt):
+                    self.bot.send_message(chat_id, text)
+                error = None
+            except Exception as e:
+                error = e
+            metrics.SEND_SECONDS.observe(time.perf_counter() - started)
+            if error is None:
+                return True
+
+            metrics.SEND_ERRORS.inc()
+            delay = self.retry_delay(error, attempt)
+            if delay is None or attempt == self.max_retries:
+                metrics.SEND_DROPPED.inc()
+                logging.error('Message to chat {} dropped after {} attempts: {!r}'.format(chat_id, attempt + 1, error))
+                return False
+            metrics.SEND_RETRIES.inc()
+            logging.warning('Message to chat {} failed, retry in {:.2f}s: {!r}'.format(chat_id, delay, error))
+            time.sleep(delay)
+
+    def retry_delay(self, error, attempt):
+        """Seconds to wait before retrying after error, None if it is permanent"""
+        import telegram
+        if isinstance(error, telegram.error.RetryAfter):
+            return error.retry_after
+        if isinstance(error, telegram.error.BadRequest) or not isinstance(error, telegram.error.NetworkError):
+            return None
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
@@ -0,0 +1,72 @@
+
+import logging
+import random
+import time
+from collections import OrderedDict
+
+
+def group_by_chat(updates):
+    """Updates with text message grouped by chat, in order of first update of each chat"""
+    chats = OrderedDict()
+    for update in updates:
+        if update.message is None or not isinstance(update.message.text, str):
+            logging.debug('Skip update without text message')
+            continue
+        chats.setdefault(update.message.chat_id, []).append(update)
+    return chats
+
+
+class LongPoller(object):
+    """
+    Fetches updates by getUpdates long polling and passes them on in batches.
+
+    Offset moves past a batch only once `handle_batch(updates)` returned,
+    so updates of unfinished batch are fetched again after restart.
+    Updates seen by UpdateWindow `window` are dropped when it is given,
+    they are marked seen only once handled, so a failed batch is handled
+    again on the next poll.
+    """
+    def __init__(self, bot, handle_batch, limit=100, timeout=30, max_delay=30.0, window=None):
+        self.bot = bot
+        self.window = window
+        self.handle_batch = handle_batch
+        self.limit = limit
+        self.timeout = timeout
+        self.max_delay = max_delay
+        self.offset = None
+        self.failures = 0
+        self.stopped = False
+
+    def poll(self):
+        """Fetch and handle one batch, returns number of updates"""
+        updates = self.bot.get_updates(offset=self.offset, limit=self.limit, timeout=self.timeout)
+        if updates:
+            fresh = updates
+            if self.window is not None:
+                fresh_ids = set(self.window.fresh([update.update_id for update in updates]))
+                fresh = [update for update in updates if update.update_id in fresh_ids]
+            if fresh:
+                self.handle_batch(fresh)
+                if self.window is not None:
+                    self.window.mark([update.update_id for update in fresh])
+            self.offset = updates[-1].update_id + 1
+        return len(updates)
+
+    def run(self, idle=None):
+        """Poll until stopped, `idle()` is called between batches"""
+        while not self.stopped:
+            try:
+                self.poll()
+                self.failures = 0
+            except Exception as e:
+                # Back off while Bot API is unavailable
+                self.failures += 1
+                delay = random.uniform(0, min(self.max_delay, 2 ** self.failures))
+                logging.error('Polling failed, retry in {:.1f}s: {!r}'.format(delay, e))
+                time.sleep(delay)
+            if idle is not None:
+                idle()
+
+    def stop(self):
+        """Stop after current batch"""
+        self.stopped = True
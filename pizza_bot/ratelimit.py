@@ -0,0 +1,175 @@
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+
+
+class TokenBucket(object):
+    """Tokens refilled at `rate` per second up to `capacity`"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available"""
+        self.refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def take(self, now):
+        self.refill(now)
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+
+class RateLimiter(object):
+    """
+    Send permits paced by global and per-chat token buckets, Telegram limits
+    are 30 messages per second overall and 1 per second to one chat.
+
+    Waiting chats are served round-robin: a chat with many queued messages
+    gets one permit per turn, so it cannot starve others of the global rate.
+    Permits of one chat are granted in request order. Scheduler thread only
+    grants permits, requests themselves are made by the waiting threads.
+    """
+    sweep_interval = 60  # seconds between dropping buckets of idle chats
+
+    def __init__(self, global_rate=30.0, chat_rate=1.0, global_burst=30, chat_burst=1):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.bucket = TokenBucket(global_rate, global_burst, time.monotonic())
+        self.chat_buckets = dict()
+        self.waiters = dict()  # chat -> deque of grant callbacks
+        self.ready = deque()  # chats with waiters and a token, in turn order
+        self.blocked = []  # heap of (time token is available, sequence, chat)
+        self.sequence = itertools.count()
+        self.swept = time.monotonic()
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name='RateLimiter', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+
+    def request(self, chat_id, grant):
+        """Call `grant()` on scheduler thread when message to chat may be sent"""
+        with self.condition:
+            waiters = self.waiters.get(chat_id)
+            if waiters is not None:
+                waiters.append(grant)
+                return
+            self.waiters[chat_id] = deque([grant])
+            self.schedule(chat_id, time.monotonic())
+            self.condition.notify()
+
+    def acquire(self, chat_id):
+        """Block until message to chat may be sent"""
+        event = threading.Event()
+        self.request(chat_id, event.set)
+        event.wait()
+
+    async def acquire_async(self, chat_id):
+        """Wait until message to chat may be sent, without blocking event loop"""
+        import asyncio
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+
+        def resolve():
+            if not future.done():
+                future.set_result(None)
+        self.request(chat_id, lambda: loop.call_soon_threadsafe(resolve))
+        await future
+
+    def schedule(self, chat_id, now):
+        """Put chat with waiters in turn, or aside until its bucket refills"""
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst, now)
+        wait = bucket.wait_time(now)
+        if wait:
+            heapq.heappush(self.blocked, (now + wait, next(self.sequence), chat_id))
+        else:
+            self.ready.append(chat_id)
+
+    def run(self):
+        with self.condition:
+            while not self.stopped:
+                now = time.monotonic()
+                while self.blocked and self.blocked[0][0] <= now:
+                    self.ready.append(heapq.heappop(self.blocked)[2])
+
+                if not self.ready:
+                    self.condition.wait(self.blocked[0][0] - now if self.blocked else None)
+                    continue
+
+                wait = self.bucket.wait_time(now)
+                if wait:
+                    self.condition.wait(wait)
+                    continue
+
+                chat_id = self.ready.popleft()
+                self.bucket.take(now)
+                self.chat_buckets[chat_id].take(now)
+                waiters = self.waiters[chat_id]
+                grant = waiters.popleft()
+                if waiters:
+                    self.schedule(chat_id, now)
+                else:
+                    del self.waiters[chat_id]
+                try:
+                    grant()
+                except Exception as e:
+                    logging.exception(e)
+
+                if now - self.swept > self.sweep_interval:
+                    self.sweep(now)
+
+    def sweep(self, now):
+        """Drop full buckets of chats without waiters, they start full anyway"""
+        self.swept = now
+        for chat_id in [chat_id for chat_id, bucket in self.chat_buckets.items()
+                        if chat_id not in self.waiters and bucket.is_full(now)]:
+            del self.chat_buckets[chat_id]
+
+
+class RateLimitedBot(object):
+    """Bot sending messages once RateLimiter permits, for TelegramDialog"""
+    def __init__(self, bot, limiter):
+        self.bot = bot
+        self.limiter = limiter
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.limiter.acquire(chat_id)
+        return self.bot.send_message(chat_id, text, **kwargs)
+
+
+class AsyncRateLimitedBotApi(object):
+    """AsyncBotApi sending messages once RateLimiter permits, for AsyncTelegramDialog"""
+    def __init__(self, api, limiter):
+        self.api = api
+        self.limiter = limiter
+
+    async def send_message(self, chat_id, text):
+        await self.limiter.acquire_async(chat_id)
+        return await self.api.send_message(chat_id, text)
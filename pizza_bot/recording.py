@@ -0,0 +1,155 @@
+
+import functools
+import mmap
+import os
+import queue
+import struct
+import time
+from pizza_bot.background import BatchWriter
+from pizza_bot.interface import Dialog
+
+# Recording file starts with MAGIC, each record is RECORD header followed by
+# UTF-8 text of header's length: text length, chat id, unix time received
+MAGIC = b'PZREC1\n'
+RECORD = struct.Struct('<Hqd')
+MAX_TEXT = 0xffff
+
+
+def encode_record(chat_id, text, timestamp):
+    data = text.encode('utf-8')[:MAX_TEXT]
+    return RECORD.pack(len(data), chat_id, timestamp) + data
+
+
+def read_records(path):
+    """
+    Yield (chat_id, text, timestamp) of recording, file is memory mapped.
+    Record cut short by crash of recording process ends the stream.
+    """
+    with open(path, 'rb') as f:
+        if not os.fstat(f.fileno()).st_size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[:len(MAGIC)] != MAGIC:
+                raise ValueError('Not an update recording: {}'.format(path))
+            offset, end = len(MAGIC), len(data)
+            while offset + RECORD.size <= end:
+                length, chat_id, timestamp = RECORD.unpack_from(data, offset)
+                offset += RECORD.size
+                if offset + length > end:
+                    return
+                yield chat_id, data[offset:offset + length].decode('utf-8', 'ignore'), timestamp
+                offset += length
+
+
+class Recorder(BatchWriter):
+    """
+    Incoming text messages appended to binary recording by background thread.
+
+    Records are dropped rather than delaying updates when writer falls
+    behind. A batch is appended by single write call, so processes may
+    share recording.
+    """
+    def __init__(self, path, max_queue=10000, max_batch=1000):
+        super(Recorder, self).__init__(max_queue=max_queue, max_batch=max_batch)
+        self.path = path
+        self.dropped = 0
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if not os.fstat(self.fd).st_size:
+            os.write(self.fd, MAGIC)
+        self.start()
+
+    def record(self, chat_id, text, timestamp=None):
+        try:
+            self.queue.put_nowait(encode_record(chat_id, text, time.time() if timestamp is None else timestamp))
+        except queue.Full:
+            self.dropped += 1
+
+    def record_update(self, update):
+        """Record update with text message, others are not replayed"""
+        message = update.message
+        if message is not None and message.text is not None:
+            self.record(message.chat_id, message.text)
+
+    def write_batch(self, items):
+        os.write(self.fd, b''.join(items))
+
+    def close(self):
+        """Write queued records and close recording"""
+        super(Recorder, self).close()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def record_updates(recorder, handler):
+    """
+    Wrap update handler taking update or list of updates as last argument,
+    updates are recorded before they are handled
+    """
+    @functools.wraps(handler)
+    def recording_handler(*args):
+        updates = args[-1]
+        for update in updates if isinstance(updates, list) else (updates,):
+            recorder.record_update(update)
+        return handler(*args)
+    return recording_handler
+
+
+class ReplayDialog(Dialog):
+    """Dialog of replayed chat, input comes from recording and replies are counted"""
+    __slots__ = ('chat', 'message', 'sent')
+
+    def __init__(self, chat):
+        super(ReplayDialog, self).__init__()
+        self.chat = chat
+        self.message = None
+        self.sent = 0
+
+    def reset_input(self):
+        self.message = None
+
+    def get_input(self):
+        return self.message
+
+    def send_message(self, message):
+        self.sent += 1
+
+
+class Replayer(object):
+    """
+    Feeds recorded messages to PizzaBot the way message_handler does.
+
+    Messages go as fast as possible, or at recorded pacing divided by `speed`.
+    """
+    def __init__(self, pizza_bot, speed=None):
+        self.pizza_bot = pizza_bot
+        self.speed = speed
+        self.dialogs = dict()
+        self.processed = 0
+
+    def replay(self, records):
+        """Process (chat_id, text, timestamp) records, returns number processed"""
+        started = time.monotonic()
+        first = None
+        count = self.processed
+        for chat_id, text, timestamp in records:
+            if self.speed:
+                if first is None:
+                    first = timestamp
+                delay = (timestamp - first) / self.speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            self.process(chat_id, text)
+        return self.processed - count
+
+    def process(self, chat_id, text):
+        dialog = self.dialogs.get(chat_id)
+        is_chat_start = dialog is None
+        if is_chat_start:
+            dialog = self.dialogs[chat_id] = ReplayDialog(chat_id)
+        dialog.message = text
+
+        if is_chat_start:
+            self.pizza_bot.on_chat_start(dialog)
+        self.pizza_bot.on_chat_input(dialog)
+        self.processed += 1
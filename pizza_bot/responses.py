@@ -0,0 +1,32 @@
+
+from pizza_bot.interface import Order
+
+
+class Responses(object):
+    """
+    Formatted texts of PizzaBot rendered once: variants lists per state and
+    order confirmations for every pizza size and payment method.
+    """
+    sizes = Order.SMALL_SIZE, Order.BIG_SIZE
+    payments = Order.PAY_CHECK, Order.PAY_CARD
+
+    def __init__(self, messages: dict, variants: dict):
+        self.messages = messages
+        self.variants = variants
+
+        self.please_repeat = dict()
+        template = messages.get('please_repeat')
+        if template is not None:
+            for state, state_variants in variants.items():
+                self.please_repeat[state] = template.format(variants=', '.join(state_variants.keys()))
+
+        # (pizza_size, payment_method) -> text
+        self.confirm_pick = dict()
+        template = messages.get('confirm_pick')
+        if template is not None:
+            order = Order()
+            for order.pizza_size in self.sizes:
+                for order.payment_method in self.payments:
+                    key = order.pizza_size, order.payment_method
+                    self.confirm_pick[key] = template.format(
+                        pizza_size=order.size_description, payment_type=order.payment_description)
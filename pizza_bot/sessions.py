@@ -0,0 +1,119 @@
+
+import threading
+import time
+from collections import OrderedDict
+from pizza_bot.storage import SessionRecord
+
+
+class SessionRegistry(object):
+    """
+    Live chat sessions: dialogs by chat key together with their PizzaBot state.
+
+    Sessions are kept in least recently used order. Every input moves session
+    to the end, so the order matches `last_received` of dialogs and expired
+    sessions are always found at the front: purging costs time proportional
+    to number of expired sessions, not all of them.
+
+    With a store given, sessions are checkpointed after every input and
+    restored lazily when chat unknown to the registry sends a message.
+    Sessions evicted by `max_sessions` are kept in the store. Saved sessions
+    without input for `threshold` seconds are expired and start over, as they
+    would have been purged if they were live.
+    """
+    def __init__(self, pizza_bot, dialog_factory, max_sessions=None, store=None, threshold=None):
+        self.pizza_bot = pizza_bot
+        self.dialog_factory = dialog_factory
+        self.max_sessions = max_sessions
+        self.store = store
+        self.threshold = threshold
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def __contains__(self, key):
+        return key in self.sessions
+
+    def open(self, key):
+        """
+        Get dialog for given key, creating new one when chat is unknown.
+        Returns (dialog, is_new) pair, new dialogs are not started yet,
+        dialogs restored from the store are not new.
+        """
+        evicted = []
+        with self.lock:
+            dialog = self.sessions.get(key)
+            if dialog is not None:
+                self.sessions.move_to_end(key)
+                return dialog, False
+
+            dialog = self.dialog_factory()
+            self.sessions[key] = dialog
+            is_new = not self.restore(key, dialog)
+            if self.max_sessions is not None:
+                while len(self.sessions) > self.max_sessions:
+                    evicted.append(self.sessions.popitem(last=False)[1])
+
+        for old_dialog in evicted:
+            self.end(old_dialog)
+        return dialog, is_new
+
+    def restore(self, key, dialog):
+        """Restore dialog from the store, returns whether it was saved and not expired"""
+        record = self.store and self.store.load(key)
+        if not record:
+            return False
+        if self.threshold is not None and record.last_received < time.time() - self.threshold:
+            return False
+        self.pizza_bot.restore_dialog(
+            dialog, record.state, record.pizza_size, record.payment_method, record.flow_version)
+        dialog.last_received = record.last_received
+        if record.update_id is not None:
+            dialog.update_id = record.update_id
+        return True
+
+    def save(self, key, dialog):
+        """Checkpoint dialog state to the store"""
+        if self.store is None or dialog not in self.pizza_bot.dialogs:
+            return
+        order, machine = self.pizza_bot.dialogs[dialog]
+        record = SessionRecord(
+            order.state, order.pizza_size, order.payment_method, dialog.last_received,
+            getattr(dialog, 'update_id', None), getattr(order, 'flow_version', None))
+        self.store.save(key, record)
+
+    def close(self, key):
+        """Drop session for given key"""
+        with self.lock:
+            dialog = self.sessions.pop(key, None)
+        if dialog is not None:
+            self.end(dialog)
+        if self.store is not None:
+            self.store.delete(key)
+
+    def purge(self, timestamp, purge_store=True):
+        """
+        Drop sessions without input since given timestamp, returns their number.
+        Records of the store are purged too unless purge_store is false, for
+        registries sharing store purged once by the caller.
+        """
+        expired = []
+        with self.lock:
+            while self.sessions:
+                dialog = next(iter(self.sessions.values()))
+                # Sessions not received anything yet are just being created
+                if dialog.last_received is None or dialog.last_received >= timestamp:
+                    break
+                expired.append(self.sessions.popitem(last=False)[1])
+
+        for dialog in expired:
+            self.end(dialog)
+        if purge_store and self.store is not None:
+            self.store.purge(timestamp)
+        return len(expired)
+
+    def end(self, dialog):
+        """Release bot conversation of removed dialog"""
+        if dialog in self.pizza_bot.dialogs:
+            self.pizza_bot.on_chat_exit(dialog)
@@ -0,0 +1,64 @@
+
+import logging
+import queue
+import threading
+
+
+class Shard(object):
+    """Worker thread owning its queue and state"""
+    STOP = object()
+
+    def __init__(self, state, name):
+        self.state = state
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name=name, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is self.STOP:
+                    return
+                callback, args = item
+                callback(self.state, *args)
+            except Exception as e:
+                logging.exception(e)
+            finally:
+                self.queue.task_done()
+
+
+class ShardedExecutor(object):
+    """
+    Work distributed across worker threads by key.
+
+    Work for a key always runs on the same shard, one item at a time: items
+    of one key are processed strictly in submit order, state of a shard is
+    touched by its thread only, different keys run in parallel.
+    """
+    def __init__(self, states):
+        self.shards = [Shard(state, 'Shard-{}'.format(index)) for index, state in enumerate(states)]
+
+    def shard_for(self, key):
+        return self.shards[hash(key) % len(self.shards)]
+
+    def submit(self, key, callback, *args):
+        """Run `callback(state, *args)` on the shard owning key"""
+        self.shard_for(key).queue.put((callback, args))
+
+    def broadcast(self, callback, *args):
+        """Run `callback(state, *args)` on every shard"""
+        for shard in self.shards:
+            shard.queue.put((callback, args))
+
+    def join(self):
+        """Wait until submitted work is done"""
+        for shard in self.shards:
+            shard.queue.join()
+
+    def stop(self):
+        """Finish submitted work and stop worker threads"""
+        for shard in self.shards:
+            shard.queue.put(Shard.STOP)
+        for shard in self.shards:
+            shard.thread.join()
@@ -0,0 +1,412 @@
+
+import fcntl
+import math
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+from collections import namedtuple
+from pizza_bot.background import BatchWriter
+
+
+SessionRecord = namedtuple(
+    'SessionRecord', 'state pizza_size payment_method last_received update_id flow_version reply')
+# Id of the last update processed in session, None for dialogs not from Telegram,
+# version of conversation flow the order was started on, None for built-in one,
+# and reply to that update for webhook response sent again when it is redelivered,
+# kept by SQLiteSessionStore only
+SessionRecord.__new__.__defaults__ = (None, None, None)
+
+
+class ChatLocks(object):
+    """
+    Exclusive locks of chats held across processes: byte `chat_id % stripes`
+    of lock file is locked with lockf, so chats of different stripes are
+    handled in parallel and a lock is released when its process dies.
+    Record locks belong to the process, a thread lock per stripe keeps
+    threads of the process apart as well. Closing any descriptor of the
+    file drops locks of the process, so a process keeps one ChatLocks.
+    """
+    def __init__(self, path, stripes=4096):
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self.stripes = stripes
+        self.locks = [threading.Lock() for _ in range(stripes)]
+
+    def acquire(self, chat_id):
+        stripe = chat_id % self.stripes
+        self.locks[stripe].acquire()
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, stripe)
+        except BaseException:
+            self.locks[stripe].release()
+            raise
+
+    def release(self, chat_id):
+        stripe = chat_id % self.stripes
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, stripe)
+        self.locks[stripe].release()
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SQLiteSessionStore(BatchWriter):
+    """
+    Sessions persisted to SQLite database in WAL mode.
+
+    Updates are written behind by background thread, each batch is one
+    transaction, so the caller never waits for a commit. Records not
+    committed yet are served from memory.
+    """
+    schema = (
+        'CREATE TABLE IF NOT EXISTS sessions ('
+        'chat_id INTEGER PRIMARY KEY, state TEXT NOT NULL, pizza_size INTEGER, '
+        'payment_method INTEGER, last_received REAL, update_id INTEGER, flow_version INTEGER, reply TEXT)'
+    )
+    columns = 'state, pizza_size, payment_method, last_received, update_id, flow_version, reply'
+    upsert = 'INSERT OR REPLACE INTO sessions (chat_id, {}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)'.format(columns)
+
+    def __init__(self, path, max_batch=1000):
+        super(SQLiteSessionStore, self).__init__(max_batch=max_batch)
+        self.path = path
+        self.chat_locks = None
+        self.pending = dict()
+        self.pending_lock = threading.Lock()
+        self.local = threading.local()
+
+        self.connection = self.connect(check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=FULL')
+        self.connection.execute(self.schema)
+        self.migrate()
+        self.connection.commit()
+        self.start()
+
+    def migrate(self):
+        """Add columns missing in database created by earlier version"""
+        names = [row[1] for row in self.connection.execute('PRAGMA table_info(sessions)')]
+        for name, type in (('update_id', 'INTEGER'), ('flow_version', 'INTEGER'), ('reply', 'TEXT')):
+            if name not in names:
+                self.connection.execute('ALTER TABLE sessions ADD COLUMN {} {}'.format(name, type))
+
+    def connect(self, **kwargs):
+        return sqlite3.connect(self.path, **kwargs)
+
+    def close(self):
+        """Commit pending records and close database"""
+        super(SQLiteSessionStore, self).close()
+        self.connection.close()
+        if self.chat_locks is not None:
+            self.chat_locks.close()
+
+    def load(self, chat_id):
+        """Get saved session record or None"""
+        with self.pending_lock:
+            if chat_id in self.pending:
+                return self.pending[chat_id]
+
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = self.local.connection = self.connect()
+        row = connection.execute(
+            'SELECT {} FROM sessions WHERE chat_id = ?'.format(self.columns), (chat_id,)).fetchone()
+        return row and SessionRecord(*row)
+
+    def update(self, chat_id, callback):
+        """
+        Replace record with `callback(record)` holding lock of the chat in
+        `<path>-lock` file, so processes sharing the database never interleave
+        updates of a chat. Database write lock is held only to write the
+        record, callbacks of other chats run meanwhile. Returning None from
+        callback deletes the record, nothing is written when callback fails
+        or returns the record it was given.
+        Bypasses write-behind, not to be mixed with `save` for the same chat.
+        """
+        connection = getattr(self.local, 'locking_connection', None)
+        if connection is None:
+            connection = self.local.locking_connection = self.connect(isolation_level=None, timeout=30)
+            # Commit survives process crash without waiting for fsync
+            connection.execute('PRAGMA synchronous=NORMAL')
+        if self.chat_locks is None:
+            with self.pending_lock:
+                if self.chat_locks is None:
+                    self.chat_locks = ChatLocks(self.path + '-lock')
+
+        self.chat_locks.acquire(chat_id)
+        try:
+            row = connection.execute(
+                'SELECT {} FROM sessions WHERE chat_id = ?'.format(self.columns), (chat_id,)).fetchone()
+            current = row and SessionRecord(*row)
+            record = callback(current)
+            # Single statement commits on its own
+            if record is current:
+                pass
+            elif record is None:
+                connection.execute('DELETE FROM sessions WHERE chat_id = ?', (chat_id,))
+            else:
+                connection.execute(self.upsert, (chat_id,) + record)
+        finally:
+            self.chat_locks.release(chat_id)
+        return record
+
+    def save(self, chat_id, record: SessionRecord):
+        """Save session record"""
+        with self.pending_lock:
+            self.pending[chat_id] = record
+        self.submit((chat_id, record))
+
+    def delete(self, chat_id):
+        """Delete session record"""
+        with self.pending_lock:
+            self.pending[chat_id] = None
+        self.submit((chat_id, None))
+
+    def purge(self, timestamp):
+        """Delete records without input since given timestamp"""
+        self.submit((None, timestamp))
+
+    def write_batch(self, items):
+        with self.connection:
+            for chat_id, record in items:
+                if chat_id is None:
+                    self.connection.execute('DELETE FROM sessions WHERE last_received < ?', (record,))
+                elif record is None:
+                    self.connection.execute('DELETE FROM sessions WHERE chat_id = ?', (chat_id,))
+                else:
+                    self.connection.execute(self.upsert, (chat_id,) + record)
+
+        # Committed records are served from database since now
+        with self.pending_lock:
+            for chat_id, record in items:
+                if chat_id is not None and self.pending.get(chat_id, chat_id) is record:
+                    del self.pending[chat_id]
+
+
+class SnapshotSessionStore(BatchWriter):
+    """
+    Sessions kept in versioned binary snapshot file, for single process.
+
+    Snapshot holds fixed size records sorted by chat id, found by binary
+    search over memory mapped file, so opening takes the same time for any
+    number of sessions. Changes are appended to the file tail by background
+    thread and served from memory, the tail is read back on open. Closing
+    streams snapshot and tail merged into a new snapshot.
+
+    States are stored as small codes indexing the state names of the file,
+    names not known yet are appended to the tail before first use.
+    """
+    MAGIC = b'PZSNAP'
+    VERSION = 3
+    # Magic, version, number of state names, number of sorted records
+    HEADER = struct.Struct('<6sHII')
+    # State name is its length and UTF-8 bytes
+    NAME = struct.Struct('<H')
+    # Chat id, state code, pizza size, payment method, last received, update id, flow version
+    RECORD = struct.Struct('<qhbbdqi')
+    # Tail entries besides records, by state code: deleted chat, purge with
+    # last received timestamp, state name of chat id length following entry
+    DELETED, PURGED, STATE = -1, -2, -3
+    STATES = ('idle', 'size_picked', 'payment_picked')
+
+    def __init__(self, path, max_batch=1000):
+        super(SnapshotSessionStore, self).__init__(max_batch=max_batch)
+        self.path = path
+        self.lock = threading.Lock()
+        self.tail = dict()  # chat -> record, None for deleted
+        self.purged = None  # snapshot records received earlier are purged
+        self.states = []
+        self.codes = dict()
+        self.data = None
+        self.count = 0
+        self.fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        self.read()
+        self.start()
+
+    def read(self):
+        size = os.fstat(self.fd).st_size
+        if not size:
+            os.write(self.fd, self.encode_header(self.STATES, 0))
+            size = os.fstat(self.fd).st_size
+
+        magic, version, states, self.count = self.HEADER.unpack(os.pread(self.fd, self.HEADER.size, 0))
+        if magic != self.MAGIC:
+            raise ValueError('Not a session snapshot: {}'.format(self.path))
+        if version != self.VERSION:
+            raise ValueError('Unsupported session snapshot version {}: {}'.format(version, self.path))
+        offset = self.HEADER.size
+        for _ in range(states):
+            length, = self.NAME.unpack(os.pread(self.fd, self.NAME.size, offset))
+            offset += self.NAME.size
+            self.add_state(os.pread(self.fd, length, offset).decode('utf-8'))
+            offset += length
+
+        self.offset = offset
+        end = offset + self.count * self.RECORD.size
+        if self.count:
+            self.data = mmap.mmap(self.fd, end, access=mmap.ACCESS_READ)
+        tail_end = end + self.read_tail(os.pread(self.fd, size - end, end))
+        if tail_end < size:
+            # Entry cut short by crash, appends continue from the last whole one
+            os.ftruncate(self.fd, tail_end)
+
+    def read_tail(self, data):
+        """Apply tail entries, returns length of whole entries"""
+        offset = 0
+        while offset + self.RECORD.size <= len(data):
+            chat_id, code, pizza_size, payment_method, last_received, update_id, flow_version = \
+                self.RECORD.unpack_from(data, offset)
+            end = offset + self.RECORD.size
+            if code == self.STATE:
+                if end + chat_id > len(data):
+                    break
+                self.add_state(data[end:end + chat_id].decode('utf-8'))
+                end += chat_id
+            elif code == self.PURGED:
+                self.apply_purge(last_received)
+            elif code == self.DELETED:
+                self.tail[chat_id] = None
+            else:
+                self.tail[chat_id] = self.decode(
+                    code, pizza_size, payment_method, last_received, update_id, flow_version)
+            offset = end
+        return offset
+
+    def add_state(self, state):
+        self.codes[state] = len(self.states)
+        self.states.append(state)
+
+    def encode_header(self, states, count):
+        names = b''.join(self.NAME.pack(len(name)) + name for name in (state.encode('utf-8') for state in states))
+        return self.HEADER.pack(self.MAGIC, self.VERSION, len(states), count) + names
+
+    def encode(self, chat_id, record):
+        return self.RECORD.pack(
+            chat_id, self.codes[record.state],
+            -1 if record.pizza_size is None else record.pizza_size,
+            -1 if record.payment_method is None else record.payment_method,
+            math.nan if record.last_received is None else record.last_received,
+            -1 if record.update_id is None else record.update_id,
+            -1 if record.flow_version is None else record.flow_version)
+
+    def decode(self, code, pizza_size, payment_method, last_received, update_id, flow_version):
+        return SessionRecord(
+            self.states[code],
+            None if pizza_size < 0 else pizza_size,
+            None if payment_method < 0 else payment_method,
+            None if math.isnan(last_received) else last_received,
+            None if update_id < 0 else update_id,
+            None if flow_version < 0 else flow_version)
+
+    def is_purged(self, record, timestamp):
+        return timestamp is not None and record.last_received is not None and record.last_received < timestamp
+
+    def search(self, chat_id):
+        """Snapshot record of chat or None, by binary search"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            entry = self.RECORD.unpack_from(self.data, self.offset + middle * self.RECORD.size)
+            if entry[0] < chat_id:
+                low = middle + 1
+            elif entry[0] > chat_id:
+                high = middle
+            else:
+                return self.decode(*entry[1:])
+        return None
+
+    def load(self, chat_id):
+        """Get saved session record or None"""
+        with self.lock:
+            if chat_id in self.tail:
+                return self.tail[chat_id]
+            purged = self.purged
+        record = self.search(chat_id)
+        if record is None or self.is_purged(record, purged):
+            return None
+        return record
+
+    def save(self, chat_id, record: SessionRecord):
+        """Save session record"""
+        with self.lock:
+            self.tail[chat_id] = record
+            if record.state not in self.codes:
+                name = record.state.encode('utf-8')
+                self.submit(self.RECORD.pack(len(name), self.STATE, 0, 0, 0.0, 0, 0) + name)
+                self.add_state(record.state)
+            self.submit(self.encode(chat_id, record))
+
+    def delete(self, chat_id):
+        """Delete session record"""
+        with self.lock:
+            self.tail[chat_id] = None
+            self.submit(self.RECORD.pack(chat_id, self.DELETED, 0, 0, 0.0, 0, 0))
+
+    def purge(self, timestamp):
+        """Delete records without input since given timestamp"""
+        with self.lock:
+            self.apply_purge(timestamp)
+            self.submit(self.RECORD.pack(0, self.PURGED, 0, 0, timestamp, 0, 0))
+
+    def apply_purge(self, timestamp):
+        """
+        Purge records received before timestamp, lock is held. Tail entries
+        of purged and deleted chats are dropped, so tail holds live sessions
+        only, entries hiding live snapshot records are kept as deleted.
+        """
+        if self.purged is None or timestamp > self.purged:
+            self.purged = timestamp
+        expired = [chat_id for chat_id, record in self.tail.items()
+                   if record is None or self.is_purged(record, timestamp)]
+        for chat_id in expired:
+            record = self.search(chat_id)
+            if record is None or self.is_purged(record, self.purged):
+                del self.tail[chat_id]
+            else:
+                self.tail[chat_id] = None
+
+    def write_batch(self, items):
+        os.write(self.fd, b''.join(items))
+        os.fsync(self.fd)
+
+    def records(self):
+        """Live (chat_id, record) pairs ordered by chat id, snapshot merged with tail"""
+        tail = sorted(self.tail.items())
+        index = 0
+        for position in range(self.count):
+            entry = self.RECORD.unpack_from(self.data, self.offset + position * self.RECORD.size)
+            while index < len(tail) and tail[index][0] < entry[0]:
+                yield tail[index]
+                index += 1
+            if index < len(tail) and tail[index][0] == entry[0]:
+                continue
+            record = self.decode(*entry[1:])
+            if not self.is_purged(record, self.purged):
+                yield entry[0], record
+        for item in tail[index:]:
+            yield item
+
+    def close(self):
+        """Write pending changes and compact them into new snapshot"""
+        super(SnapshotSessionStore, self).close()
+        if self.fd is None:
+            return
+        path = self.path + '.tmp'
+        with open(path, 'wb') as f:
+            f.write(self.encode_header(self.states, 0))
+            count = 0
+            for chat_id, record in self.records():
+                if record is not None:
+                    f.write(self.encode(chat_id, record))
+                    count += 1
+            f.seek(0)
+            f.write(self.encode_header(self.states, count))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path, self.path)
+
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        os.close(self.fd)
+        self.fd = None
@@ -1,16 +1,20 @@
 
+from pizza_bot import tracing
 from pizza_bot.interface import Dialog, Order
-import telegram
 import time
 
 
 class TelegramDialog(Dialog):
-    def __init__(self, bot: telegram.Bot):
+    __slots__ = ('bot', 'chat', 'last_received', 'message', 'outbox', 'update_id')
+
+    def __init__(self, bot: 'telegram.Bot'):
         super(TelegramDialog, self).__init__()
         self.bot = bot
         self.chat = None
         self.last_received = None
         self.message = None
+        self.outbox = None
+        self.update_id = None
 
     def reset_input(self):
         """Reset input before dialog has started"""
@@ -21,12 +25,24 @@ class TelegramDialog(Dialog):
         return self.message
 
     def send_message(self, message):
-        """Send message to user"""
+        """Send message to user, delivered on flush_messages"""
         if self.chat is None:
             raise TypeError('No chat to send a message')
-        self.bot.send_message(self.chat, message)
+        if self.outbox is None:
+            self.outbox = [message]
+        else:
+            self.outbox.append(message)
+
+    def flush_messages(self):
+        """Send messages of the turn to user as one message"""
+        if not self.outbox:
+            return
+        messages, self.outbox = self.outbox, None
+        # Bot API request metrics are recorded by Outbox
+        with tracing.tracer.span('send_message', self.chat):
+            self.bot.send_message(self.chat, '\n'.join(messages))
 
-    def process_update(self, update: telegram.Update):
+    def process_update(self, update: 'telegram.Update'):
         if update.message is None:
             raise TypeError('Update with empty message')
         if self.chat is None:
@@ -36,6 +52,11 @@ class TelegramDialog(Dialog):
 
         self.message = update.message.text
         self.last_received = time.time()
+        self.update_id = update.update_id
+
+    def is_replay(self, update: 'telegram.Update'):
+        """Whether update was processed in this session already, update ids only grow"""
+        return self.update_id is not None and update.update_id <= self.update_id
 
     def __str__(self):
         return 'TelegramDialog[last_received={}, message={}, chat={}]'.format(
@@ -0,0 +1,131 @@
+
+import asyncio
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import MagicMock as M, call
+from pizza_bot.aio_bot import AsyncFlowBot, AsyncPizzaBot
+from pizza_bot.interface import AsyncDialog, AsyncTransactionManager
+from pizza_bot.tests.test_flow import PIZZA_FLOW
+
+
+class RecordingDialog(AsyncDialog):
+    def __init__(self):
+        self.input = None
+        self.pending = []
+        self.sent = []
+
+    def reset_input(self):
+        self.input = None
+
+    def get_input(self):
+        return self.input
+
+    def send_message(self, message):
+        self.pending.append(message)
+
+    async def flush_messages(self):
+        self.sent.append(self.pending)
+        self.pending = []
+
+
+class RecordingManager(AsyncTransactionManager):
+    def __init__(self):
+        self.orders = []
+
+    async def create_order(self, dialog, order):
+        self.orders.append((dialog, order.pizza_size, order.payment_method))
+
+
+class AsyncPizzaBotTestCase(unittest.TestCase):
+    """
+    AsyncPizzaBot runs the same conversation awaiting dialog and manager
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.manager = RecordingManager()
+        self.bot = AsyncPizzaBot(self.manager, shared_machine=True)
+        self.dialog = RecordingDialog()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def say(self, text):
+        self.dialog.input = text
+        self.loop.run_until_complete(self.bot.on_chat_input(self.dialog))
+        return self.dialog.sent.pop()
+
+    def test_conversation(self):
+        messages = self.bot.messages
+        self.loop.run_until_complete(self.bot.on_chat_start(self.dialog))
+        self.assertEqual(self.dialog.sent, [[messages['pick_size']]])
+        self.dialog.sent.clear()
+
+        with self.subTest('Test invalid input'):
+            self.assertEqual(self.say('пепперони'), [
+                messages['pick_size'],
+                self.bot.variants_message('idle'),
+            ])
+
+        with self.subTest('Test order'):
+            self.assertEqual(self.say('Большую'), [messages['pick_payment']])
+            order, machine = self.bot.dialogs[self.dialog]
+            self.assertEqual(self.say('картой'), [self.bot.confirm_message(order)])
+            self.assertEqual(self.say('да'), [messages['success'], messages['pick_size']])
+            self.assertEqual(self.manager.orders, [(self.dialog, order.BIG_SIZE, order.PAY_CARD)])
+            self.assertTrue(self.bot.dialogs[self.dialog][0].is_idle())
+
+        with self.subTest('Test declined order'):
+            self.say('маленькую'), self.say('наличкой')
+            self.assertEqual(self.say('нет'), [messages['pick_size']])
+            self.assertEqual(len(self.manager.orders), 1)
+
+    def test_on_chat_input_wrong_dialog(self):
+        self.bot.log = log = M()
+        self.loop.run_until_complete(self.bot.on_chat_input(self.dialog))
+        self.assertEqual(log.call_args_list, [
+            call('Input received from wrong dialog: {}'.format(self.dialog))
+        ])
+        self.assertEqual(self.dialog.sent, [])
+
+    def test_messages_flushed_when_handler_fails(self):
+        self.bot.start_dialog(self.dialog)
+        self.bot.manager = None
+        for text in ('большую', 'картой'):
+            self.say(text)
+        self.dialog.input = 'да'
+        with self.assertRaises(AttributeError):
+            self.loop.run_until_complete(self.bot.on_chat_input(self.dialog))
+        # Order is passed on once the turn is done
+        self.assertEqual(self.dialog.sent, [[self.bot.messages['success'], self.bot.messages['pick_size']]])
+
+
+class AsyncFlowBotTestCase(unittest.TestCase):
+    """
+    AsyncFlowBot runs flow conversation awaiting dialog and manager
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, 'pizza.json')
+        shutil.copyfile(PIZZA_FLOW, path)
+        self.manager = RecordingManager()
+        self.bot = AsyncFlowBot(self.manager, path)
+        self.dialog = RecordingDialog()
+
+    def tearDown(self):
+        self.loop.close()
+        self.directory.cleanup()
+
+    def test_conversation(self):
+        pizza_bot = AsyncPizzaBot(RecordingManager(), shared_machine=True)
+        pizza_dialog = RecordingDialog()
+        self.loop.run_until_complete(self.bot.on_chat_start(self.dialog))
+        self.loop.run_until_complete(pizza_bot.on_chat_start(pizza_dialog))
+        for text in ('пепперони', 'большую', 'картой', 'да', 'маленькую', 'наличкой', 'нет'):
+            self.dialog.input = pizza_dialog.input = text
+            self.loop.run_until_complete(self.bot.on_chat_input(self.dialog))
+            self.loop.run_until_complete(pizza_bot.on_chat_input(pizza_dialog))
+        self.assertEqual(self.dialog.sent, pizza_dialog.sent)
+        self.assertEqual(self.manager.orders, [(self.dialog, 1, 1)])
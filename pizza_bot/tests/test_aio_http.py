@@ -0,0 +1,65 @@
+
+import asyncio
+import unittest
+from pizza_bot.aio_http import HTTPConnectionPool, start_server
+
+
+class AioHTTPTestCase(unittest.TestCase):
+    """
+    Minimal HTTP server and keep-alive client pool talk to each other
+    """
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.requests = []
+        self.hung = asyncio.Event()
+        self.server = self.loop.run_until_complete(start_server(self.handler, '127.0.0.1', 0))
+        port = self.server.sockets[0].getsockname()[1]
+        self.pool = HTTPConnectionPool('http://127.0.0.1:{}'.format(port), size=2)
+
+    def tearDown(self):
+        self.pool.close()
+        self.server.close()
+        self.loop.run_until_complete(self.server.wait_closed())
+        # Let server connections see the client went away
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    async def handler(self, method, path, body):
+        self.requests.append((method, path, body))
+        if path == '/missing':
+            return 404, b''
+        if path == '/hang':
+            await self.hung.wait()
+        return 200, body[::-1]
+
+    def test_request(self):
+        status, body = self.loop.run_until_complete(self.pool.request('POST', '/echo', b'abc'))
+        self.assertEqual((status, body), (200, b'cba'))
+        self.assertEqual(self.requests, [('POST', '/echo', b'abc')])
+
+        status, body = self.loop.run_until_complete(self.pool.request('GET', '/missing'))
+        self.assertEqual((status, body), (404, b''))
+
+    def test_connections_reused(self):
+        requests = [self.pool.request('POST', '/echo', str(i).encode()) for i in range(10)]
+        responses = self.loop.run_until_complete(asyncio.gather(*requests))
+        self.assertEqual([body for status, body in responses], [str(i).encode() for i in range(10)])
+        self.assertLessEqual(len(self.pool.idle), 2)
+
+    def test_closed_idle_connection_replaced(self):
+        self.loop.run_until_complete(self.pool.request('POST', '/echo', b'1'))
+        reader, writer = self.pool.idle[0]
+        writer.close()
+        status, body = self.loop.run_until_complete(self.pool.request('POST', '/echo', b'2'))
+        self.assertEqual((status, body), (200, b'2'))
+
+    def test_timeout(self):
+        self.pool.timeout = 0.05
+        with self.assertRaises(asyncio.TimeoutError):
+            self.loop.run_until_complete(self.pool.request('GET', '/hang'))
+        self.assertEqual(self.pool.idle, [])
+        self.hung.set()
+        status, body = self.loop.run_until_complete(self.pool.request('POST', '/echo', b'1'))
+        self.assertEqual(status, 200)
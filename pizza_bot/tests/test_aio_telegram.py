@@ -0,0 +1,172 @@
+
+import asyncio
+import json
+import unittest
+from unittest.mock import MagicMock as M, call
+from pizza_bot.aio_http import HTTPConnectionPool, start_server
+from pizza_bot.aio_telegram import (
+    AsyncBotApi, AsyncTelegramDialog, BotApiError, ChatLocks, UpdateTasks, start_webhook)
+
+
+class AsyncTelegramTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_async(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+
+class AsyncBotApiTestCase(AsyncTelegramTestCase):
+    """
+    AsyncBotApi posts JSON requests to Bot API methods
+    """
+    def setUp(self):
+        super(AsyncBotApiTestCase, self).setUp()
+        self.calls = []
+        self.server = self.run_async(start_server(self.handler, '127.0.0.1', 0))
+        port = self.server.sockets[0].getsockname()[1]
+        self.api = AsyncBotApi('TOKEN', base_url='http://127.0.0.1:{}'.format(port))
+
+    def tearDown(self):
+        self.api.close()
+        self.server.close()
+        self.run_async(self.server.wait_closed())
+        self.run_async(asyncio.sleep(0.01))
+        super(AsyncBotApiTestCase, self).tearDown()
+
+    async def handler(self, method, path, body):
+        params = json.loads(body.decode('utf-8'))
+        self.calls.append((path, params))
+        if params.get('text') == 'fail':
+            return 400, b'{"ok": false, "description": "Bad Request: failed"}'
+        return 200, json.dumps(dict(ok=True, result=params)).encode('utf-8')
+
+    def test_send_message(self):
+        result = self.run_async(self.api.send_message(5, 'Привет'))
+        self.assertEqual(result, dict(chat_id=5, text='Привет'))
+        self.assertEqual(self.calls, [('/botTOKEN/sendMessage', dict(chat_id=5, text='Привет'))])
+
+    def test_set_webhook(self):
+        self.run_async(self.api.set_webhook('https://example.com/TOKEN'))
+        self.assertEqual(self.calls, [('/botTOKEN/setWebhook', dict(url='https://example.com/TOKEN'))])
+
+    def test_error(self):
+        with self.assertRaises(BotApiError) as cm:
+            self.run_async(self.api.send_message(5, 'fail'))
+        self.assertEqual(cm.exception.args, ('Bad Request: failed',))
+
+
+class AsyncTelegramDialogTestCase(AsyncTelegramTestCase):
+    def setUp(self):
+        super(AsyncTelegramDialogTestCase, self).setUp()
+        self.api = M()
+        self.api.send_message.side_effect = self.send_message
+        self.dialog = AsyncTelegramDialog(self.api)
+
+    async def send_message(self, chat, text):
+        pass
+
+    def test_send_and_flush(self):
+        with self.subTest('Test send_message raises exception'):
+            with self.assertRaises(TypeError):
+                self.dialog.send_message('hi')
+
+        with self.subTest('Test messages of the turn sent at once'):
+            self.dialog.chat = 5
+            self.run_async(self.dialog.flush_messages())
+            self.dialog.send_message('first')
+            self.dialog.send_message('second')
+            self.assertEqual(self.api.send_message.call_count, 0)
+            self.run_async(self.dialog.flush_messages())
+            self.assertEqual(self.api.send_message.call_args_list, [call(5, 'first\nsecond')])
+
+
+class ChatLocksTestCase(AsyncTelegramTestCase):
+    def test_updates_of_chat_serialized(self):
+        locks = ChatLocks()
+        events = []
+
+        async def process(chat_id, name):
+            await locks.acquire(chat_id)
+            try:
+                events.append(('start', name))
+                await asyncio.sleep(0)
+                events.append(('end', name))
+            finally:
+                locks.release(chat_id)
+
+        self.run_async(asyncio.gather(process(1, 'a'), process(1, 'b'), process(2, 'c')))
+        self.assertEqual(events, [
+            ('start', 'a'), ('start', 'c'), ('end', 'a'), ('end', 'c'), ('start', 'b'), ('end', 'b'),
+        ])
+        self.assertEqual(locks.locks, {})
+
+
+class StartWebhookTestCase(AsyncTelegramTestCase):
+    def test_updates_passed_to_handler(self):
+        updates = []
+
+        async def handler(update):
+            updates.append(update)
+
+        server = self.run_async(start_webhook(handler, '127.0.0.1', 0, '/TOKEN'))
+        port = server.sockets[0].getsockname()[1]
+        pool = HTTPConnectionPool('http://127.0.0.1:{}'.format(port))
+        payload = dict(update_id=7, message=dict(
+            message_id=1, date=0, chat=dict(id=5, type='private'), text='да'))
+        try:
+            status, body = self.run_async(pool.request('POST', '/TOKEN', json.dumps(payload).encode()))
+            self.assertEqual(status, 200)
+            status, body = self.run_async(pool.request('POST', '/other', b'{}'))
+            self.assertEqual(status, 404)
+        finally:
+            pool.close()
+            server.close()
+            self.run_async(server.wait_closed())
+            self.run_async(asyncio.sleep(0.01))
+
+        update, = updates
+        self.assertEqual((update.update_id, update.message.chat_id, update.message.text), (7, 5, 'да'))
+
+    def test_answered_before_handler_done(self):
+        events = []
+        release = asyncio.Event()
+
+        async def handler(update):
+            events.append(('start', update.update_id))
+            await release.wait()
+            events.append(('end', update.update_id))
+
+        tasks = UpdateTasks()
+        server = self.run_async(start_webhook(handler, '127.0.0.1', 0, '/TOKEN', tasks=tasks))
+        pool = HTTPConnectionPool('http://127.0.0.1:{}'.format(server.sockets[0].getsockname()[1]))
+        try:
+            for update_id in (1, 2):
+                payload = dict(update_id=update_id, message=dict(
+                    message_id=1, date=0, chat=dict(id=5, type='private'), text='да'))
+                status, body = self.run_async(pool.request('POST', '/TOKEN', json.dumps(payload).encode()))
+                self.assertEqual(status, 200)
+            self.assertEqual(events, [('start', 1), ('start', 2)])
+            release.set()
+            self.run_async(tasks.join())
+            self.assertEqual(events[2:], [('end', 1), ('end', 2)])
+            self.assertEqual(tasks.tasks, set())
+        finally:
+            pool.close()
+            server.close()
+            self.run_async(server.wait_closed())
+            self.run_async(asyncio.sleep(0.01))
+
+    def test_failed_task_logged(self):
+        async def handler():
+            raise ValueError('failed')
+
+        tasks = UpdateTasks()
+        with self.assertLogs(level='ERROR'):
+            tasks.start(handler())
+            self.run_async(tasks.join())
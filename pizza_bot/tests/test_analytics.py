@@ -0,0 +1,125 @@
+
+import threading
+import unittest
+from unittest.mock import MagicMock as M, patch
+from pizza_bot.analytics import OrderAnalytics, RollingCounts
+from pizza_bot.bot import PizzaBot
+from pizza_bot.interface import Order
+
+
+class RollingCountsTestCase(unittest.TestCase):
+    """
+    RollingCounts keeps counts of the last periods in ring buffer
+    """
+    def test_window(self):
+        counts = RollingCounts(period=10, slots=3)
+        for now, key in [(0, 'a'), (5, 'a'), (12, 'b'), (25, 'a')]:
+            counts.add(key, now)
+
+        self.assertEqual(counts.totals(29), dict(a=3, b=1))
+        self.assertEqual(counts.series('a', 29), [2, 0, 1])
+
+        with self.subTest('Test old periods leave window'):
+            self.assertEqual(counts.totals(30), dict(a=1, b=1))
+            self.assertEqual(counts.totals(100), dict())
+
+        with self.subTest('Test reused slot starts over'):
+            counts.add('b', 31)
+            self.assertEqual(counts.counts[0], dict(b=1))
+            self.assertEqual(counts.totals(31), dict(a=1, b=2))
+
+        with self.subTest('Test period older than the slot keeps is dropped'):
+            counts.add('c', 1)
+            self.assertEqual(counts.totals(31), dict(a=1, b=2))
+
+
+class OrderAnalyticsTestCase(unittest.TestCase):
+    """
+    OrderAnalytics counts orders, decisions and funnel states per window
+    """
+    def setUp(self):
+        self.now = 1000000.0
+        self.analytics = OrderAnalytics(clock=lambda: self.now)
+
+    def order(self, pizza_size, payment_method, is_confirmed):
+        for state in ('idle', 'size_picked', 'payment_picked'):
+            self.analytics.reach(state)
+        self.analytics.decide(M(pizza_size=pizza_size, payment_method=payment_method, is_confirmed=is_confirmed))
+
+    def test_summary(self):
+        self.order(Order.BIG_SIZE, Order.PAY_CARD, True)
+        self.order(Order.BIG_SIZE, Order.PAY_CARD, True)
+        self.order(Order.SMALL_SIZE, Order.PAY_CARD, False)
+        self.now += 30
+        self.order(Order.SMALL_SIZE, Order.PAY_CHECK, True)
+        self.analytics.reach('idle')
+
+        summary = self.analytics.summary('1h')
+        self.assertEqual(summary['orders'], {(1, 1): 2, (0, 0): 1})
+        self.assertEqual((summary['confirmed'], summary['declined'], summary['confirm_ratio']), (3, 1, 0.75))
+        self.assertEqual(summary['funnel'], [
+            ('idle', 5, 0.2), ('size_picked', 4, 0.0), ('payment_picked', 4, 0.25), ('confirmed', 3, None)])
+
+        self.now += 60
+        self.assertEqual(self.analytics.summary('1m')['confirmed'], 0)
+        self.assertEqual(self.analytics.summary('1h')['confirmed'], 3)
+        self.assertEqual(self.analytics.orders_series('1h')[-3:], [2, 1, 0])
+
+    def test_empty(self):
+        summary = self.analytics.summary('1d')
+        self.assertEqual((summary['orders'], summary['confirm_ratio']), ({}, None))
+        self.assertEqual(self.analytics.orders_series('1d'), [0] * 24)
+        self.assertNotIn('confirm_ratio{', self.analytics.expose())
+
+    def test_expose(self):
+        self.order(Order.BIG_SIZE, Order.PAY_CHECK, True)
+        text = self.analytics.expose()
+        for line in (
+            'pizza_bot_window_orders{window="1m",pizza_size="1",payment_method="0"} 1',
+            'pizza_bot_window_confirm_ratio{window="1h"} 1.0',
+            'pizza_bot_window_funnel{window="1d",state="size_picked"} 1',
+            'pizza_bot_window_drop_off{window="1m",state="idle"} 0.0',
+        ):
+            self.assertIn(line, text.splitlines())
+
+        with self.subTest('Test extra labels'):
+            self.assertIn('pizza_bot_window_confirm_ratio{window="1h",pid="7"} 1.0',
+                          self.analytics.expose([('pid', 7)]).splitlines())
+
+    def test_threads(self):
+        def record():
+            for _ in range(100):
+                self.order(Order.BIG_SIZE, Order.PAY_CARD, True)
+        threads = [threading.Thread(target=record) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.order(Order.SMALL_SIZE, Order.PAY_CHECK, False)
+
+        with self.subTest('Test counts of other threads are read'):
+            summary = self.analytics.summary('1m')
+            self.assertEqual((summary['confirmed'], summary['declined']), (400, 1))
+            self.assertEqual(summary['funnel'][0], ('idle', 401, 0.0))
+            self.assertEqual(self.analytics.orders_series('1m')[-1], 400)
+
+        with self.subTest('Test finished threads are dropped'):
+            self.assertEqual(len(self.analytics.shards), 1)
+
+        with self.subTest('Test counts are added to windows when period is over'):
+            self.now += 5
+            self.analytics.reach('idle')
+            self.assertEqual(self.analytics.counts[0][1].totals(self.now)[('state', 'declined')], 1)
+            self.assertEqual(self.analytics.summary('1m')['funnel'][0][1], 402)
+
+    def test_pizza_bot(self):
+        with patch('pizza_bot.analytics.ANALYTICS', new=self.analytics):
+            bot = PizzaBot(M())
+            dialog = M()
+            bot.on_chat_start(dialog)
+            for dialog.get_input.return_value in ('большую', 'картой', 'нет', 'маленькую'):
+                bot.on_chat_input(dialog)
+
+        summary = self.analytics.summary()
+        self.assertEqual((summary['confirmed'], summary['declined']), (0, 1))
+        self.assertEqual([count for state, count, drop_off in summary['funnel']], [2, 2, 1, 0])
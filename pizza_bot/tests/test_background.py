@@ -0,0 +1,65 @@
+
+import threading
+import unittest
+from unittest.mock import patch
+from pizza_bot.background import BatchWriter
+
+
+class ListWriter(BatchWriter):
+    def __init__(self, **kwargs):
+        super(ListWriter, self).__init__(**kwargs)
+        self.batches = []
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def write_batch(self, items):
+        self.gate.wait()
+        if 'fail' in items:
+            raise ValueError('fail')
+        self.batches.append(items)
+
+
+class BatchWriterTestCase(unittest.TestCase):
+    """
+    BatchWriter groups queued items into batches written in background
+    """
+    def setUp(self):
+        self.writer = ListWriter(max_batch=3)
+        self.writer.start()
+
+    def tearDown(self):
+        self.writer.gate.set()
+        self.writer.close()
+
+    def test_items_batched(self):
+        # Hold first batch until the rest is queued
+        self.writer.gate.clear()
+        self.writer.submit(0)
+        for item in range(1, 6):
+            self.writer.submit(item)
+        self.writer.gate.set()
+        self.writer.flush()
+
+        self.assertEqual(sum(self.writer.batches, []), list(range(6)))
+        self.assertTrue(all(len(batch) <= 3 for batch in self.writer.batches))
+        self.assertLess(len(self.writer.batches), 6)
+
+    def test_close_writes_pending(self):
+        self.writer.gate.clear()
+        for item in range(5):
+            self.writer.submit(item)
+        self.writer.gate.set()
+        self.writer.close()
+
+        self.assertFalse(self.writer.thread.is_alive())
+        self.assertEqual(sum(self.writer.batches, []), list(range(5)))
+
+    def test_failed_batch_logged(self):
+        with patch('pizza_bot.background.logging') as logging:
+            self.writer.submit('fail')
+            self.writer.flush()
+            self.writer.submit('ok')
+            self.writer.flush()
+
+        self.assertEqual(logging.exception.call_count, 1)
+        self.assertEqual(self.writer.batches, [['ok']])
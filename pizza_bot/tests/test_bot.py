@@ -103,6 +103,36 @@ class PizzaBotTestCase(unittest.TestCase):
             )
         ]
 
+    def test_start_dialog_shared_machine(self):
+        bot = PizzaBot(self.bot_manager, shared_machine=True)
+        other_dialog = M()
+        with patch('pizza_bot.bot.Machine') as Machine:
+            bot.start_dialog(self.dialog)
+            bot.start_dialog(other_dialog)
+
+        assert Machine.call_count == 0
+        order, machine = bot.dialogs[self.dialog]
+        other_order, other_machine = bot.dialogs[other_dialog]
+        assert machine is other_machine is bot.machine
+        assert order is not other_order
+        assert order.state == 'idle' and order.is_idle()
+        assert self.dialog.reset_input.call_args_list == [call()]
+
+        order.set_size(order.BIG_SIZE)
+        assert order.is_size_picked() and order.pizza_size == order.BIG_SIZE
+        assert other_order.is_idle() and other_order.pizza_size is None
+
+    def test_restore_dialog(self):
+        for shared_machine in (False, True):
+            with self.subTest('Test restore_dialog with shared_machine={}'.format(shared_machine)):
+                bot = PizzaBot(self.bot_manager, shared_machine=shared_machine)
+                bot.restore_dialog(self.dialog, 'payment_picked', 1, 0)
+                order, machine = bot.dialogs[self.dialog]
+                assert order.is_payment_picked()
+                assert (order.pizza_size, order.payment_method) == (1, 0)
+                order.confirm(True)
+                assert order.is_idle() and order.is_confirmed
+
     def test_delete_dialog(self):
         it = M()
         self.bot.dialogs[it] = it
@@ -138,6 +168,15 @@ class PizzaBotTestCase(unittest.TestCase):
             self.bot.run_dialog(self.dialog)
             self.assertEqual(method.call_args_list, [call(self.dialog, order, value)])
             self.assertEqual(calls, tuple(m.call_count for m in mocks))
+        self.assertEqual(self.dialog.flush_messages.call_count, len(states))
+
+        with self.subTest('Test messages flushed when handler fails'):
+            self.dialog.flush_messages.reset_mock()
+            mocks[0].side_effect = TypeError()
+            order.state = 'idle'
+            with self.assertRaises(TypeError):
+                self.bot.run_dialog(self.dialog)
+            self.assertEqual(self.dialog.flush_messages.call_count, 1)
 
     def test_handle_idle(self):
         order = M()
@@ -299,6 +338,48 @@ class PizzaBotTestCase(unittest.TestCase):
                 self.assertEqual(order.state, 'state_1')
                 self.assertEqual(out, rv)
 
+    def test_get_value_near_misses(self):
+        order = M()
+        self.bot.dialogs[self.dialog] = order, M()
+        asserts = {
+            'idle': {'большая': PizzaBot.variants['idle']['большую'], 'мленькую': PizzaBot.variants['idle']['маленькую']},
+            'size_picked': {'карта': PizzaBot.variants['size_picked']['картой']},
+            'payment_picked': {'lf': True, 'ytn': False, 'нетушки': self.bot.INVALID},
+        }
+        for state, inputs in asserts.items():
+            order.state = state
+            for inp, out in inputs.items():
+                with self.subTest('Test get_value in {} for input {}'.format(state, inp)):
+                    self.dialog.get_input.return_value = inp
+                    self.assertEqual(self.bot.get_value(self.dialog), out)
+
+    def test_matchers_compiled_once(self):
+        matcher = self.bot.get_matcher('idle')
+        self.assertIs(self.bot.get_matcher('idle'), matcher)
+        self.assertEqual(set(self.bot.matchers), set(PizzaBot.variants))
+
+        self.bot.variants = dict(PizzaBot.variants, idle={'a': 1})
+        self.assertIsNot(self.bot.get_matcher('idle'), matcher)
+
+    def test_responses_rendered_once(self):
+        from pizza_bot.interface import Order
+        responses = self.bot.get_responses()
+        self.assertIs(self.bot.get_responses(), responses)
+
+        order = Order()
+        for size in (Order.SMALL_SIZE, Order.BIG_SIZE):
+            for payment in (Order.PAY_CHECK, Order.PAY_CARD):
+                order.pizza_size, order.payment_method = size, payment
+                with self.subTest('Test confirm_message for {} {}'.format(size, payment)):
+                    expected = PizzaBot.messages['confirm_pick'].format(
+                        pizza_size=order.size_description, payment_type=order.payment_description)
+                    self.assertEqual(self.bot.confirm_message(order), expected)
+                    self.assertIs(self.bot.confirm_message(order), responses.confirm_pick[size, payment])
+
+        self.bot.messages = dict(PizzaBot.messages, please_repeat='{variants}')
+        self.assertIsNot(self.bot.get_responses(), responses)
+        self.assertEqual(self.bot.variants_message('payment_picked'), ', '.join(PizzaBot.variants['payment_picked']))
+
     def test_log(self):
         message = 'TTTTtest'
         with patch('pizza_bot.bot.logging.info') as cm:
@@ -0,0 +1,52 @@
+
+import unittest
+from pizza_bot.dedup import UpdateWindow
+
+
+class UpdateWindowTestCase(unittest.TestCase):
+    """
+    UpdateWindow tells updates seen among the last ids in constant memory
+    """
+    def test_seen(self):
+        window = UpdateWindow(size=16)
+        self.assertEqual([window.seen(update_id) for update_id in (10, 12, 11, 12, 10, 13)],
+                         [False, False, False, True, True, False])
+
+    def test_window_slides(self):
+        window = UpdateWindow(size=16)
+        for update_id in range(100, 116):
+            window.seen(update_id)
+
+        with self.subTest('Test ids reused by ring are forgotten'):
+            self.assertFalse(window.seen(116))
+            self.assertFalse(window.seen(117))
+            self.assertTrue(window.seen(116))
+            self.assertTrue(window.seen(102))
+
+        with self.subTest('Test jump past the window'):
+            self.assertFalse(window.seen(1000))
+            self.assertFalse(window.seen(999))
+            self.assertFalse(window.seen(985))
+            self.assertTrue(window.seen(999))
+            self.assertEqual(len(window.bits), 2)
+
+        with self.subTest('Test id below the window starts sequence over'):
+            self.assertFalse(window.seen(123))
+            self.assertTrue(window.seen(123))
+            self.assertEqual([window.seen(update_id) for update_id in (124, 125, 124)], [False, False, True])
+            self.assertFalse(window.seen(999))
+
+    def test_fresh_then_mark(self):
+        window = UpdateWindow(size=16)
+        window.seen(10)
+        self.assertEqual(window.fresh([10, 11, 12]), [11, 12])
+        self.assertEqual(window.fresh([11, 12]), [11, 12])
+        window.mark([11, 12])
+        self.assertEqual(window.fresh([10, 11, 12, 13]), [13])
+        window.mark([40, 30])
+        self.assertEqual(window.fresh([30, 25, 40]), [25])
+
+    def test_size_checked(self):
+        for size in (0, 12):
+            with self.subTest(size=size), self.assertRaises(ValueError):
+                UpdateWindow(size)
@@ -0,0 +1,42 @@
+import unittest
+import telegram
+from telegram.utils.request import Request
+from pizza_bot.fake_telegram import FakeBotApi
+from pizza_bot.telegram_chat import TelegramDialog
+
+TOKEN = '123456:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA'
+
+
+class FakeBotApiTestCase(unittest.TestCase):
+    """
+    FakeBotApi serves telegram.Bot like Bot API and keeps messages sent
+    """
+    def setUp(self):
+        self.api = FakeBotApi().start()
+        self.bot = telegram.Bot(TOKEN, base_url=self.api.url, request=Request(con_pool_size=2))
+
+    def tearDown(self):
+        self.api.stop()
+
+    def test_send_message(self):
+        message = self.bot.send_message(5, 'Привет')
+        self.assertEqual((message.chat_id, message.text), (5, 'Привет'))
+        self.assertEqual(self.api.sent, [(5, 'Привет')])
+
+    def test_dialog_flush(self):
+        dialog = TelegramDialog(self.bot)
+        dialog.chat = 7
+        dialog.send_message('a')
+        dialog.send_message('b')
+        dialog.flush_messages()
+        self.assertEqual(self.api.sent, [(7, 'a\nb')])
+
+    def test_get(self):
+        self.assertEqual(self.bot.get_me().username, 'fake_bot')
+        # Bot.id asks for commands along with getMe
+        self.assertEqual(self.bot.id, 1)
+
+    def test_unknown_method(self):
+        with self.assertRaises(telegram.error.TelegramError):
+            self.bot.get_chat(5)
+        self.assertEqual(self.api.sent, [])
@@ -0,0 +1,173 @@
+
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock as M
+from pizza_bot.bot import PizzaBot
+from pizza_bot.flow import Flow, FlowBot
+
+PIZZA_FLOW = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'flows', 'pizza.json')
+
+
+class ScriptDialog(object):
+    """Dialog recording sent messages"""
+    def __init__(self):
+        self.input = None
+        self.sent = []
+
+    def reset_input(self):
+        self.input = None
+
+    def get_input(self):
+        return self.input
+
+    def send_message(self, message):
+        self.sent.append(message)
+
+    def flush_messages(self):
+        pass
+
+
+def converse(bot, texts):
+    """Messages sent and orders created by bot during conversation"""
+    dialog = ScriptDialog()
+    bot.on_chat_start(dialog)
+    for text in texts:
+        dialog.input = text
+        bot.on_chat_input(dialog)
+    orders = [(order.pizza_size, order.payment_method, order.is_confirmed)
+              for (_, order), _ in bot.manager.create_order.call_args_list]
+    return dialog.sent, orders
+
+
+class FlowBotTestCase(unittest.TestCase):
+    """
+    FlowBot runs flow definitions, pizza flow talks exactly like PizzaBot
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'flow.json')
+        with open(PIZZA_FLOW, encoding='utf-8') as f:
+            self.definition = json.load(f)
+        self.write(self.definition)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, definition):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump(definition, f, ensure_ascii=False)
+        # Reload is triggered by changed modification time
+        stat = os.stat(self.path)
+        os.utime(self.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    def test_same_as_pizza_bot(self):
+        scripts = [
+            ('большую', 'картой', 'да'),
+            ('маленькая', 'нал', 'lf'),
+            ('ой', 'большую', 'чем-то', 'наличкой', 'может', 'нет', 'маленькую'),
+            ('Большую!', 'картой', 'да', 'большую', 'картой', 'да'),
+        ]
+        for texts in scripts:
+            with self.subTest(texts=texts):
+                self.assertEqual(converse(FlowBot(M(), self.path), texts), converse(PizzaBot(M()), texts))
+
+    def test_restore_dialog(self):
+        bot = FlowBot(M(), self.path)
+        dialog = ScriptDialog()
+        bot.restore_dialog(dialog, 'payment_picked', 1, 0)
+        order, flow = bot.dialogs[dialog]
+        self.assertEqual((order.state, order.step, order.pizza_size, order.payment_method), ('payment_picked', 2, 1, 0))
+
+        bot.restore_dialog(dialog, 'removed_state')
+        self.assertEqual((bot.dialogs[dialog][0].state, bot.dialogs[dialog][0].step), ('idle', 0))
+
+    def test_restore_dialog_on_its_flow_version(self):
+        FlowBot(M(), self.path)
+        self.definition['version'] = 2
+        self.definition['messages']['pick_payment'] = 'Наличкой или картой?'
+        self.write(self.definition)
+
+        # Process started after reload finds older version in archive
+        bot = FlowBot(M(), self.path)
+        dialog = ScriptDialog()
+        bot.restore_dialog(dialog, 'size_picked', 1, flow_version=1)
+        dialog.input = 'ой'
+        bot.on_chat_input(dialog)
+        self.assertEqual(dialog.sent[0], 'Как вы будете платить?')
+        self.assertEqual(bot.dialogs[dialog][0].flow_version, 1)
+
+        with self.subTest('Test next order starts on current version'):
+            for dialog.input in ('картой', 'да'):
+                bot.on_chat_input(dialog)
+            self.assertEqual(bot.dialogs[dialog][0].flow_version, 2)
+
+        with self.subTest('Test unknown version continues on current flow'):
+            bot.restore_dialog(dialog, 'size_picked', 1, flow_version=7)
+            self.assertEqual(bot.dialogs[dialog][1].version, 2)
+
+        with self.subTest('Test older flow dropped once no dialog uses it'):
+            self.assertEqual(sorted(bot.flows), [1, 2])
+            self.definition['version'] = 3
+            self.write(self.definition)
+            bot.reload()
+            self.assertEqual(sorted(bot.flows), [2, 3])
+
+    def test_reload_keeps_orders_in_progress(self):
+        bot = FlowBot(M(), self.path)
+        old = ScriptDialog()
+        bot.on_chat_start(old)
+        old.input = 'большую'
+        bot.on_chat_input(old)
+
+        self.assertFalse(bot.reload())
+        self.definition['version'] = 2
+        self.definition['messages']['pick_payment'] = 'Наличкой или картой?'
+        self.write(self.definition)
+        self.assertTrue(bot.reload())
+        self.assertEqual(bot.flow.version, 2)
+
+        with self.subTest('Test order in progress finishes on old flow'):
+            old.input = 'ой'
+            bot.on_chat_input(old)
+            self.assertEqual(old.sent[-2], 'Как вы будете платить?')
+            for old.input in ('картой', 'да'):
+                bot.on_chat_input(old)
+            self.assertEqual(bot.dialogs[old][1].version, 2)
+
+        with self.subTest('Test new dialog starts on new flow'):
+            new = ScriptDialog()
+            bot.on_chat_start(new)
+            new.input = 'большую'
+            bot.on_chat_input(new)
+            self.assertEqual(new.sent[-1], 'Наличкой или картой?')
+
+    def test_added_step(self):
+        self.definition['messages']['pick_crust'] = 'Тонкое тесто или пышное?'
+        states = self.definition['states']
+        states[0]['next'] = 'crust_picked'
+        states.insert(1, dict(name='crust_picked', prompt='pick_crust', inputs={'тонкое': 0, 'пышное': 1},
+                              set='set_payment_method', next='size_picked'))
+        flow = Flow(self.definition)
+        self.assertEqual([step.name for step in flow.steps], ['idle', 'crust_picked', 'size_picked', 'payment_picked'])
+        self.assertEqual([step.next for step in flow.steps], [1, 2, 3, None])
+
+    def test_invalid_definition(self):
+        cases = [
+            ('Test unknown state', lambda d: d['states'][0].update(next='nowhere')),
+            ('Test unknown message', lambda d: d['states'][0].update(prompt='nothing')),
+            ('Test unknown setter', lambda d: d['states'][0].update(set='__init__')),
+            ('Test next and order', lambda d: d['states'][2].update(next='idle')),
+            ('Test unknown initial', lambda d: d.update(initial='nowhere')),
+            ('Test version not integer', lambda d: d.update(version='2')),
+            ('Test size order cannot describe', lambda d: d['states'][0]['inputs'].update(среднюю=2)),
+            ('Test payment of wrong type', lambda d: d['states'][1]['inputs'].update(картой=True)),
+            ('Test confirmation not boolean', lambda d: d['states'][2]['inputs'].update(да=1)),
+        ]
+        for message, change in cases:
+            with self.subTest(message):
+                definition = json.loads(json.dumps(self.definition))
+                change(definition)
+                with self.assertRaises(ValueError):
+                    Flow(definition)
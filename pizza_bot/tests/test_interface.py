@@ -14,6 +14,10 @@ class DialogTestCase(unittest.TestCase):
             args = ('Message',) if method == 'send_message' else ()
             self.assertRaises(NotImplementedError, getattr(dialog, method), *args)
 
+    def test_flush_messages(self):
+        """Dialogs not buffering messages have nothing to flush"""
+        self.assertIsNone(Dialog().flush_messages())
+
 
 class OrderTestCase(unittest.TestCase):
     """
@@ -72,6 +76,13 @@ class OrderTestCase(unittest.TestCase):
                 self.assertEqual(getattr(order, target_field), value)
 
 
+    def test_slots(self):
+        order = Order()
+        order.state = 'idle'
+        order.set_pizza_size(Order.BIG_SIZE)
+        self.assertEqual(vars(order), {})
+
+
 class TransactionManagerTestCase(unittest.TestCase):
     def test_interface_contracts(self):
         manager = TransactionManager()
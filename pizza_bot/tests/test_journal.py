@@ -0,0 +1,75 @@
+
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock as M
+from pizza_bot.journal import JournalTransactionManager, AsyncJournalTransactionManager
+
+
+class JournalTransactionManagerTestCase(unittest.TestCase):
+    """
+    JournalTransactionManager appends orders to journal file in background
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'orders.jsonl')
+        self.manager = JournalTransactionManager(self.path)
+
+    def tearDown(self):
+        self.manager.close()
+        self.directory.cleanup()
+
+    def read(self):
+        with open(self.path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def test_create_order(self):
+        dialog = M(chat=42, update_id=7)
+        order = M(pizza_size=1, payment_method=0, is_confirmed=True)
+        self.manager.create_order(dialog, order)
+        self.manager.flush()
+
+        record, = self.read()
+        self.assertIsInstance(record.pop('time'), float)
+        self.assertEqual(record, dict(chat=42, update_id=7, pizza_size=1, payment_method=0, is_confirmed=True))
+
+    def test_close_writes_acknowledged(self):
+        for chat in range(100):
+            self.manager.create_order(M(chat=chat, update_id=None), M(pizza_size=0, payment_method=1, is_confirmed=True))
+        self.manager.close()
+
+        self.assertIsNone(self.manager.fd)
+        self.assertEqual([record['chat'] for record in self.read()], list(range(100)))
+
+    def test_appends_to_existing(self):
+        self.manager.create_order(M(chat=1, update_id=None), M(pizza_size=0, payment_method=1, is_confirmed=True))
+        self.manager.close()
+        self.manager = JournalTransactionManager(self.path)
+        self.manager.create_order(M(chat=2, update_id=None), M(pizza_size=0, payment_method=1, is_confirmed=True))
+        self.manager.close()
+
+        self.assertEqual([record['chat'] for record in self.read()], [1, 2])
+
+
+class AsyncJournalTransactionManagerTestCase(unittest.TestCase):
+    def test_create_order(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'orders.jsonl')
+            manager = AsyncJournalTransactionManager(path, max_queue=1)
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            try:
+                orders = [
+                    manager.create_order(M(chat=chat, update_id=None), M(pizza_size=0, payment_method=1, is_confirmed=True))
+                    for chat in range(5)
+                ]
+                loop.run_until_complete(asyncio.gather(*orders))
+            finally:
+                manager.close()
+                loop.close()
+                asyncio.set_event_loop(None)
+
+            with open(path, encoding='utf-8') as f:
+                self.assertEqual(sorted(json.loads(line)['chat'] for line in f), list(range(5)))
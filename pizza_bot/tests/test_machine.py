@@ -0,0 +1,102 @@
+
+import unittest
+from unittest.mock import MagicMock as M, call
+from pizza_bot.machine import CompiledMachine, MachineError
+
+
+class Model(object):
+    def __init__(self):
+        self.calls = M()
+
+    def before_go(self, *args, **kwargs):
+        self.calls.before_go(self.state, *args, **kwargs)
+
+    def after_go(self, *args, **kwargs):
+        self.calls.after_go(self.state, *args, **kwargs)
+
+
+class CompiledMachineTestCase(unittest.TestCase):
+    """
+    CompiledMachine builds model class with triggers shared by all models
+    """
+    states = ['a', 'b', 'c']
+    transitions = [
+        dict(trigger='go', source='a', dest='b', before='before_go', after='after_go'),
+        dict(trigger='back', source=['b', 'c'], dest='a'),
+        dict(trigger='jump', source='b', dest='c'),
+    ]
+
+    def setUp(self):
+        self.machine = CompiledMachine(Model, self.states, self.transitions, 'a')
+
+    def test_create_model(self):
+        model = self.machine.create_model()
+        self.assertIsInstance(model, Model)
+        self.assertIs(type(model), self.machine.model_class)
+        self.assertEqual(model.state, 'a')
+        self.assertIs(model.machine, self.machine)
+        self.assertNotIn('go', vars(model))
+
+    def test_models_are_independent(self):
+        first, second = self.machine.create_model(), self.machine.create_model()
+        first.go()
+        self.assertEqual(first.state, 'b')
+        self.assertEqual(second.state, 'a')
+
+    def test_triggers(self):
+        model = self.machine.create_model()
+        value = object()
+
+        self.assertTrue(model.go(value))
+        self.assertEqual(model.state, 'b')
+        self.assertEqual(model.calls.method_calls, [
+            call.before_go('a', value),
+            call.after_go('b', value),
+        ])
+
+        model.jump()
+        self.assertEqual(model.state, 'c')
+        model.back()
+        self.assertEqual(model.state, 'a')
+
+    def test_invalid_trigger(self):
+        model = self.machine.create_model()
+        with self.assertRaises(MachineError) as cm:
+            model.jump()
+        self.assertEqual(cm.exception.args, ("Can't trigger event jump from state a",))
+        self.assertEqual(model.state, 'a')
+
+    def test_state_checks(self):
+        model = self.machine.create_model()
+        for state in self.states:
+            with self.subTest('Test is_{}'.format(state)):
+                self.machine.set_state(state, model)
+                for other in self.states:
+                    self.assertEqual(getattr(model, 'is_{}'.format(other))(), other == state)
+
+    def test_set_state_unknown(self):
+        model = self.machine.create_model()
+        with self.assertRaises(ValueError):
+            self.machine.set_state('d', model)
+        self.assertEqual(model.state, 'a')
+
+    def test_slotted_model(self):
+        class SlottedModel(object):
+            __slots__ = ('state',)
+
+        machine = CompiledMachine(SlottedModel, self.states, self.transitions, 'a')
+        model = machine.create_model()
+        self.assertFalse(hasattr(model, '__dict__'))
+        machine.set_state('b', model)
+        model.jump()
+        self.assertTrue(model.is_c())
+
+    def test_unknown_states(self):
+        with self.subTest('Test unknown initial state'):
+            with self.assertRaises(ValueError):
+                CompiledMachine(Model, self.states, self.transitions, 'd')
+
+        with self.subTest('Test unknown transition state'):
+            transitions = [dict(trigger='go', source='a', dest='d')]
+            with self.assertRaises(ValueError):
+                CompiledMachine(Model, self.states, transitions, 'a')
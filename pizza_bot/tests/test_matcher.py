@@ -0,0 +1,62 @@
+
+import unittest
+from pizza_bot.matcher import VariantMatcher, within_one_edit
+
+
+class WithinOneEditTestCase(unittest.TestCase):
+    def test_edits(self):
+        asserts = {
+            ('картой', 'картой'): True,
+            ('картой', 'катрой'): True,
+            ('картой', 'картрй'): True,
+            ('картой', 'картй'): True,
+            ('картой', 'карттой'): True,
+            ('картой', 'кртй'): False,
+            ('картой', 'катрйо'): False,
+            ('картой', 'картойка'): False,
+        }
+        for (a, b), expected in asserts.items():
+            with self.subTest('Test {} against {}'.format(a, b)):
+                self.assertEqual(within_one_edit(a, b), expected)
+                self.assertEqual(within_one_edit(b, a), expected)
+
+
+class VariantMatcherTestCase(unittest.TestCase):
+    """
+    VariantMatcher accepts exact words, other layouts, inflections and typos
+    """
+    def setUp(self):
+        self.sizes = VariantMatcher({'маленькую': 0, 'большую': 1})
+        self.answers = VariantMatcher({'да': True, 'нет': False})
+
+    def check(self, matcher, asserts):
+        for text, expected in asserts.items():
+            with self.subTest('Test match {!r}'.format(text)):
+                self.assertEqual(matcher.match(text, 'invalid'), expected)
+
+    def test_exact(self):
+        self.check(self.sizes, {'большую': 1, ' МАЛЕНЬКУЮ ': 0, 'Большую!': 1})
+        self.check(self.answers, {'да': True, 'Нет.': False})
+
+    def test_keyboard_layout(self):
+        self.check(self.answers, {'lf': True, 'ytn': False, 'LF': True})
+        self.check(self.sizes, {',jkmie.': 1})
+
+    def test_inflections(self):
+        self.check(self.sizes, {'большая': 1, 'большой': 1, 'маленькая': 0, 'маленькой': 0})
+
+    def test_typos(self):
+        self.check(self.sizes, {'бльшую': 1, 'болшую': 1, 'ьольшую': 1, 'малнькую': 0, 'маленкьую': 0})
+
+    def test_invalid(self):
+        self.check(self.sizes, {'пепперони': 'invalid', '': 'invalid', 'бо': 'invalid', 'среднюю': 'invalid'})
+        # Short words are not guessed
+        self.check(self.answers, {'д': 'invalid', 'дат': 'invalid', 'нее': 'invalid', 'нетт': 'invalid'})
+
+    def test_ambiguous(self):
+        matcher = VariantMatcher({'картой': 1, 'картон': 2, 'наличкой': 3})
+        self.check(matcher, {'картой': 1, 'картон': 2, 'карто': 'invalid', 'карта': 'invalid', 'наличные': 3})
+
+    def test_default(self):
+        self.assertIsNone(self.sizes.match('пепперони'))
+        self.assertIs(self.answers.match('нет', 'invalid'), False)
@@ -0,0 +1,116 @@
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from unittest.mock import MagicMock as M
+from pizza_bot import metrics
+from pizza_bot.bot import PizzaBot
+from pizza_bot.metrics import Counter, Gauge, Histogram, Registry, start_http_server
+
+
+class MetricsTestCase(unittest.TestCase):
+    """
+    Metrics recorded per thread are summed and exposed in Prometheus format
+    """
+    def test_counter_across_threads(self):
+        counter = Counter('c_total', 'Counter', ('state',))
+
+        def work():
+            for _ in range(1000):
+                counter.inc('idle')
+            counter.inc('size_picked', amount=5)
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(counter.total('idle'), 4000)
+        self.assertEqual(counter.total('size_picked'), 20)
+        # Dicts of finished threads are merged on collection
+        self.assertEqual((counter.shards, counter.retired), ([], {('idle',): 4000, ('size_picked',): 20}))
+        self.assertEqual(counter.expose(), (
+            '# HELP c_total Counter\n'
+            '# TYPE c_total counter\n'
+            'c_total{state="idle"} 4000\n'
+            'c_total{state="size_picked"} 20\n'
+        ))
+
+    def test_short_lived_threads(self):
+        counter = Counter('c_total', 'Counter')
+        histogram = Histogram('h_seconds', 'Histogram', buckets=(1.0,))
+        for _ in range(50):
+            thread = threading.Thread(target=lambda: (counter.inc(), histogram.observe(0.5)))
+            thread.start()
+            thread.join()
+
+        self.assertLessEqual(len(counter.shards), 1)
+        self.assertEqual(counter.total(), 50)
+        self.assertEqual(histogram.totals(), {(): [50, 0, 25.0]})
+        self.assertEqual(histogram.shards, [])
+
+    def test_histogram(self):
+        histogram = Histogram('h_seconds', 'Histogram', buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(value)
+        self.assertEqual(histogram.expose(), (
+            '# HELP h_seconds Histogram\n'
+            '# TYPE h_seconds histogram\n'
+            'h_seconds_bucket{le="0.1"} 2\n'
+            'h_seconds_bucket{le="1.0"} 3\n'
+            'h_seconds_bucket{le="+Inf"} 4\n'
+            'h_seconds_sum 3.65\n'
+            'h_seconds_count 4\n'
+        ))
+
+    def test_gauge(self):
+        gauge = Gauge('g', 'Gauge')
+        self.assertEqual(gauge.expose(), '# HELP g Gauge\n# TYPE g gauge\n')
+        gauge.set_function(lambda: 3)
+        self.assertTrue(gauge.expose().endswith('g 3\n'))
+
+    def test_extra_labels(self):
+        registry = Registry()
+        registry.register(Counter('c_total', 'Counter', ('state',))).inc('idle')
+        registry.register(Histogram('h_seconds', 'Histogram', buckets=(1.0,))).observe(0.5)
+        registry.register(Gauge('g', 'Gauge', lambda: 3))
+        samples = [line for line in registry.expose([('pid', 7)]).splitlines() if not line.startswith('#')]
+        self.assertEqual(samples, [
+            'c_total{state="idle",pid="7"} 1',
+            'h_seconds_bucket{pid="7",le="1.0"} 1',
+            'h_seconds_bucket{pid="7",le="+Inf"} 1',
+            'h_seconds_sum{pid="7"} 0.5',
+            'h_seconds_count{pid="7"} 1',
+            'g{pid="7"} 3',
+        ])
+
+    def test_http_server(self):
+        registry = Registry()
+        registry.register(Counter('c_total', 'Counter')).inc()
+        server = start_http_server(0, '127.0.0.1', registry)
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        try:
+            with urllib.request.urlopen(url + '/metrics') as response:
+                self.assertEqual(response.read().decode('utf-8'), registry.expose())
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(url + '/other')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test_bot_turns(self):
+        bot = PizzaBot(M(), shared_machine=True)
+        dialog = M()
+        dialog.get_input.return_value = None
+        turns = metrics.TURNS.total('idle', 'valid'), metrics.TURNS.total('size_picked', 'invalid')
+        orders = metrics.ORDERS.total()
+
+        bot.on_chat_start(dialog)
+        for text in ('большую', 'ой', 'картой', 'да'):
+            dialog.get_input.return_value = text
+            bot.on_chat_input(dialog)
+
+        self.assertEqual(metrics.TURNS.total('idle', 'valid'), turns[0] + 1)
+        self.assertEqual(metrics.TURNS.total('size_picked', 'invalid'), turns[1] + 1)
+        self.assertEqual(metrics.ORDERS.total(), orders + 1)
+        self.assertIn('pizza_bot_turn_seconds_count{state="payment_picked"}', metrics.REGISTRY.expose())
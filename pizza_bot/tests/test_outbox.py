@@ -0,0 +1,93 @@
+import random
+import threading
+import time
+import unittest
+from unittest.mock import MagicMock as M
+import telegram
+from pizza_bot.outbox import Outbox
+
+
+class OutboxTestCase(unittest.TestCase):
+    """
+    Outbox delivers queued messages in background, in order per chat, with retries
+    """
+    def setUp(self):
+        self.bot = M()
+        self.outbox = Outbox(self.bot, senders=4, base_delay=0.001)
+
+    def tearDown(self):
+        self.outbox.close()
+
+    def test_send_returns_at_once(self):
+        release = threading.Event()
+        self.bot.send_message.side_effect = lambda chat_id, text: release.wait()
+        started = time.monotonic()
+        self.outbox.send_message(1, 'a')
+        self.outbox.send_message(1, 'b')
+        self.assertLess(time.monotonic() - started, 0.5)
+        self.assertEqual(len(self.outbox), 1)
+
+        release.set()
+        self.outbox.flush()
+        self.assertEqual(len(self.outbox), 0)
+        self.assertEqual(self.bot.send_message.call_count, 2)
+
+    def test_order_per_chat(self):
+        sent = []
+
+        def send_message(chat_id, text):
+            time.sleep(random.random() / 1000)
+            sent.append((chat_id, text))
+        self.bot.send_message.side_effect = send_message
+
+        for index in range(20):
+            for chat_id in range(10):
+                self.outbox.send_message(chat_id, index)
+        self.outbox.flush()
+
+        self.assertEqual(len(sent), 200)
+        for chat_id in range(10):
+            self.assertEqual([text for sent_chat, text in sent if sent_chat == chat_id], list(range(20)))
+
+    def test_retry(self):
+        errors = [telegram.error.TimedOut(), telegram.error.RetryAfter(0), None]
+
+        def send_message(chat_id, text):
+            error = errors.pop(0)
+            if error is not None:
+                raise error
+        self.bot.send_message.side_effect = send_message
+
+        self.outbox.send_message(1, 'a')
+        self.outbox.flush()
+        self.assertEqual(self.bot.send_message.call_count, 3)
+        self.assertEqual(errors, [])
+
+    def test_drop(self):
+        errors = {
+            'bad': telegram.error.BadRequest('Chat not found'),
+            'crash': ValueError('bug'),
+            'down': telegram.error.NetworkError('Bad Gateway'),
+        }
+        for text, error in errors.items():
+            with self.subTest('Test drop on {!r}'.format(error)):
+                self.bot.reset_mock()
+                self.bot.send_message.side_effect = error
+                with self.assertLogs(level='ERROR'):
+                    self.outbox.send_message(1, text)
+                    self.outbox.flush()
+                expected = self.outbox.max_retries + 1 if text == 'down' else 1
+                self.assertEqual(self.bot.send_message.call_count, expected)
+
+        # Chat keeps receiving after dropped message
+        self.bot.send_message.side_effect = None
+        self.outbox.send_message(1, 'next')
+        self.outbox.flush()
+        self.bot.send_message.assert_called_with(1, 'next')
+
+    def test_limiter(self):
+        limiter = M()
+        self.outbox.limiter = limiter
+        self.outbox.send_message(3, 'a')
+        self.outbox.flush()
+        limiter.acquire.assert_called_once_with(3)
@@ -0,0 +1,127 @@
+import unittest
+from unittest.mock import MagicMock as M, call, patch
+import telegram
+from telegram.utils.request import Request
+from pizza_bot.fake_telegram import FakeBotApi
+from pizza_bot.dedup import UpdateWindow
+from pizza_bot.polling import LongPoller, group_by_chat
+from pizza_bot.tests.test_fake_telegram import TOKEN
+
+
+def update_data(update_id, chat_id, text='да'):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': text,
+        },
+    }
+
+
+class GroupByChatTestCase(unittest.TestCase):
+    def test_group(self):
+        updates = [telegram.Update.de_json(update_data(index, chat_id), None)
+                   for index, chat_id in enumerate([3, 1, 3, 2, 1])]
+        updates.append(telegram.Update(10))
+        photo = update_data(11, 3)
+        del photo['message']['text']
+        photo['message']['photo'] = []
+        updates.append(telegram.Update.de_json(photo, None))
+
+        chats = group_by_chat(updates)
+        self.assertEqual(list(chats), [3, 1, 2])
+        self.assertEqual([update.update_id for update in chats[3]], [0, 2])
+        self.assertEqual([update.update_id for update in chats[1]], [1, 4])
+
+
+class LongPollerTestCase(unittest.TestCase):
+    """
+    LongPoller moves offset past a batch only once it is handled
+    """
+    def test_offset_after_handled(self):
+        bot = M()
+        handle_batch = M()
+        poller = LongPoller(bot, handle_batch, limit=50, timeout=5)
+        bot.get_updates.return_value = [M(update_id=7), M(update_id=9)]
+
+        self.assertEqual(poller.poll(), 2)
+        bot.get_updates.return_value = []
+        self.assertEqual(poller.poll(), 0)
+
+        handle_batch.side_effect = ValueError()
+        bot.get_updates.return_value = [M(update_id=10)]
+        with self.assertRaises(ValueError):
+            poller.poll()
+
+        self.assertEqual(bot.get_updates.call_args_list, [
+            call(offset=None, limit=50, timeout=5),
+            call(offset=10, limit=50, timeout=5),
+            call(offset=10, limit=50, timeout=5),
+        ])
+        self.assertEqual(poller.offset, 10)
+
+    def test_window(self):
+        bot = M()
+        handle_batch = M()
+        poller = LongPoller(bot, handle_batch, window=UpdateWindow())
+        poller.window.seen(7)
+
+        bot.get_updates.return_value = updates = [M(update_id=7), M(update_id=8)]
+        self.assertEqual(poller.poll(), 2)
+        handle_batch.assert_called_once_with(updates[1:])
+
+        bot.get_updates.return_value = [M(update_id=8)]
+        poller.poll()
+        self.assertEqual((handle_batch.call_count, poller.offset), (1, 9))
+
+    def test_window_failed_batch_handled_again(self):
+        bot = M()
+        handled = []
+
+        def handle_batch(updates):
+            if not handled:
+                handled.append(None)
+                raise ValueError()
+            handled.extend(updates)
+        poller = LongPoller(bot, handle_batch, window=UpdateWindow())
+        bot.get_updates.return_value = updates = [M(update_id=10), M(update_id=11)]
+
+        with self.assertRaises(ValueError):
+            poller.poll()
+        self.assertIsNone(poller.offset)
+        poller.poll()
+        self.assertEqual((handled[1:], poller.offset), (updates, 12))
+        self.assertEqual(poller.window.fresh([10, 11, 12]), [12])
+
+    def test_run_backs_off(self):
+        bot = M()
+        poller = LongPoller(bot, M(), max_delay=3)
+        bot.get_updates.side_effect = [telegram.error.NetworkError('down')] * 3 + [[]]
+        idle = M(side_effect=lambda: poller.failures or poller.stop())
+
+        with patch('pizza_bot.polling.time.sleep') as sleep, self.assertLogs(level='ERROR'):
+            poller.run(idle)
+
+        self.assertEqual(len(sleep.call_args_list), 3)
+        for (delay,), kwargs in sleep.call_args_list:
+            self.assertLessEqual(delay, 3)
+        self.assertEqual(poller.failures, 0)
+
+    def test_fake_api(self):
+        api = FakeBotApi().start()
+        try:
+            bot = telegram.Bot(TOKEN, base_url=api.url, request=Request(con_pool_size=2))
+            batches = []
+            poller = LongPoller(bot, lambda updates: batches.append([u.update_id for u in updates]),
+                                limit=2, timeout=0)
+            for update_id in range(1, 4):
+                api.push_update(update_data(update_id, 5))
+
+            while poller.poll():
+                pass
+            self.assertEqual(batches, [[1, 2], [3]])
+            self.assertEqual(list(api.updates), [])
+        finally:
+            api.stop()
@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import time
+import unittest
+import telegram
+from telegram.utils.request import Request
+from pizza_bot.fake_telegram import FakeBotApi
+from pizza_bot.ratelimit import RateLimiter, RateLimitedBot, TokenBucket
+from pizza_bot.tests.test_fake_telegram import TOKEN
+
+
+class TokenBucketTestCase(unittest.TestCase):
+    def test_refill(self):
+        bucket = TokenBucket(rate=2.0, capacity=2, now=0.0)
+        bucket.take(0.0)
+        bucket.take(0.0)
+        self.assertEqual(bucket.wait_time(0.0), 0.5)
+        self.assertEqual(bucket.wait_time(0.25), 0.25)
+        self.assertEqual(bucket.wait_time(0.5), 0.0)
+        self.assertFalse(bucket.is_full(0.5))
+        self.assertTrue(bucket.is_full(10.0))
+        self.assertEqual(bucket.tokens, 2)
+
+
+class RateLimiterTestCase(unittest.TestCase):
+    """
+    RateLimiter paces permits by global and per-chat buckets, chats take turns
+    """
+    def grants(self, limiter, requests):
+        """Request permits before scheduler starts, returns chats in grant order"""
+        granted = []
+        done = threading.Event()
+        for chat_id in requests:
+            limiter.request(chat_id, lambda chat_id=chat_id: (
+                granted.append(chat_id), len(granted) == len(requests) and done.set()))
+        limiter.start()
+        self.assertTrue(done.wait(5))
+        limiter.stop()
+        return granted
+
+    def test_chats_take_turns(self):
+        limiter = RateLimiter(global_rate=200.0, chat_rate=1000.0, global_burst=1, chat_burst=10)
+        self.assertEqual(self.grants(limiter, ['a'] * 4 + ['b', 'c']), ['a', 'b', 'c', 'a', 'a', 'a'])
+
+    def test_chat_rate(self):
+        limiter = RateLimiter(global_rate=1000.0, chat_rate=20.0, global_burst=100, chat_burst=1)
+        started = time.monotonic()
+        self.assertEqual(sorted(self.grants(limiter, ['a'] * 5 + ['b'])), ['a'] * 5 + ['b'])
+        # Four refills of chat bucket after first permit
+        self.assertGreaterEqual(time.monotonic() - started, 4 / 20.0)
+        self.assertEqual(set(limiter.waiters), set())
+
+    def test_sweep(self):
+        limiter = RateLimiter(global_rate=1000.0, chat_rate=1000.0)
+        self.grants(limiter, ['a', 'b'])
+        limiter.sweep(time.monotonic() + 1)
+        self.assertEqual(limiter.chat_buckets, dict())
+
+    def test_acquire_async(self):
+        limiter = RateLimiter(global_rate=1000.0, chat_rate=1000.0).start()
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(asyncio.wait_for(limiter.acquire_async(1), 5))
+        finally:
+            loop.close()
+            limiter.stop()
+
+
+class RateLimitedBotTestCase(unittest.TestCase):
+    """
+    Messages paced by RateLimiter are all accepted by API enforcing the limits
+    """
+    limits = dict(global_rate=50.0, chat_rate=10.0, global_burst=5, chat_burst=1)
+
+    def setUp(self):
+        self.api = FakeBotApi(**self.limits).start()
+        self.bot = telegram.Bot(TOKEN, base_url=self.api.url, request=Request(con_pool_size=8))
+
+    def tearDown(self):
+        self.api.stop()
+
+    def test_limits_enforced(self):
+        with self.assertRaises(telegram.error.RetryAfter):
+            for _ in range(3):
+                self.bot.send_message(1, 'hi')
+        self.assertEqual(self.api.rejected, 1)
+
+    def test_no_rejections(self):
+        limiter = RateLimiter(**self.limits).start()
+        bot = RateLimitedBot(self.bot, limiter)
+
+        def chat(chat_id):
+            for index in range(5):
+                bot.send_message(chat_id, str(index))
+        threads = [threading.Thread(target=chat, args=(chat_id,)) for chat_id in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        limiter.stop()
+
+        self.assertEqual(self.api.rejected, 0)
+        self.assertEqual(len(self.api.sent), 40)
+        for chat_id in range(8):
+            self.assertEqual([text for sent_chat, text in self.api.sent if sent_chat == chat_id], list('01234'))
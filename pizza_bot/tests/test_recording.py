@@ -0,0 +1,93 @@
+
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock as M, call, patch
+from pizza_bot.recording import MAGIC, RECORD, Recorder, Replayer, encode_record, read_records, record_updates
+
+
+class RecordingTestCase(unittest.TestCase):
+    """
+    Recorder appends text messages to binary recording, read back memory mapped
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'updates.rec')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        recorder = Recorder(self.path)
+        recorder.record(-100123456789, 'Большую "пиццу"', 1500000000.25)
+        recorder.record(7, '', 1500000001.5)
+        recorder.close()
+        recorder = Recorder(self.path)
+        recorder.record(8, 'да', 1500000002.0)
+        recorder.close()
+
+        self.assertEqual(list(read_records(self.path)), [
+            (-100123456789, 'Большую "пиццу"', 1500000000.25),
+            (7, '', 1500000001.5),
+            (8, 'да', 1500000002.0),
+        ])
+
+    def test_record_update(self):
+        recorder = Recorder(self.path)
+        recorder.record_update(M(message=M(chat_id=5, text='да')))
+        recorder.record_update(M(message=None))
+        recorder.record_update(M(message=M(chat_id=6, text=None)))
+        recorder.close()
+
+        (chat_id, text, timestamp), = read_records(self.path)
+        self.assertEqual((chat_id, text), (5, 'да'))
+        self.assertIsInstance(timestamp, float)
+
+    def test_record_updates(self):
+        recorder = M()
+        handler = M(__name__='handler', return_value='handled')
+        updates = [M(), M()]
+        wrapped = record_updates(recorder, handler)
+
+        self.assertEqual(wrapped('registry', 'bot', updates[0]), 'handled')
+        self.assertEqual(wrapped('registry', updates), 'handled')
+        handler.assert_has_calls([call('registry', 'bot', updates[0]), call('registry', updates)])
+        recorder.record_update.assert_has_calls([call(updates[0]), call(updates[0]), call(updates[1])])
+
+    def test_truncated_tail(self):
+        with open(self.path, 'wb') as f:
+            f.write(MAGIC + encode_record(1, 'да', 1.0) + encode_record(2, 'нет', 2.0)[:RECORD.size + 1])
+        self.assertEqual(list(read_records(self.path)), [(1, 'да', 1.0)])
+
+    def test_empty_and_foreign(self):
+        open(self.path, 'wb').close()
+        self.assertEqual(list(read_records(self.path)), [])
+        with open(self.path, 'wb') as f:
+            f.write(b'{"chat": 1}\n')
+        with self.assertRaises(ValueError):
+            list(read_records(self.path))
+
+
+class ReplayerTestCase(unittest.TestCase):
+    """
+    Replayer feeds recorded messages to bot chat by chat
+    """
+    def test_replay(self):
+        pizza_bot = M()
+        inputs = []
+        pizza_bot.on_chat_input.side_effect = lambda dialog: inputs.append((dialog.chat, dialog.message))
+        replayer = Replayer(pizza_bot)
+
+        count = replayer.replay([(1, 'привет', 0.0), (2, 'большую', 0.0), (1, 'да', 0.0)])
+
+        self.assertEqual(count, 3)
+        self.assertEqual(inputs, [(1, 'привет'), (2, 'большую'), (1, 'да')])
+        self.assertEqual(pizza_bot.on_chat_start.call_count, 2)
+        self.assertEqual(sorted(replayer.dialogs), [1, 2])
+
+    @patch('pizza_bot.recording.time')
+    def test_pacing(self, time):
+        time.monotonic.return_value = 100.0
+        replayer = Replayer(M(), speed=2)
+        replayer.replay([(1, 'a', 50.0), (1, 'b', 50.0), (1, 'c', 54.0)])
+        time.sleep.assert_called_once_with(2.0)
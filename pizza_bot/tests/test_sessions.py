@@ -0,0 +1,178 @@
+
+import time
+import unittest
+from unittest.mock import MagicMock as M, call
+from pizza_bot.sessions import SessionRegistry
+from pizza_bot.storage import SessionRecord
+
+
+class SessionRegistryTestCase(unittest.TestCase):
+    """
+    SessionRegistry owns dialogs and their bot conversations
+    """
+    def setUp(self):
+        self.pizza_bot = M()
+        self.pizza_bot.dialogs = dict()
+        self.pizza_bot.on_chat_exit.side_effect = self.pizza_bot.dialogs.pop
+        self.registry = SessionRegistry(self.pizza_bot, dialog_factory=self.create_dialog)
+
+    def create_dialog(self):
+        dialog = M(last_received=None)
+        self.pizza_bot.dialogs[dialog] = M()
+        return dialog
+
+    def fill(self, *keys):
+        dialogs = []
+        for timestamp, key in enumerate(keys):
+            dialog, is_new = self.registry.open(key)
+            dialog.last_received = timestamp
+            dialogs.append(dialog)
+        return dialogs
+
+    def test_open(self):
+        with self.subTest('Test new dialog created'):
+            dialog, is_new = self.registry.open('a')
+            self.assertTrue(is_new)
+            self.assertIn('a', self.registry)
+            self.assertEqual(len(self.registry), 1)
+
+        with self.subTest('Test existing dialog returned'):
+            same_dialog, is_new = self.registry.open('a')
+            self.assertFalse(is_new)
+            self.assertIs(same_dialog, dialog)
+            self.assertEqual(len(self.registry), 1)
+
+    def test_open_moves_to_end(self):
+        self.fill('a', 'b', 'c')
+        self.registry.open('a')
+        self.assertEqual(list(self.registry.sessions), ['b', 'c', 'a'])
+
+    def test_close(self):
+        dialog, = self.fill('a')
+        self.registry.close('a')
+        self.registry.close('unknown')
+        self.assertNotIn('a', self.registry)
+        self.assertEqual(self.pizza_bot.on_chat_exit.call_args_list, [call(dialog)])
+        self.assertEqual(self.pizza_bot.dialogs, {})
+
+    def test_purge(self):
+        a, b, c = self.fill('a', 'b', 'c')
+
+        with self.subTest('Test nothing expired'):
+            self.assertEqual(self.registry.purge(0), 0)
+            self.assertEqual(len(self.registry), 3)
+
+        with self.subTest('Test expired sessions purged from both sides'):
+            self.assertEqual(self.registry.purge(2), 2)
+            self.assertEqual(list(self.registry.sessions), ['c'])
+            self.assertEqual(self.pizza_bot.on_chat_exit.call_args_list, [call(a), call(b)])
+            self.assertEqual(list(self.pizza_bot.dialogs), [c])
+
+    def test_purge_stops_at_fresh_session(self):
+        a, b = self.fill('a', 'b')
+        self.registry.open('a')
+        self.assertEqual(self.registry.purge(1), 0)
+        self.assertEqual(len(self.registry), 2)
+
+    def test_purge_keeps_dialogs_without_input(self):
+        self.registry.open('a')
+        self.assertEqual(self.registry.purge(100), 0)
+        self.assertIn('a', self.registry)
+
+    def test_max_sessions(self):
+        self.registry.max_sessions = 2
+        a, b, c = self.fill('a', 'b', 'c')
+        self.assertEqual(list(self.registry.sessions), ['b', 'c'])
+        self.assertEqual(self.pizza_bot.on_chat_exit.call_args_list, [call(a)])
+
+        self.registry.open('b')
+        self.fill('d')
+        self.assertEqual(list(self.registry.sessions), ['b', 'd'])
+
+    def test_end_not_started_dialog(self):
+        dialog = M()
+        self.registry.end(dialog)
+        self.assertEqual(self.pizza_bot.on_chat_exit.call_count, 0)
+
+
+class SessionRegistryStoreTestCase(unittest.TestCase):
+    """
+    SessionRegistry checkpoints sessions to the store and restores them lazily
+    """
+    def setUp(self):
+        self.pizza_bot = M()
+        self.pizza_bot.dialogs = dict()
+        self.store = M()
+        self.store.load.return_value = None
+        self.registry = SessionRegistry(self.pizza_bot, dialog_factory=M, store=self.store)
+
+    def test_open_restores(self):
+        record = SessionRecord('size_picked', 1, None, 10.0, 3, 2)
+        self.store.load.return_value = record
+
+        dialog, is_new = self.registry.open(5)
+
+        self.assertFalse(is_new)
+        self.assertEqual(self.store.load.call_args_list, [call(5)])
+        self.assertEqual(self.pizza_bot.restore_dialog.call_args_list, [
+            call(dialog, 'size_picked', 1, None, 2)
+        ])
+        self.assertEqual((dialog.last_received, dialog.update_id), (10.0, 3))
+
+        with self.subTest('Test store not queried for live session'):
+            self.registry.open(5)
+            self.assertEqual(self.store.load.call_count, 1)
+
+    def test_open_expired(self):
+        self.registry.threshold = 60
+        self.store.load.return_value = SessionRecord('size_picked', 1, None, time.time() - 120, 3, 2)
+
+        dialog, is_new = self.registry.open(5)
+
+        self.assertTrue(is_new)
+        self.assertEqual(self.pizza_bot.restore_dialog.call_count, 0)
+
+        with self.subTest('Test session within threshold restored'):
+            self.store.load.return_value = SessionRecord('size_picked', 1, None, time.time() - 30, 3, 2)
+            dialog, is_new = self.registry.open(6)
+            self.assertFalse(is_new)
+            self.assertEqual(self.pizza_bot.restore_dialog.call_count, 1)
+
+    def test_open_unknown(self):
+        dialog, is_new = self.registry.open(5)
+        self.assertTrue(is_new)
+        self.assertEqual(self.pizza_bot.restore_dialog.call_count, 0)
+
+    def test_save(self):
+        dialog, is_new = self.registry.open(5)
+        dialog.last_received = 10.0
+        dialog.update_id = 3
+
+        with self.subTest('Test not started dialog skipped'):
+            self.registry.save(5, dialog)
+            self.assertEqual(self.store.save.call_count, 0)
+
+        with self.subTest('Test order state saved'):
+            order = M(state='payment_picked', pizza_size=0, payment_method=1, flow_version=2)
+            self.pizza_bot.dialogs[dialog] = order, M()
+            self.registry.save(5, dialog)
+            self.assertEqual(self.store.save.call_args_list, [
+                call(5, SessionRecord('payment_picked', 0, 1, 10.0, 3, 2))
+            ])
+
+    def test_close_and_purge(self):
+        self.registry.open(5)
+        self.registry.close(5)
+        self.registry.purge(100)
+        self.assertEqual(self.store.method_calls[-2:], [call.delete(5), call.purge(100)])
+
+        with self.subTest('Test store purged by the caller'):
+            self.registry.purge(200, purge_store=False)
+            self.assertEqual(self.store.method_calls[-1], call.purge(100))
+
+    def test_evicted_session_kept(self):
+        self.registry.max_sessions = 1
+        self.registry.open(5)
+        self.registry.open(6)
+        self.assertNotIn(5, self.registry)
+        self.assertEqual(self.store.delete.call_count, 0)
@@ -0,0 +1,68 @@
+
+import threading
+import unittest
+from unittest.mock import patch
+from pizza_bot.sharding import ShardedExecutor
+
+
+class ShardedExecutorTestCase(unittest.TestCase):
+    """
+    ShardedExecutor runs work of each key on one shard in submit order
+    """
+    def setUp(self):
+        self.states = [[] for _ in range(4)]
+        self.executor = ShardedExecutor(self.states)
+
+    def tearDown(self):
+        self.executor.stop()
+
+    @staticmethod
+    def record(state, key, value):
+        state.append((key, value, threading.current_thread().name))
+
+    def test_per_key_order(self):
+        for value in range(50):
+            for key in range(8):
+                self.executor.submit(key, self.record, key, value)
+        self.executor.join()
+
+        for key in range(8):
+            with self.subTest('Test key {}'.format(key)):
+                shard = self.executor.shard_for(key)
+                records = [record for record in shard.state if record[0] == key]
+                self.assertEqual([value for _, value, _ in records], list(range(50)))
+                self.assertEqual({thread for _, _, thread in records}, {shard.thread.name})
+                for state in self.states:
+                    if state is not shard.state:
+                        self.assertFalse(any(record[0] == key for record in state))
+
+    def test_keys_spread_across_shards(self):
+        for key in range(8):
+            self.executor.submit(key, self.record, key, None)
+        self.executor.join()
+        self.assertEqual(sum(map(len, self.states)), 8)
+        self.assertGreater(sum(1 for state in self.states if state), 1)
+
+    def test_broadcast(self):
+        self.executor.broadcast(self.record, 'all', None)
+        self.executor.join()
+        for shard in self.executor.shards:
+            self.assertEqual(shard.state, [('all', None, shard.thread.name)])
+
+    def test_failure_logged(self):
+        def fail(state):
+            raise ValueError()
+
+        with patch('pizza_bot.sharding.logging') as logging:
+            self.executor.submit(1, fail)
+            self.executor.submit(1, self.record, 1, 'after')
+            self.executor.join()
+
+        self.assertEqual(logging.exception.call_count, 1)
+        self.assertEqual(self.executor.shard_for(1).state[-1][:2], (1, 'after'))
+
+    def test_stop(self):
+        self.executor.submit(1, self.record, 1, 'last')
+        self.executor.stop()
+        self.assertEqual(self.executor.shard_for(1).state[-1][:2], (1, 'last'))
+        self.assertFalse(any(shard.thread.is_alive() for shard in self.executor.shards))
@@ -0,0 +1,36 @@
+
+import os
+import subprocess
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+HEAVY = ('telegram', 'transitions', 'asyncio')
+
+
+def loaded_modules(module):
+    """Heavy modules present after importing module in a fresh interpreter"""
+    code = 'import sys, {}; print(" ".join(name for name in {!r} if name in sys.modules))'.format(module, HEAVY)
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=ROOT)
+    return output.decode('utf-8').split()
+
+
+class StartupTestCase(unittest.TestCase):
+    """
+    Entry points import heavy dependencies on first use, not at startup
+    """
+    def test_entry_points(self):
+        for module in ('cli', 'telegram_bot', 'pizza_bot.wsgi', 'pizza_bot.updates'):
+            with self.subTest(module=module):
+                self.assertEqual(loaded_modules(module), [])
+
+    def test_machine_imported_on_first_dialog(self):
+        code = (
+            'import sys\n'
+            'from pizza_bot.bot import PizzaBot\n'
+            'from benchmarks.common import NullDialog, NullTransactionManager\n'
+            'assert "transitions" not in sys.modules\n'
+            'PizzaBot(NullTransactionManager()).start_dialog(NullDialog())\n'
+            'assert "transitions" in sys.modules\n'
+        )
+        subprocess.check_call([sys.executable, '-c', code], cwd=ROOT)
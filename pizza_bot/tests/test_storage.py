@@ -0,0 +1,249 @@
+
+import fcntl
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+from pizza_bot.background import BatchWriter
+from pizza_bot.storage import SQLiteSessionStore, SessionRecord, SnapshotSessionStore
+
+
+class SQLiteSessionStoreTestCase(unittest.TestCase):
+    """
+    SQLiteSessionStore persists session records written behind in batches
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'sessions.db')
+        self.store = SQLiteSessionStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def rows(self):
+        with sqlite3.connect(self.path) as connection:
+            return connection.execute('SELECT * FROM sessions ORDER BY chat_id').fetchall()
+
+    def test_wal_mode(self):
+        with sqlite3.connect(self.path) as connection:
+            mode, = connection.execute('PRAGMA journal_mode').fetchone()
+        self.assertEqual(mode, 'wal')
+
+    def test_save_and_load(self):
+        record = SessionRecord('size_picked', 1, None, 10.0)
+        self.store.save(5, record)
+
+        with self.subTest('Test pending record loaded'):
+            self.assertEqual(self.store.load(5), record)
+
+        with self.subTest('Test committed record loaded'):
+            self.store.flush()
+            self.assertEqual(self.store.pending, {})
+            self.assertEqual(self.store.load(5), record)
+            self.assertEqual(self.rows(), [(5, 'size_picked', 1, None, 10.0, None, None, None)])
+
+        with self.subTest('Test unknown record'):
+            self.assertIsNone(self.store.load(6))
+
+    def test_delete(self):
+        self.store.save(5, SessionRecord('idle', None, None, 10.0))
+        self.store.flush()
+        self.store.delete(5)
+        self.assertIsNone(self.store.load(5))
+        self.store.flush()
+        self.assertIsNone(self.store.load(5))
+        self.assertEqual(self.rows(), [])
+
+    def test_purge(self):
+        for chat_id in range(4):
+            self.store.save(chat_id, SessionRecord('idle', None, None, float(chat_id)))
+        self.store.purge(2)
+        self.store.flush()
+        self.assertEqual([row[0] for row in self.rows()], [2, 3])
+
+    def test_reopen(self):
+        record = SessionRecord('payment_picked', 0, 1, 10.0, 3, 2)
+        self.store.save(5, record)
+        self.store.close()
+
+        self.store = SQLiteSessionStore(self.path)
+        self.assertEqual(self.store.load(5), record)
+
+    def test_migrate(self):
+        self.store.close()
+        os.remove(self.path)
+        with sqlite3.connect(self.path) as connection:
+            connection.execute(
+                'CREATE TABLE sessions (chat_id INTEGER PRIMARY KEY, state TEXT NOT NULL, '
+                'pizza_size INTEGER, payment_method INTEGER, last_received REAL)')
+            connection.execute("INSERT INTO sessions VALUES (5, 'idle', NULL, NULL, 10.0)")
+
+        self.store = SQLiteSessionStore(self.path)
+        self.assertEqual(self.store.load(5), SessionRecord('idle', None, None, 10.0, None))
+        self.store.save(5, SessionRecord('size_picked', 1, None, 11.0, 3))
+        self.store.flush()
+        self.assertEqual(self.rows(), [(5, 'size_picked', 1, None, 11.0, 3, None, None)])
+
+    def test_update(self):
+        with self.subTest('Test callback gets no record for unknown chat'):
+            record = SessionRecord('idle', None, None, 10.0)
+            seen = []
+            rv = self.store.update(5, lambda old: seen.append(old) or record)
+            self.assertEqual((seen, rv), ([None], record))
+            self.assertEqual(self.rows(), [(5, 'idle', None, None, 10.0, None, None, None)])
+
+        with self.subTest('Test callback gets saved record'):
+            self.store.update(5, lambda old: old._replace(state='size_picked'))
+            self.assertEqual(self.store.load(5).state, 'size_picked')
+
+        with self.subTest('Test reply kept and unchanged record not written'):
+            self.store.update(5, lambda old: old._replace(update_id=7, reply='Привет'))
+            self.assertEqual(self.store.load(5).reply, 'Привет')
+            changes = self.store.local.locking_connection.total_changes
+            self.assertEqual(self.store.update(5, lambda old: old).reply, 'Привет')
+            self.assertEqual(self.store.local.locking_connection.total_changes, changes)
+
+        with self.subTest('Test failed callback rolls back'):
+            def fail(old):
+                raise ValueError()
+            with self.assertRaises(ValueError):
+                self.store.update(5, fail)
+            self.assertEqual(self.store.load(5).state, 'size_picked')
+
+        with self.subTest('Test None deletes record'):
+            self.assertIsNone(self.store.update(5, lambda old: None))
+            self.assertEqual(self.rows(), [])
+
+    def test_update_locks_chat_across_processes(self):
+        other = SQLiteSessionStore(self.path)
+        try:
+            def locked(chat_id):
+                """Whether other process fails to lock the chat"""
+                code = 'import fcntl, os, sys; fcntl.lockf(os.open(sys.argv[1], os.O_RDWR), {}, 1, {})'.format(
+                    fcntl.LOCK_EX | fcntl.LOCK_NB, chat_id % 4096)
+                return subprocess.call([sys.executable, '-c', code, self.path + '-lock'], stderr=subprocess.DEVNULL) != 0
+
+            def turn(old):
+                self.assertEqual((locked(5), locked(6)), (True, False))
+                # Database is not locked while the turn runs
+                other.update(6, lambda old: SessionRecord('idle', None, None, 2.0))
+                return SessionRecord('idle', None, None, 1.0)
+
+            self.store.update(5, turn)
+            self.assertFalse(locked(5))
+            self.assertEqual([row[0] for row in self.rows()], [5, 6])
+        finally:
+            other.close()
+
+
+class SnapshotSessionStoreTestCase(unittest.TestCase):
+    """
+    SnapshotSessionStore appends changes to tail and compacts them on close
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'sessions.snapshot')
+        self.store = SnapshotSessionStore(self.path)
+
+    def tearDown(self):
+        self.store.close()
+        self.directory.cleanup()
+
+    def reopen(self):
+        self.store.close()
+        self.store = SnapshotSessionStore(self.path)
+
+    def test_save_and_load(self):
+        record = SessionRecord('size_picked', 1, None, 10.0, 8, 2)
+        self.store.save(5, record)
+        self.store.save(-7, SessionRecord('idle', None, None, None))
+
+        with self.subTest('Test record loaded from tail'):
+            self.assertEqual(self.store.load(5), record)
+            self.assertIsNone(self.store.load(6))
+
+        with self.subTest('Test record loaded from snapshot'):
+            self.reopen()
+            self.assertEqual(self.store.count, 2)
+            self.assertEqual(self.store.tail, {})
+            self.assertEqual(self.store.load(5), record)
+            self.assertEqual(self.store.load(-7), SessionRecord('idle', None, None, None))
+            self.assertIsNone(self.store.load(6))
+
+    def test_binary_search(self):
+        records = {chat_id: SessionRecord('payment_picked', chat_id % 2, 1, float(chat_id), chat_id + 1000)
+                   for chat_id in range(-1000, 1000, 3)}
+        for chat_id, record in records.items():
+            self.store.save(chat_id, record)
+        self.reopen()
+
+        for chat_id in range(-1002, 1002):
+            self.assertEqual(self.store.load(chat_id), records.get(chat_id))
+
+    def test_tail_replayed_on_open(self):
+        for chat_id in range(4):
+            self.store.save(chat_id, SessionRecord('idle', None, None, float(chat_id)))
+        self.reopen()
+        self.store.save(1, SessionRecord('size_picked', 0, None, 5.0))
+        self.store.save(9, SessionRecord('custom_state', None, None, 5.0))
+        self.store.delete(2)
+        self.store.purge(1)
+        self.store.flush()
+
+        # Process crashed without compacting
+        other = SnapshotSessionStore(self.path)
+        try:
+            self.assertEqual(other.states[-1], 'custom_state')
+            self.assertEqual({chat_id: other.load(chat_id) for chat_id in range(10) if other.load(chat_id)}, {
+                1: SessionRecord('size_picked', 0, None, 5.0),
+                3: SessionRecord('idle', None, None, 3.0),
+                9: SessionRecord('custom_state', None, None, 5.0),
+            })
+        finally:
+            other.close()
+
+    def test_purge(self):
+        for chat_id in range(4):
+            self.store.save(chat_id, SessionRecord('idle', None, None, float(chat_id)))
+        self.reopen()
+        self.store.save(4, SessionRecord('idle', None, None, 0.0))
+        self.store.save(0, SessionRecord('idle', None, None, 3.0))
+        self.store.delete(3)
+        self.store.purge(2)
+        self.assertEqual([chat_id for chat_id in range(5) if self.store.load(chat_id)], [0, 2])
+
+        with self.subTest('Test tail keeps live sessions and deleted snapshot records only'):
+            self.assertEqual(self.store.tail, {0: SessionRecord('idle', None, None, 3.0), 3: None})
+            self.store.purge(4)
+            self.assertEqual(self.store.tail, {})
+            self.assertEqual([chat_id for chat_id in range(5) if self.store.load(chat_id)], [])
+            self.store.save(3, SessionRecord('idle', None, None, 5.0))
+
+        self.reopen()
+        self.assertEqual(self.store.count, 1)
+        self.assertEqual(self.store.load(3), SessionRecord('idle', None, None, 5.0))
+
+    def test_truncated_tail(self):
+        self.store.save(1, SessionRecord('idle', None, None, 1.0))
+        self.store.flush()
+        with open(self.path, 'ab') as f:
+            f.write(b'\x02\x00')
+        # Process crashed without compacting
+        BatchWriter.close(self.store)
+        os.close(self.store.fd)
+
+        self.store = SnapshotSessionStore(self.path)
+        self.store.save(2, SessionRecord('idle', None, None, 2.0))
+        self.reopen()
+        self.assertEqual([self.store.load(1), self.store.load(2)], [
+            SessionRecord('idle', None, None, 1.0), SessionRecord('idle', None, None, 2.0)])
+
+    def test_version_checked(self):
+        with open(self.path, 'r+b') as f:
+            f.seek(len(SnapshotSessionStore.MAGIC))
+            f.write(b'\x09\x00')
+        with self.assertRaises(ValueError):
+            SnapshotSessionStore(self.path)
@@ -0,0 +1,67 @@
+
+import unittest
+from unittest.mock import MagicMock as M
+from pizza_bot import metrics
+from pizza_bot.bot import PizzaBot
+from pizza_bot.sessions import SessionRegistry
+from pizza_bot.telegram_chat import TelegramDialog
+from telegram_bot import batch_handler, message_handler, purge_sessions, purge_shards
+
+
+def update(update_id, text, chat_id=5):
+    return M(update_id=update_id, message=M(chat_id=chat_id, text=text))
+
+
+class HandlersTestCase(unittest.TestCase):
+    """
+    Handlers skip updates their session has processed already
+    """
+    def setUp(self):
+        self.bot = M()
+        self.manager = M()
+        self.registry = SessionRegistry(PizzaBot(self.manager, shared_machine=True), lambda: TelegramDialog(self.bot))
+
+    def state(self):
+        dialog, is_new = self.registry.open(5)
+        return self.registry.pizza_bot.dialogs[dialog][0].state, dialog.update_id
+
+    def test_message_handler_replay(self):
+        for update_id, text in enumerate(('/start', 'большую', 'картой', 'да'), 1):
+            message_handler(self.registry, None, update(update_id, text))
+        sent = self.bot.send_message.call_count
+        replays = metrics.REPLAYS.total()
+
+        for update_id, text in ((4, 'да'), (2, 'маленькую')):
+            message_handler(self.registry, None, update(update_id, text))
+        self.assertEqual(self.manager.create_order.call_count, 1)
+        self.assertEqual(self.bot.send_message.call_count, sent)
+        self.assertEqual(metrics.REPLAYS.total() - replays, 2)
+        self.assertEqual(self.state(), ('idle', 4))
+
+    def test_batch_handler_replay(self):
+        batch_handler(self.registry, [update(1, '/start'), update(2, 'большую')])
+        replays = metrics.REPLAYS.total()
+
+        batch_handler(self.registry, [update(1, '/start'), update(2, 'большую'), update(3, 'картой')])
+        self.assertEqual(metrics.REPLAYS.total() - replays, 2)
+        self.assertEqual(self.state(), ('payment_picked', 3))
+
+        with self.subTest('Test whole batch delivered again'):
+            sent = self.bot.send_message.call_count
+            batch_handler(self.registry, [update(2, 'большую'), update(3, 'картой')])
+            self.assertEqual(self.bot.send_message.call_count, sent)
+            self.assertEqual(self.state(), ('payment_picked', 3))
+
+
+class PurgeTestCase(unittest.TestCase):
+    """
+    Shards purge their sessions, the store they share is purged once
+    """
+    def test_purge_shards(self):
+        executor, store = M(), M()
+        registries = [SessionRegistry(M(), M(), store=store) for _ in range(4)]
+        purge_shards(executor, registries, 100)
+        executor.broadcast.assert_called_once_with(purge_sessions, 100, False)
+        for registry in registries:
+            purge_sessions(registry, *executor.broadcast.call_args[0][1:])
+        store.purge.assert_called_once_with(100)
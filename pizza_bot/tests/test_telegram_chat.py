@@ -30,12 +30,27 @@ class TelegramDialogTestCase(unittest.TestCase):
                 self.dialog.send_message(message)
             self.assertEqual(cm.exception.args, ('No chat to send a message',))
 
-        with self.subTest('Test send_message passes message to bot'):
-            self.dialog.chat = chat = object()
+        with self.subTest('Test send_message buffers message'):
+            self.dialog.chat = object()
             self.dialog.send_message(message)
+            self.assertListEqual(self.dialog.outbox, [message])
+            self.assertListEqual(self.bot.method_calls, [])
+
+    def test_flush_messages(self):
+        self.dialog.chat = chat = object()
+        with self.subTest('Test nothing sent without messages'):
+            self.dialog.flush_messages()
+            self.assertListEqual(self.bot.method_calls, [])
+
+        with self.subTest('Test messages of the turn sent at once'):
+            for message in ('first', 'second'):
+                self.dialog.send_message(message)
+            self.dialog.flush_messages()
+            self.dialog.flush_messages()
             self.assertListEqual(self.bot.method_calls, [
-                call.send_message(chat, message)
+                call.send_message(chat, 'first\nsecond')
             ])
+            self.assertIsNone(self.dialog.outbox)
 
     def test_process_update(self):
         mocker = M()
@@ -87,6 +102,16 @@ class TelegramDialogTestCase(unittest.TestCase):
                         self.assertIs(chat, self.dialog.chat)
         time_patch.stop()
 
+    def test_is_replay(self):
+        self.assertFalse(self.dialog.is_replay(M(update_id=5)))
+        self.dialog.process_update(M(update_id=5, message=M(chat_id=1, text='да')))
+        self.assertEqual(self.dialog.update_id, 5)
+        self.assertEqual([self.dialog.is_replay(M(update_id=update_id)) for update_id in (4, 5, 6)],
+                         [True, True, False])
+
+    def test_slots(self):
+        self.assertFalse(hasattr(self.dialog, '__dict__'))
+
     def test_magic_str(self):
         d = self.dialog
         d.last_received = last_received = 'sdfhsreh'
@@ -0,0 +1,85 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock as M
+from pizza_bot import tracing
+from pizza_bot.bot import PizzaBot
+from pizza_bot.telegram_chat import TelegramDialog
+from pizza_bot.tracing import NullTracer, Tracer
+
+
+class TracerTestCase(unittest.TestCase):
+    """
+    Tracer writes spans to file in Chrome trace event format
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'trace.json')
+        self.tracer = Tracer(self.path)
+
+    def tearDown(self):
+        self.tracer.close()
+        self.directory.cleanup()
+
+    def read(self):
+        with open(self.path, encoding='utf-8') as f:
+            data = f.read()
+        # Array is left open for appending
+        return json.loads(data.rstrip(',\n') + ']')
+
+    def test_span(self):
+        with self.tracer.span('update', 42, update_id=7) as span:
+            span.set(state='idle')
+        with self.assertRaises(ValueError):
+            with self.tracer.span('parse'):
+                raise ValueError('bad')
+        self.tracer.close()
+
+        update, parse = self.read()
+        self.assertEqual(update['name'], 'update')
+        self.assertEqual(update['ph'], 'X')
+        self.assertEqual(update['tid'], 42)
+        self.assertEqual(update['args'], dict(update_id=7, state='idle', chat=42))
+        self.assertGreaterEqual(update['dur'], 0)
+        self.assertGreater(parse['ts'], update['ts'])
+        self.assertEqual(parse['args'], dict(error="ValueError('bad')"))
+
+    def test_appends_to_existing(self):
+        with self.tracer.span('a'):
+            pass
+        self.tracer.close()
+        self.tracer = Tracer(self.path)
+        with self.tracer.span('b'):
+            pass
+        self.tracer.close()
+
+        self.assertEqual([event['name'] for event in self.read()], ['a', 'b'])
+
+    def test_conversation_spans(self):
+        old_tracer = tracing.set_tracer(self.tracer)
+        try:
+            bot = PizzaBot(M(), shared_machine=True)
+            dialog = TelegramDialog(M())
+            dialog.chat = 5
+            bot.start_dialog(dialog)
+            bot.restore_dialog(dialog, 'payment_picked', 1, 0)
+            dialog.message = 'да'
+            bot.on_chat_input(dialog)
+        finally:
+            tracing.set_tracer(old_tracer)
+        self.tracer.close()
+
+        events = self.read()
+        self.assertEqual([event['name'] for event in events], ['create_order', 'transition', 'send_message'])
+        self.assertEqual({event['tid'] for event in events}, {5})
+        self.assertEqual(events[1]['args'], dict(state='payment_picked', chat=5))
+
+
+class NullTracerTestCase(unittest.TestCase):
+    def test_span(self):
+        tracer = NullTracer()
+        with tracer.span('update', 1, update_id=2) as span:
+            span.set(state='idle')
+        self.assertIs(tracer.span('other'), span)
+        self.assertIsInstance(tracing.tracer, NullTracer)
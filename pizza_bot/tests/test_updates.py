@@ -0,0 +1,94 @@
+import json
+import unittest
+import urllib.request
+from unittest.mock import MagicMock as M, patch
+import telegram
+from pizza_bot.telegram_chat import TelegramDialog
+from pizza_bot.dedup import UpdateWindow
+from pizza_bot.updates import LeanUpdate, WebhookServer, decode_update
+
+
+def encode(payload):
+    return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+
+def text_update(text='да', chat_id=5, update_id=7):
+    return dict(update_id=update_id, message=dict(
+        message_id=1, date=0, chat=dict(id=chat_id, type='private'), text=text))
+
+
+class DecodeUpdateTestCase(unittest.TestCase):
+    """
+    decode_update takes text messages lean, drops others, parses odd ones fully
+    """
+    def test_text_message(self):
+        update = decode_update(encode(text_update('Большую "пиццу"')))
+        self.assertIsInstance(update, LeanUpdate)
+        self.assertEqual((update.update_id, update.message.chat_id, update.message.text), (7, 5, 'Большую "пиццу"'))
+
+        dialog = TelegramDialog(None)
+        dialog.process_update(update)
+        self.assertEqual((dialog.chat, dialog.message), (5, 'Большую "пиццу"'))
+
+    def test_dropped_without_parsing(self):
+        payloads = {
+            'sticker': dict(update_id=1, message=dict(message_id=1, date=0, chat=dict(id=5), sticker=dict())),
+            'caption': dict(update_id=1, message=dict(message_id=1, date=0, chat=dict(id=5), caption='"text"')),
+        }
+        for name, payload in payloads.items():
+            with self.subTest('Test {} dropped'.format(name)), patch('pizza_bot.updates.json') as json_module:
+                self.assertIsNone(decode_update(encode(payload)))
+                self.assertFalse(json_module.loads.called)
+
+    def test_irrelevant_update(self):
+        payload = dict(update_id=1, edited_message=text_update()['message'])
+        self.assertIsNone(decode_update(encode(payload)))
+
+    def test_reply_without_text(self):
+        payload = dict(update_id=1, message=dict(
+            message_id=2, date=0, chat=dict(id=5, type='private'), photo=[],
+            reply_to_message=text_update()['message']))
+        self.assertIsNone(decode_update(encode(payload)))
+
+        payload['message']['text'] = None
+        self.assertIsNone(decode_update(encode(payload)))
+
+    def test_fallback(self):
+        payload = text_update()
+        payload['message']['chat']['id'] = '5'
+        update = decode_update(encode(payload))
+        self.assertIsInstance(update, telegram.Update)
+        self.assertEqual(update.message.chat_id, 5)
+
+
+class WebhookServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.handler = M()
+        self.server = WebhookServer(self.handler, '127.0.0.1', 0, '/TOKEN').start()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.stop()
+
+    def post(self, path, payload):
+        request = urllib.request.Request(self.url + path, data=encode(payload), method='POST')
+        with urllib.request.urlopen(request) as response:
+            return response.status
+
+    def test_updates_handled(self):
+        self.assertEqual(self.post('/TOKEN', text_update()), 200)
+        self.assertEqual(self.post('/TOKEN', dict(update_id=8)), 200)
+        update, = self.handler.call_args[0]
+        self.assertEqual(self.handler.call_count, 1)
+        self.assertEqual(update.update_id, 7)
+
+    def test_redelivery_dropped(self):
+        self.server.window = UpdateWindow()
+        for update_id in (7, 7, 8):
+            self.assertEqual(self.post('/TOKEN', text_update(update_id=update_id)), 200)
+        self.assertEqual([args[0].update_id for args, kwargs in self.handler.call_args_list], [7, 8])
+
+    def test_not_found(self):
+        with self.assertRaises(urllib.error.HTTPError):
+            self.post('/other', text_update())
+        self.assertFalse(self.handler.called)
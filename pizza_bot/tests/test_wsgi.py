@@ -0,0 +1,152 @@
+
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock as M, patch
+from pizza_bot.bot import PizzaBot
+from pizza_bot.metrics import Counter, Registry
+from pizza_bot.storage import SQLiteSessionStore, SessionRecord
+from pizza_bot.wsgi import WebhookApplication, WebhookDialog
+
+
+class WebhookDialogTestCase(unittest.TestCase):
+    def test_flush_messages(self):
+        dialog = WebhookDialog()
+        dialog.chat = 5
+        dialog.flush_messages()
+        for message in ('first', 'second'):
+            dialog.send_message(message)
+        dialog.flush_messages()
+        dialog.send_message('third')
+        dialog.flush_messages()
+        self.assertEqual(dialog.replies, ['first\nsecond', 'third'])
+
+
+class WebhookApplicationTestCase(unittest.TestCase):
+    """
+    WebhookApplication keeps sessions in the store and replies in response
+    """
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.store = SQLiteSessionStore(os.path.join(self.directory.name, 'sessions.db'))
+        self.manager = M()
+        self.pizza_bot = PizzaBot(self.manager, shared_machine=True)
+        self.app = WebhookApplication(self.pizza_bot, self.store, '/TOKEN', threshold=60)
+
+    def tearDown(self):
+        self.app.close()
+        self.directory.cleanup()
+
+    def request(self, payload, method='POST', path='/TOKEN', raw=False):
+        body = json.dumps(payload).encode('utf-8')
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': io.BytesIO(body),
+        }
+        start_response = M()
+        response = b''.join(self.app(environ, start_response))
+        status = start_response.call_args[0][0]
+        if raw:
+            return status, response.decode('utf-8')
+        return status, response and json.loads(response.decode('utf-8'))
+
+    def say(self, text, chat_id=5, update_id=1):
+        return self.request(dict(update_id=update_id, message=dict(
+            message_id=update_id, date=0, chat=dict(id=chat_id, type='private'), text=text)))
+
+    def test_not_found(self):
+        self.assertEqual(self.request({}, method='GET')[0], '404 Not Found')
+        self.assertEqual(self.request({}, path='/other')[0], '404 Not Found')
+
+    def test_metrics(self):
+        self.app.registry = Registry()
+        self.app.registry.register(Counter('c_total', 'Counter')).inc()
+        status, text = self.request({}, method='GET', path='/metrics', raw=True)
+        self.assertEqual((status, text), ('200 OK', self.app.registry.expose([('pid', os.getpid())])))
+        self.assertIn('c_total{{pid="{}"}} 1'.format(os.getpid()), text)
+        self.assertEqual(self.request({}, path='/metrics')[0], '404 Not Found')
+
+    def test_conversation(self):
+        messages = self.pizza_bot.messages
+        status, reply = self.say('/start')
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(reply, dict(
+            method='sendMessage', chat_id=5, text=messages['pick_size'] + '\n' + messages['pick_size']))
+
+        status, reply = self.say('большую', update_id=2)
+        self.assertEqual(reply['text'], messages['pick_payment'])
+        self.assertEqual(self.store.load(5).state, 'size_picked')
+
+        status, reply = self.say('картой', update_id=3)
+        record = self.store.load(5)
+        self.assertEqual(record, SessionRecord('payment_picked', 1, 1, record.last_received, 3, None, reply['text']))
+
+        status, reply = self.say('да', update_id=4)
+        self.assertEqual(reply['text'], messages['success'] + '\n' + messages['pick_size'])
+        self.assertEqual(self.manager.create_order.call_count, 1)
+        self.assertEqual(self.store.load(5).state, 'idle')
+
+        # Nothing is kept in process memory
+        self.assertEqual(self.pizza_bot.dialogs, {})
+
+    def test_update_processed_once(self):
+        for update_id, text in enumerate(('/start', 'большую', 'картой', 'да'), 1):
+            status, first = self.say(text, update_id=update_id)
+        self.assertEqual(self.manager.create_order.call_count, 1)
+
+        with self.subTest('Test redelivered update replied again by session'):
+            status, reply = self.say('да', update_id=4)
+            self.assertEqual((status, reply), ('200 OK', first))
+            self.assertEqual(self.manager.create_order.call_count, 1)
+            self.assertEqual(self.store.load(5).update_id, 4)
+
+        with self.subTest('Test older update skipped'):
+            status, reply = self.say('картой', update_id=3)
+            self.assertEqual((status, reply), ('200 OK', b''))
+
+        with self.subTest('Test redelivered update replied again by window'):
+            self.app.window = M()
+            self.app.window.seen.return_value = True
+            status, reply = self.say('нет', update_id=4)
+            self.assertEqual((status, reply), ('200 OK', first))
+            self.app.window.seen.assert_called_once_with(4)
+            self.assertEqual(self.manager.create_order.call_count, 1)
+
+        with self.subTest('Test update seen by window not processed'):
+            status, reply = self.say('большую', update_id=5)
+            self.assertEqual((status, reply), ('200 OK', b''))
+            self.assertEqual(self.store.load(5).state, 'idle')
+
+    def test_expired_session_restarted(self):
+        self.store.update(5, lambda record: SessionRecord('payment_picked', 1, 1, 0.0))
+        status, reply = self.say('да')
+        self.assertEqual(self.manager.create_order.call_count, 0)
+        self.assertEqual(self.store.load(5).state, 'idle')
+
+    def test_update_without_message(self):
+        status, reply = self.request(dict(update_id=1))
+        self.assertEqual((status, reply), ('200 OK', b''))
+
+    def test_failure_logged(self):
+        with patch('pizza_bot.wsgi.logging') as logging:
+            status, reply = self.request(['text'])
+        self.assertEqual((status, reply), ('200 OK', b''))
+        self.assertEqual(logging.exception.call_count, 1)
+
+    def test_update_without_text(self):
+        status, reply = self.request(dict(update_id=1, message=dict(
+            message_id=1, date=0, chat=dict(id=5, type='private'), sticker=dict(file_id='x'))))
+        self.assertEqual((status, reply), ('200 OK', b''))
+        self.assertIsNone(self.store.load(5))
+
+    def test_purge(self):
+        self.store.update(6, lambda record: SessionRecord('idle', None, None, 0.0))
+        self.app.purged = 0
+        self.say('/start')
+        self.store.flush()
+        self.assertIsNone(self.store.load(6))
+        self.assertIsNotNone(self.store.load(5))
@@ -0,0 +1,128 @@
+
+import json
+import os
+import queue
+import threading
+import time
+from pizza_bot.background import BatchWriter
+
+
+class NullSpan(object):
+    """Span of disabled tracer, does nothing"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+class NullTracer(object):
+    """Tracer used while tracing is off, spans cost one call"""
+    enabled = False
+    null_span = NullSpan()
+
+    def span(self, name, chat=None, **args):
+        return self.null_span
+
+    def close(self):
+        pass
+
+
+class Span(object):
+    """Timed phase of update processing"""
+    __slots__ = ('tracer', 'name', 'chat', 'args', 'started')
+
+    def __init__(self, tracer, name, chat, args):
+        self.tracer = tracer
+        self.name = name
+        self.chat = chat
+        self.args = args
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        finished = time.perf_counter()
+        if exc_type is not None:
+            self.args['error'] = repr(exc_value)
+        self.tracer.record(self, finished)
+        return False
+
+    def set(self, **args):
+        """Add arguments known once span has started"""
+        self.args.update(args)
+
+
+class Tracer(BatchWriter):
+    """
+    Spans written to file in Chrome trace event format by background thread,
+    open it with chrome://tracing or Perfetto.
+
+    Spans of a chat share one track, `chat` and `update_id` arguments
+    correlate them. Spans are dropped rather than delaying updates when
+    writer falls behind. Events are appended to JSON array that is never
+    closed, which trace viewers accept, so processes may share one file.
+    """
+    enabled = True
+
+    def __init__(self, path, max_queue=10000, max_batch=1000):
+        super(Tracer, self).__init__(max_queue=max_queue, max_batch=max_batch)
+        self.path = path
+        self.pid = os.getpid()
+        self.dropped = 0
+        # Spans are timed by perf_counter, shifted to wall clock time
+        self.origin = time.time() - time.perf_counter()
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        if not os.fstat(self.fd).st_size:
+            os.write(self.fd, b'[\n')
+        self.start()
+
+    def span(self, name, chat=None, **args):
+        return Span(self, name, chat, args)
+
+    def record(self, span, finished):
+        event = dict(
+            name=span.name,
+            cat='pizza_bot',
+            ph='X',
+            ts=round((self.origin + span.started) * 1e6, 1),
+            dur=round((finished - span.started) * 1e6, 1),
+            pid=self.pid,
+            tid=span.chat if span.chat is not None else threading.get_ident(),
+            args=span.args,
+        )
+        if span.chat is not None:
+            event['args']['chat'] = span.chat
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.dropped += 1
+
+    def write_batch(self, items):
+        data = ''.join(json.dumps(item, ensure_ascii=False, default=str) + ',\n' for item in items)
+        os.write(self.fd, data.encode('utf-8'))
+
+    def close(self):
+        """Write queued spans and close trace file"""
+        super(Tracer, self).close()
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+# Tracer in use, spans are taken as `tracing.tracer.span(...)`
+tracer = NullTracer()
+
+
+def set_tracer(new_tracer):
+    """Replace tracer in use, returns the previous one"""
+    global tracer
+    old_tracer, tracer = tracer, new_tracer
+    return old_tracer
@@ -0,0 +1,114 @@
+
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+
+class LeanMessage(object):
+    """Fields of telegram.Message used by the bot"""
+    __slots__ = ('chat_id', 'text')
+
+    def __init__(self, chat_id, text):
+        self.chat_id = chat_id
+        self.text = text
+
+
+class LeanUpdate(object):
+    """Fields of telegram.Update used by the bot, decoded without object graph"""
+    __slots__ = ('update_id', 'message')
+
+    def __init__(self, update_id, chat_id, text):
+        self.update_id = update_id
+        self.message = LeanMessage(chat_id, text)
+
+    def __repr__(self):
+        return 'LeanUpdate(update_id={}, chat_id={}, text={!r})'.format(
+            self.update_id, self.message.chat_id, self.message.text)
+
+
+def decode_update(data: bytes, bot=None):
+    """
+    Decode webhook payload, returns None for updates the bot doesn't handle.
+
+    Text messages are decoded to LeanUpdate. Payloads without text are
+    dropped before JSON is parsed, messages without text of their own, like
+    a photo replying to text message, once it is. Text messages of
+    unexpected shape are decoded to telegram.Update.
+    """
+    if b'"text"' not in data:
+        return None
+    payload = json.loads(data.decode('utf-8'))
+    message = payload.get('message')
+    if message is None:
+        # Edited messages, callback queries and others
+        return None
+    if isinstance(message, dict) and type(message.get('text')) is not str:
+        return None
+    try:
+        chat_id = message['chat']['id']
+        text = message['text']
+        update_id = payload['update_id']
+        if type(chat_id) is int and type(text) is str and type(update_id) is int:
+            return LeanUpdate(update_id, chat_id, text)
+    except (KeyError, TypeError):
+        pass
+    import telegram
+    return telegram.Update.de_json(payload, bot)
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length)
+        if self.path != self.server.path:
+            self.reply(404)
+            return
+        try:
+            update = decode_update(body, self.server.bot)
+            window = self.server.window
+            if update is None:
+                logging.debug('Skip update without text message')
+            elif window is not None and window.seen(update.update_id):
+                logging.debug('Skip update %s delivered again', update.update_id)
+            else:
+                self.server.handler(update)
+        except Exception as e:
+            logging.exception(e)
+        self.reply(200)
+
+    def reply(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class WebhookServer(ThreadingMixIn, HTTPServer):
+    """
+    Serves Telegram webhook, calls `handler(update)` with decoded updates
+    in request thread, so handler is expected to queue work and return.
+    Updates seen by UpdateWindow `window` are dropped when it is given.
+    """
+    daemon_threads = True
+
+    def __init__(self, handler, host, port, path, bot=None, window=None):
+        super(WebhookServer, self).__init__((host, port), WebhookRequestHandler)
+        self.handler = handler
+        self.path = path
+        self.bot = bot
+        self.window = window
+
+    def start(self):
+        """Serve requests in background thread"""
+        threading.Thread(target=self.serve_forever, name='Webhook', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
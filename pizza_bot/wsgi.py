@@ -0,0 +1,147 @@
+
+import json
+import logging
+import os
+import time
+from pizza_bot import metrics, tracing
+from pizza_bot.storage import SessionRecord
+from pizza_bot.telegram_chat import TelegramDialog
+from pizza_bot.updates import decode_update
+
+
+class WebhookDialog(TelegramDialog):
+    """
+    TelegramDialog collecting flushed messages to reply within webhook response
+    """
+    __slots__ = ('replies',)
+
+    def __init__(self, bot=None):
+        super(WebhookDialog, self).__init__(bot)
+        self.replies = []
+
+    def flush_messages(self):
+        """Keep messages of the turn for the response"""
+        if not self.outbox:
+            return
+        messages, self.outbox = self.outbox, None
+        self.replies.append('\n'.join(messages))
+
+
+class WebhookApplication(object):
+    """
+    WSGI application serving Telegram webhook, may run in many processes.
+
+    Sessions live only in the store shared by all processes: an update loads,
+    advances and saves its chat session holding the store lock of its chat,
+    so any process can handle any chat while other chats go on in parallel.
+    Reply goes back in the webhook response, no Bot API request is made
+    while session is locked.
+
+    Updates are processed once per session: one delivered again after its
+    turn was saved is told by update id saved with the session, as well as
+    by UpdateWindow `window` of this process when it is given. Telegram
+    delivers an update again when webhook response was slow or lost, so
+    the reply saved with the session is sent again in the response.
+
+    `GET /metrics` serves metrics of the worker process answering it, they
+    are not shared between processes. Samples carry `pid` label of the worker
+    so series of different workers are kept apart rather than mixed into one
+    jumping back and forth, sum them over `pid` for totals. A scrape reaches
+    one worker, each worker is up to date as of the last scrape it answered.
+    """
+    def __init__(self, pizza_bot, store, path, threshold, purge_interval=60, window=None, registry=metrics.REGISTRY):
+        self.pizza_bot = pizza_bot
+        self.registry = registry
+        self.window = window
+        self.store = store
+        self.path = path
+        self.threshold = threshold
+        self.purge_interval = purge_interval
+        self.purged = time.time()
+
+    def __call__(self, environ, start_response):
+        if environ['REQUEST_METHOD'] == 'GET' and environ.get('PATH_INFO') == '/metrics':
+            return self.serve_metrics(start_response)
+        if environ['REQUEST_METHOD'] != 'POST' or environ.get('PATH_INFO') != self.path:
+            start_response('404 Not Found', [('Content-Length', '0')])
+            return [b'']
+
+        body = b''
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+            data = environ['wsgi.input'].read(length)
+            with tracing.tracer.span('parse'):
+                update = decode_update(data)
+            if update is not None:
+                body = self.handle(update, self.window is not None and self.window.seen(update.update_id))
+        except Exception as e:
+            logging.exception(e)
+
+        headers = [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))]
+        start_response('200 OK', headers)
+        return [body]
+
+    def serve_metrics(self, start_response):
+        """Metrics in Prometheus text format"""
+        body = self.registry.expose([('pid', os.getpid())]).encode('utf-8')
+        start_response('200 OK', [
+            ('Content-Type', 'text/plain; version=0.0.4; charset=utf-8'), ('Content-Length', str(len(body)))])
+        return [body]
+
+    def handle(self, update: 'telegram.Update', replayed=False):
+        """Process update, or reply again to one replayed, returns response body with reply"""
+        if update.message is None:
+            logging.debug('Skip update without message')
+            return b''
+
+        chat_id = update.message.chat_id
+        dialog = WebhookDialog()
+        with tracing.tracer.span('update', chat_id, update_id=update.update_id):
+            self.store.update(chat_id, lambda record: self.advance(dialog, update, record, replayed))
+            self.purge()
+
+        if not dialog.replies:
+            return b''
+        reply = dict(method='sendMessage', chat_id=chat_id, text='\n'.join(dialog.replies))
+        return json.dumps(reply, ensure_ascii=False).encode('utf-8')
+
+    def advance(self, dialog, update, record, replayed=False):
+        """Run conversation turn for saved session, returns record to save"""
+        if record is not None and record.last_received < time.time() - self.threshold:
+            record = None
+        if replayed or record is not None and record.update_id is not None and update.update_id <= record.update_id:
+            # Delivered again as response with the reply was lost, window counted it already
+            if not replayed:
+                metrics.REPLAYS.inc()
+            logging.debug('Skip update %s processed already', update.update_id)
+            if record is not None and record.update_id == update.update_id and record.reply is not None:
+                dialog.replies.append(record.reply)
+            return record
+        if record is not None:
+            self.pizza_bot.restore_dialog(
+                dialog, record.state, record.pizza_size, record.payment_method, record.flow_version)
+        with tracing.tracer.span('process_update', update.message.chat_id):
+            dialog.process_update(update)
+
+        try:
+            if record is None:
+                self.pizza_bot.on_chat_start(dialog)
+            self.pizza_bot.on_chat_input(dialog)
+            order, machine = self.pizza_bot.dialogs[dialog]
+            return SessionRecord(
+                order.state, order.pizza_size, order.payment_method, dialog.last_received, dialog.update_id,
+                getattr(order, 'flow_version', None), '\n'.join(dialog.replies) or None)
+        finally:
+            if dialog in self.pizza_bot.dialogs:
+                self.pizza_bot.on_chat_exit(dialog)
+
+    def purge(self):
+        """Drop expired sessions from the store once in a while"""
+        now = time.time()
+        if now - self.purged < self.purge_interval:
+            return
+        self.purged = now
+        self.store.purge(now - self.threshold)
+
+    def close(self):
+        self.store.close()
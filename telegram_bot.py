@@ -7,60 +7,183 @@ This program is dedicated to the public domain under the CC0 license.
 """
 import os
 import logging
+import signal
+import threading
 import time
 from functools import partial
 
-import telegram
-import telegram.ext
-from telegram.utils.request import Request
+from pizza_bot import metrics, tracing
 from pizza_bot.telegram_chat import TelegramDialog
-from pizza_bot.console_chat import ConsoleTransactionManager
+from pizza_bot.ratelimit import RateLimiter
+from pizza_bot.outbox import Outbox
+from pizza_bot.polling import LongPoller, group_by_chat
+from pizza_bot.recording import Recorder, record_updates
+from pizza_bot.journal import JournalTransactionManager
 from pizza_bot.bot import PizzaBot
+from pizza_bot.dedup import UpdateWindow
+from pizza_bot.flow import FlowBot
+from pizza_bot.sessions import SessionRegistry
+from pizza_bot.sharding import ShardedExecutor
+from pizza_bot.storage import SQLiteSessionStore, SnapshotSessionStore
+# telegram, asyncio and modules using them are imported by entry points
+# needing them, so that each mode starts without loading the others
 
 
-def gc_callback(bot: telegram.Bot, job: telegram.ext.Job):
+# Url to access bot: https://t.me/pizza_3468_bot
+
+# Settings used by bot:
+# Bot token
+TOKEN = '453704416:AAEhuUw0XiMa4QM7u8OLaNTqvO65Fs9djUk'
+# Webhook address, token is appended
+WEBHOOK_URL = 'https://pizza-bot-3468.herokuapp.com/'
+# gc_callback job settings
+THRESHOLD = 30 * 60  # 30min in seconds, threshold for last message in chat
+INTERVAL = 5 * 60 # 5min in seconds, checks interval
+# getUpdates long polling timeout in seconds
+POLL_TIMEOUT = 30
+# Bot API address, local Bot API server or fake one can be set by BOT_API_URL
+BOT_API_URL = 'https://api.telegram.org'
+
+
+def gc_callback(bot: 'telegram.Bot', job: 'telegram.ext.Job'):
     """Purge old dialogs"""
     logging.debug('Purging old dialogs')
     timestamp = time.time() - job.context['threshold']
-    dispatcher = job.context['dispatcher']
-    for chat_data in dispatcher.chat_data.values():
-        dialog = chat_data.get('dialog', None)
-        if dialog is None or dialog.last_received is None or dialog.last_received >= timestamp:
-            continue
-        logging.debug('Purging dialog {}'.format(dialog))
-        del chat_data['dialog']
+    purge_shards(job.context['executor'], job.context['registries'], timestamp)
+
+
+def purge_shards(executor: ShardedExecutor, registries: list, timestamp: float):
+    """Purge dialogs of every shard, and the store they share once"""
+    executor.broadcast(purge_sessions, timestamp, False)
+    store = registries[0].store
+    if store is not None:
+        store.purge(timestamp)
+
+
+def purge_sessions(registry: SessionRegistry, timestamp: float, purge_store=True):
+    """Purge dialogs of one registry"""
+    purged = registry.purge(timestamp, purge_store)
+    metrics.PURGES.inc()
+    metrics.PURGED.inc(amount=purged)
+    logging.debug('Purged {} dialogs, {} left'.format(purged, len(registry)))
+
 
+def dispatch_update(executor: ShardedExecutor, bot: 'telegram.Bot', update: 'telegram.Update', handler=None):
+    """Pass update to the shard owning its chat, message_handler by default"""
+    if update.message is None:
+        logging.debug('Skip update without message')
+        return
+    executor.submit(update.message.chat_id, handler or message_handler, bot, update)
 
-def message_handler(pizza_bot: PizzaBot, bot: telegram.Bot, update: telegram.Update, chat_data: dict):
+
+def message_handler(registry: SessionRegistry, bot: 'telegram.Bot', update: 'telegram.Update'):
     """Handle incoming messages"""
-    logging.debug('Update processing {}'.format(update))
-    is_chat_start = False
-    if 'dialog' not in chat_data:
-        chat_data['dialog'] = TelegramDialog(bot)
-        is_chat_start = True
+    logging.debug('Update processing %s', update)
+    if update.message is None:
+        logging.debug('Skip update without message')
+        return
 
-    dialog = chat_data['dialog']
-    dialog.process_update(update)
+    chat_id = update.message.chat_id
+    tracer = tracing.tracer
+    with tracer.span('update', chat_id, update_id=update.update_id):
+        with tracer.span('open_session', chat_id):
+            dialog, is_chat_start = registry.open(chat_id)
+        if dialog.is_replay(update):
+            skip_replay(update)
+            return
+        with tracer.span('process_update', chat_id):
+            dialog.process_update(update)
 
-    if is_chat_start:
-        pizza_bot.on_chat_start(dialog)
-    pizza_bot.on_chat_input(dialog)
+        pizza_bot = registry.pizza_bot
+        if is_chat_start:
+            pizza_bot.on_chat_start(dialog)
+        pizza_bot.on_chat_input(dialog)
+        with tracer.span('save_session', chat_id):
+            registry.save(chat_id, dialog)
 
 
-def main():
-    """Run the bot."""
+def skip_replay(update):
+    """Drop update processed in its session already, delivered again after restart"""
+    metrics.REPLAYS.inc()
+    logging.debug('Skip update %s processed already', update.update_id)
+
+
+def dispatch_batch(executor: ShardedExecutor, updates: list, handler=None):
+    """Pass polled updates to shards chat by chat, returns once all are handled"""
+    for chat_id, chat_updates in group_by_chat(updates).items():
+        executor.submit(chat_id, handler or batch_handler, chat_updates)
+    executor.join()
+
+
+def batch_handler(registry: SessionRegistry, updates: list):
+    """Handle polled updates of one chat, session is opened and saved once"""
+    chat_id = updates[0].message.chat_id
+    tracer = tracing.tracer
+    with tracer.span('open_session', chat_id):
+        dialog, is_chat_start = registry.open(chat_id)
+
+    pizza_bot = registry.pizza_bot
+    for update in updates:
+        if dialog.is_replay(update):
+            skip_replay(update)
+            continue
+        try:
+            with tracer.span('update', chat_id, update_id=update.update_id):
+                with tracer.span('process_update', chat_id):
+                    dialog.process_update(update)
+                if is_chat_start:
+                    is_chat_start = False
+                    pizza_bot.on_chat_start(dialog)
+                pizza_bot.on_chat_input(dialog)
+        except Exception as e:
+            logging.exception(e)
 
-    # Url to access bot: https://t.me/pizza_3468_bot
+    with tracer.span('save_session', chat_id):
+        registry.save(chat_id, dialog)
 
-    # Settings used by bot:
-    # Bot token
-    token = '453704416:AAEhuUw0XiMa4QM7u8OLaNTqvO65Fs9djUk'
-    # gc_callback job settings
-    threshold = 30 * 60  # 30min in seconds, threshold for last message in chat
-    interval = 5 * 60 # 5min in seconds, checks interval
 
+async def async_message_handler(registry: SessionRegistry, locks: 'ChatLocks', update: 'telegram.Update'):
+    """Handle incoming messages on asyncio engine"""
+    logging.debug('Update processing %s', update)
+    if update.message is None:
+        logging.debug('Skip update without message')
+        return
 
-    # Set logging format
+    # Updates of one chat are processed in order they came
+    chat_id = update.message.chat_id
+    tracer = tracing.tracer
+    with tracer.span('update', chat_id, update_id=update.update_id):
+        with tracer.span('wait_chat', chat_id):
+            await locks.acquire(chat_id)
+        try:
+            with tracer.span('open_session', chat_id):
+                dialog, is_chat_start = registry.open(chat_id)
+            if dialog.is_replay(update):
+                skip_replay(update)
+                return
+            with tracer.span('process_update', chat_id):
+                dialog.process_update(update)
+
+            pizza_bot = registry.pizza_bot
+            if is_chat_start:
+                await pizza_bot.on_chat_start(dialog)
+            await pizza_bot.on_chat_input(dialog)
+            with tracer.span('save_session', chat_id):
+                registry.save(chat_id, dialog)
+        finally:
+            locks.release(chat_id)
+
+
+async def purge_periodically(registry: SessionRegistry):
+    """Purge old dialogs every INTERVAL seconds"""
+    import asyncio
+    while True:
+        await asyncio.sleep(INTERVAL)
+        purge_sessions(registry, time.time() - THRESHOLD)
+
+
+def setup_logging():
+    """Set logging format"""
     log_level = os.environ.get('LOGLEVEL', None)
     logging.basicConfig(
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -68,32 +191,298 @@ def main():
     if log_level is not None:
         logging.getLogger('telegram.utils.webhookhandler').setLevel(int(log_level))
 
+
+def setup_tracing():
+    """Record update processing spans to TRACE_FILE when it is set"""
+    trace_file = os.environ.get('TRACE_FILE', None)
+    if trace_file:
+        tracing.set_tracer(tracing.Tracer(trace_file))
+
+
+def setup_recording(handler):
+    """
+    Record updates passed to handler to RECORD_FILE when it is set, replay
+    them with benchmarks/replay.py. Returns handler to use and recorder.
+    """
+    record_file = os.environ.get('RECORD_FILE', None)
+    if not record_file:
+        return handler, None
+    recorder = Recorder(record_file)
+    return record_updates(recorder, handler), recorder
+
+
+def start_metrics(registries, port):
+    """Serve metrics on METRICS_PORT, next to webhook port by default"""
+    metrics.SESSIONS.set_function(lambda: sum(len(registry) for registry in registries))
+    # METRICS_PORT=0 disables the endpoint
+    metrics_port = int(os.environ.get('METRICS_PORT', port + 1))
+    if metrics_port:
+        metrics.start_http_server(metrics_port)
+
+
+def bot_api_url():
+    """Bot API address from BOT_API_URL, Telegram by default"""
+    return os.environ.get('BOT_API_URL', BOT_API_URL)
+
+
+def create_pizza_bot(manager, asynchronous=False):
+    """
+    Bot running conversation flow from FLOW_FILE when it is set, built-in PizzaBot otherwise.
+    Asynchronous bot awaits dialogs and manager, for asyncio mode.
+    """
+    flow_file = os.environ.get('FLOW_FILE', None)
+    if asynchronous:
+        from pizza_bot.aio_bot import AsyncFlowBot, AsyncPizzaBot
+        if flow_file:
+            return AsyncFlowBot(manager, flow_file)
+        return AsyncPizzaBot(manager, shared_machine=True)
+    if flow_file:
+        return FlowBot(manager, flow_file)
+    return PizzaBot(manager, shared_machine=True)
+
+
+def reload_flow(pizza_bot):
+    """Load changed flow file on SIGHUP, orders in progress finish on the old flow"""
+    if not isinstance(pizza_bot, FlowBot):
+        return
+    try:
+        if pizza_bot.reload():
+            logging.info('Loaded flow version {}'.format(pizza_bot.flow.version))
+    except Exception as e:
+        logging.exception(e)
+
+
+def create_registries(pizza_bot, dialog_factory, count=1):
+    """
+    Create session registries configured from environment, sharing one store.
+    Returns list of registries and the store.
+    """
+    # Hard cap on live sessions, least recently used are dropped first
+    max_sessions = os.environ.get('MAX_SESSIONS', None)
+    # Database file to keep sessions across restarts, must be on persistent disk
+    sessions_db = os.environ.get('SESSIONS_DB', None)
+    # Binary snapshot file instead, for single process: opens at once for any
+    # number of sessions and is compacted on shutdown
+    sessions_snapshot = os.environ.get('SESSIONS_SNAPSHOT', None)
+
+    if sessions_snapshot:
+        store = SnapshotSessionStore(sessions_snapshot)
+    else:
+        store = sessions_db and SQLiteSessionStore(sessions_db)
+    registries = [
+        SessionRegistry(
+            pizza_bot,
+            dialog_factory=dialog_factory,
+            max_sessions=max_sessions and max(1, int(max_sessions) // count),
+            store=store,
+            threshold=THRESHOLD)
+        for _ in range(count)
+    ]
+    return registries, store
+
+
+def create_sharded_engine(base_url=None, limiter=None):
+    """
+    Create sessions sharded across worker threads, replies delivered by outbox
+    to Bot API at base_url, paced by limiter, Telegram limits by default.
+    Base url is the one telegram.Bot takes, BOT_API_URL by default.
+    Returns executor, registries and function shutting everything down.
+    """
+    import telegram
+    from telegram.utils.request import Request
+
+    # Journal file confirmed orders are appended to
+    orders_journal = os.environ.get('ORDERS_JOURNAL', 'orders.jsonl')
+
+    # Number of worker threads chats are spread across
+    shards = int(os.environ.get('SHARDS', os.cpu_count()))
+
+    # Replies are queued and delivered by sender threads over own connections,
+    # paced to stay within Bot API limits
+    senders = int(os.environ.get('SENDERS', '8'))
+    base_url = base_url or bot_api_url() + '/bot'
+    limiter = (limiter or RateLimiter()).start()
+    outbox = Outbox(telegram.Bot(TOKEN, base_url=base_url, request=Request(con_pool_size=senders)), limiter, senders)
+
+    # Create pizza bot, sessions of each shard are owned by its thread
+    manager = JournalTransactionManager(orders_journal)
+    pizza_bot = create_pizza_bot(manager)
+    registries, store = create_registries(pizza_bot, partial(TelegramDialog, outbox), shards)
+    executor = ShardedExecutor(registries)
+
+    def shutdown():
+        executor.stop()
+        outbox.close()
+        limiter.stop()
+        manager.close()
+        tracing.tracer.close()
+        if store:
+            store.close()
+
+    return executor, registries, shutdown
+
+
+def main():
+    """Run the bot."""
+    import telegram
+    import telegram.ext
+    from telegram.utils.request import Request
+    from pizza_bot.updates import WebhookServer
+    setup_logging()
+    setup_tracing()
+
     # Telegram Bot Authorization Token
     cpus = os.cpu_count()
     request = Request(con_pool_size=cpus+4)
-    bot = telegram.Bot(token, request=request)
+    bot = telegram.Bot(TOKEN, base_url=bot_api_url() + '/bot', request=request)
     updater = telegram.ext.Updater(bot=bot, workers=cpus)
+    executor, registries, shutdown = create_sharded_engine()
 
     # Add repeating job to get rid of old chats
-    context = dict(threshold=threshold, dispatcher=updater.dispatcher)
-    job = updater.job_queue.run_repeating(callback=gc_callback, interval=interval, context=context)
+    context = dict(threshold=THRESHOLD, executor=executor, registries=registries)
+    job = updater.job_queue.run_repeating(callback=gc_callback, interval=INTERVAL, context=context)
+
+    # Webhook updates are decoded lean and passed to shards from request threads
+    port = int(os.environ.get('PORT', '8443'))
+    start_metrics(registries, port)
+    handler, recorder = setup_recording(message_handler)
+    dispatch = partial(dispatch_update, executor, bot, handler=handler)
+    server = WebhookServer(dispatch, '0.0.0.0', port, '/' + TOKEN, bot, UpdateWindow()).start()
+    updater.job_queue.start()
+    bot.set_webhook(WEBHOOK_URL + TOKEN)
+
+    stopped = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: stopped.set())
+    signal.signal(signal.SIGHUP, lambda *args: reload_flow(registries[0].pizza_bot))
+    stopped.wait()
 
-    # Create pizza bot machine
-    manager = ConsoleTransactionManager()
-    pizza_bot = PizzaBot(manager)
+    server.stop()
+    updater.job_queue.stop()
+    shutdown()
+    if recorder:
+        recorder.close()
 
-    # Add handler to process updates aka incoming messages
-    handler = telegram.ext.MessageHandler(
-        filters=telegram.ext.Filters.all,
-        callback=partial(message_handler, pizza_bot),
-        pass_chat_data=True)
-    updater.dispatcher.add_handler(handler)
+
+def polling_main():
+    """Run the bot fetching updates by long polling, no webhook needed."""
+    import telegram
+    from telegram.utils.request import Request
+    setup_logging()
+    setup_tracing()
+
+    # Long poll request is held by server up to POLL_TIMEOUT
+    bot = telegram.Bot(
+        TOKEN, base_url=bot_api_url() + '/bot', request=Request(con_pool_size=4, read_timeout=POLL_TIMEOUT + 10))
+    executor, registries, shutdown = create_sharded_engine()
+    start_metrics(registries, int(os.environ.get('PORT', '8443')))
+
+    # Batch size, Bot API returns at most 100 updates per request
+    limit = int(os.environ.get('POLL_LIMIT', '100'))
+    handler, recorder = setup_recording(batch_handler)
+    poller = LongPoller(
+        bot, partial(dispatch_batch, executor, handler=handler), limit=limit, timeout=POLL_TIMEOUT, window=UpdateWindow())
+    purge_due = time.time() + INTERVAL
+
+    def purge_when_due():
+        nonlocal purge_due
+        if time.time() >= purge_due:
+            purge_due = time.time() + INTERVAL
+            purge_shards(executor, registries, time.time() - THRESHOLD)
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *args: poller.stop())
+    signal.signal(signal.SIGHUP, lambda *args: reload_flow(registries[0].pizza_bot))
+    # Updates are not delivered by getUpdates while webhook is set
+    bot.delete_webhook()
+    poller.run(idle=purge_when_due)
+    shutdown()
+    if recorder:
+        recorder.close()
+
+
+def async_main():
+    """Run the bot on asyncio event loop, single thread for all conversations."""
+    import asyncio
+    from pizza_bot.aio_telegram import AsyncBotApi, AsyncTelegramDialog, ChatLocks, UpdateTasks, start_webhook
+    from pizza_bot.journal import AsyncJournalTransactionManager
+    from pizza_bot.ratelimit import AsyncRateLimitedBotApi
+    setup_logging()
+    setup_tracing()
+    orders_journal = os.environ.get('ORDERS_JOURNAL', 'orders.jsonl')
+    loop = asyncio.get_event_loop()
+
+    api = AsyncBotApi(TOKEN, bot_api_url())
+    limiter = RateLimiter().start()
+    manager = AsyncJournalTransactionManager(orders_journal)
+    pizza_bot = create_pizza_bot(manager, asynchronous=True)
+    dialog_factory = partial(AsyncTelegramDialog, AsyncRateLimitedBotApi(api, limiter))
+    (registry,), store = create_registries(pizza_bot, dialog_factory)
 
     port = int(os.environ.get('PORT', '8443'))
-    updater.start_webhook(listen='0.0.0.0', port=port, url_path=token)
-    updater.bot.set_webhook('https://pizza-bot-3468.herokuapp.com/'+token)
-    updater.idle()
+    start_metrics([registry], port)
+    handler, recorder = setup_recording(async_message_handler)
+    handler = partial(handler, registry, ChatLocks())
+    tasks = UpdateTasks()
+    server = loop.run_until_complete(start_webhook(handler, '0.0.0.0', port, '/' + TOKEN, UpdateWindow(), tasks))
+    loop.run_until_complete(api.set_webhook(WEBHOOK_URL + TOKEN))
+    gc_task = loop.create_task(purge_periodically(registry))
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, loop.stop)
+    loop.add_signal_handler(signal.SIGHUP, reload_flow, pizza_bot)
+    loop.run_forever()
+
+    gc_task.cancel()
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+    # Updates answered already are processed to the end
+    loop.run_until_complete(tasks.join())
+    api.close()
+    limiter.stop()
+    manager.close()
+    tracing.tracer.close()
+    if store:
+        store.close()
+    if recorder:
+        recorder.close()
+
+
+def set_webhook():
+    """Point Telegram to the webhook"""
+    import telegram
+    telegram.Bot(TOKEN, base_url=bot_api_url() + '/bot').set_webhook(WEBHOOK_URL + TOKEN)
+
+
+def create_application():
+    """Create WSGI webhook application for pre-fork servers, see gunicorn_config.py"""
+    from pizza_bot.wsgi import WebhookApplication
+    setup_logging()
+    setup_tracing()
+    orders_journal = os.environ.get('ORDERS_JOURNAL', 'orders.jsonl')
+    # All worker processes share sessions through this database
+    sessions_db = os.environ.get('SESSIONS_DB', 'sessions.db')
+
+    manager = JournalTransactionManager(orders_journal)
+    pizza_bot = create_pizza_bot(manager)
+    store = SQLiteSessionStore(sessions_db)
+    return WebhookApplication(pizza_bot, store, '/' + TOKEN, THRESHOLD, window=UpdateWindow())
+
+
+def close_application(application: 'WebhookApplication'):
+    """Write pending orders and sessions of WSGI application"""
+    application.close()
+    application.pizza_bot.manager.close()
+    tracing.tracer.close()
 
 
 if __name__ == '__main__':
-    main()
+    # BOT_MODE=asyncio selects asyncio engine, BOT_MODE=polling long polling
+    # instead of webhook, thread pool based webhook otherwise
+    bot_mode = os.environ.get('BOT_MODE')
+    if bot_mode == 'asyncio':
+        async_main()
+    elif bot_mode == 'polling':
+        polling_main()
+    else:
+        main()
@@ -0,0 +1,5 @@
+"""WSGI entry point, run with: gunicorn -c gunicorn_config.py wsgi:application"""
+from telegram_bot import create_application
+
+
+application = create_application()